@@ -0,0 +1,57 @@
+from fastapi import Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from . import models, versioning, tables
+from .database import get_async_db
+
+_cached: dict[str, tuple[int, int | None]] = {}  # table -> (active scope version, session id)
+_tables: dict[int, str] = {}  # session id -> table; sessions never move between tables
+_tables_epoch = 0
+
+async def get_active_session_id(db: AsyncSession, table: str = tables.DEFAULT) -> int | None:
+    """A table's active session id, cached until a session create/load/delete there bumps its "active" version."""
+    scope = versioning.active_scope(table)
+    current = await versioning.current(scope)
+    cached = _cached.get(table)
+    if cached is None or cached[0] != current:
+        version, session_id = await versioning.read_with(db, scope, select(models.Session.id).where(
+            models.Session.table_key == table, models.Session.is_active == True))
+        if version != current:
+            # The request's snapshot is behind the latest commit (or ahead, with its own uncommitted change)
+            return session_id
+        cached = _cached[table] = (version, session_id)
+    return cached[1]
+
+def invalidate(db: Session, table: str):
+    versioning.bump(db, versioning.active_scope(table))
+
+def session_table(db: Session, session_id: int | None) -> str | None:
+    """The table a session belongs to (None if there is no such session). Rows without a session are the
+    default table's."""
+    global _tables_epoch
+    if session_id is None:
+        return tables.DEFAULT
+    # Dropped with the version cache, so a session deleted by another worker isn't taken for existing
+    if (epoch := versioning.revalidate()) != _tables_epoch:
+        _tables.clear()
+        _tables_epoch = epoch
+    if session_id not in _tables:
+        table = db.scalar(select(models.Session.table_key).where(models.Session.id == session_id))
+        if table is None:
+            return None
+        _tables[session_id] = table
+    return _tables[session_id]
+
+async def require_table(db: AsyncSession, session_id: int | None, table: str):
+    """404 for sessions (and players and rounds in them) of another table."""
+    if await db.run_sync(session_table, session_id) != table:
+        raise HTTPException(404, "Session not found" if session_id else "No active session at this table")
+
+async def current_session_id(session_id: int | None = None, table: str = Depends(tables.current_table),
+                             db: AsyncSession = Depends(get_async_db)) -> int | None:
+    """Session scope of a request: an explicit ?session_id= wins, otherwise the table's active session."""
+    if session_id is None:
+        session_id = await get_active_session_id(db, table)
+    await require_table(db, session_id, table)
+    return session_id
@@ -0,0 +1,118 @@
+"""Admin code storage and verification.
+
+The code is stored as a salted PBKDF2 hash. After a successful check the
+accepted code is remembered as a keyed HMAC, so later checks with the same code
+skip the slow hash; the cache follows the "admin" version scope and is dropped
+whenever the code changes. Every attempt takes a token from a per-client bucket
+before hashing, and a successful one gives it back.
+"""
+import hashlib
+import hmac
+import os
+import time
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from . import models, versioning
+
+ADMIN = "admin"
+DEFAULT_CODE = "8888"
+SCHEME = "pbkdf2_sha256"
+ITERATIONS = 200_000
+
+_process_key = os.urandom(32)
+_cached: tuple[int, str, bytes | None] | None = None  # (admin scope version, stored hash, HMAC of last accepted code)
+_default_hash: str | None = None  # DEFAULT_CODE hashed once per process, until a code is set
+
+def hash_code(code: str, salt: bytes | None = None, iterations: int = ITERATIONS) -> str:
+    salt = salt or os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", code.encode(), salt, iterations)
+    return f"{SCHEME}${iterations}${salt.hex()}${digest.hex()}"
+
+def is_hashed(value: str) -> bool:
+    return value.startswith(SCHEME + "$")
+
+def matches(code: str, stored: str) -> bool:
+    """Constant-time check of a code against a stored hash (or a legacy plaintext value)."""
+    if not is_hashed(stored):
+        return hmac.compare_digest(code.encode(), stored.encode())
+    _, iterations, salt, digest = stored.split("$")
+    return hmac.compare_digest(hash_code(code, bytes.fromhex(salt), int(iterations)), stored)
+
+def _fast(code: str) -> bytes:
+    return hmac.new(_process_key, code.encode(), hashlib.sha256).digest()
+
+async def _default() -> str:
+    global _default_hash
+    if _default_hash is None:
+        _default_hash = await run_in_threadpool(hash_code, DEFAULT_CODE)
+    return _default_hash
+
+async def _stored(db: AsyncSession) -> tuple[int, str, bytes | None]:
+    global _cached
+    current = await versioning.current(ADMIN)
+    if _cached is None or _cached[0] != current:
+        version, value = await versioning.read_with(db, ADMIN, select(models.Setting.value).where(
+            models.Setting.key == "admin_code"))
+        stored = (version, value or await _default(), None)
+        if version != current:
+            return stored
+        _cached = stored
+    return _cached
+
+async def check(db: AsyncSession, code: str) -> bool:
+    global _cached
+    version, stored, accepted = await _stored(db)
+    fast = _fast(code)
+    if accepted is not None:
+        return hmac.compare_digest(fast, accepted)
+    if not await run_in_threadpool(matches, code, stored):
+        return False
+    if _cached and _cached[0] == version:
+        _cached = (version, stored, fast)
+    return True
+
+async def change(db: AsyncSession, new_code: str):
+    value = await run_in_threadpool(hash_code, new_code)
+    setting = await db.get(models.Setting, "admin_code")
+    if setting:
+        setting.value = value
+    else:
+        db.add(models.Setting(key="admin_code", value=value))
+    await db.run_sync(versioning.bump, ADMIN)
+
+class FailureLimiter:
+    """Per-client token bucket: every attempt takes a token before the code is hashed, a success hands it back.
+
+    Taking the token up front means concurrent attempts can't all pass the check before any failure is
+    counted, so the hashing work per client stays bounded.
+    """
+
+    def __init__(self, capacity: int = 5, refill_seconds: float = 30, max_clients: int = 10_000):
+        self.capacity = capacity
+        self.refill_seconds = refill_seconds
+        self.max_clients = max_clients
+        self._buckets: dict[str, tuple[float, float]] = {}  # client -> (tokens, updated)
+
+    def _tokens(self, client: str, now: float) -> float:
+        tokens, updated = self._buckets.get(client, (self.capacity, now))
+        return min(self.capacity, tokens + (now - updated) / self.refill_seconds)
+
+    def take(self, client: str):
+        """Take a token for an attempt; raise 429 while the client has none left."""
+        now = time.monotonic()
+        tokens = self._tokens(client, now)
+        if tokens < 1:
+            retry = int(self.refill_seconds * (1 - tokens)) + 1
+            raise HTTPException(429, "Too many failed attempts", headers={"Retry-After": str(retry)})
+        if len(self._buckets) >= self.max_clients and client not in self._buckets:
+            # Forget clients whose buckets have refilled completely
+            self._buckets = {c: b for c, b in self._buckets.items() if self._tokens(c, now) < self.capacity}
+        self._buckets[client] = (tokens - 1, now)
+
+    def succeed(self, client: str):
+        """Hand back the attempt's token, and forget earlier failures."""
+        self._buckets.pop(client, None)
+
+limiter = FailureLimiter()
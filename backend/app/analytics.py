@@ -0,0 +1,108 @@
+"""Cross-session analytics, computed from the player_totals/session_totals rollups.
+
+Every query here reads one row per (session, player) or per session, never
+round_scores, so cost grows with the number of sessions rather than rounds.
+"""
+from collections import defaultdict
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from . import models
+
+def identity_key(name: str) -> str:
+    return " ".join(name.split()).casefold()
+
+def resolve_identity(db: Session, name: str) -> int:
+    """Id of the identity a player called ``name`` belongs to, created on first use."""
+    key = identity_key(name)
+    identity_id = db.scalar(select(models.PlayerIdentity.id).where(models.PlayerIdentity.key == key))
+    if identity_id is None:
+        identity = models.PlayerIdentity(key=key, name=name.strip())
+        db.add(identity)
+        db.flush()
+        identity_id = identity.id
+    return identity_id
+
+def link_players(db: Session):
+    """Attach every player without an identity to the one matching its name."""
+    for player in db.scalars(select(models.Player).where(models.Player.identity_id.is_(None))):
+        player.identity_id = resolve_identity(db, player.name)
+
+def _identity_totals(db: Session):
+    return db.execute(select(
+        models.PlayerTotal.session_id, models.Player.identity_id, func.sum(models.PlayerTotal.score),
+        func.sum(models.PlayerTotal.rounds), func.sum(models.PlayerTotal.wins)
+    ).join(models.Player, models.PlayerTotal.player_id == models.Player.id).where(
+        models.Player.identity_id.is_not(None)
+    ).group_by(models.PlayerTotal.session_id, models.Player.identity_id)).all()
+
+def _identity_names(db: Session) -> dict[int, str]:
+    return dict(db.execute(select(models.PlayerIdentity.id, models.PlayerIdentity.name)).all())
+
+def leaderboard(db: Session) -> list[dict]:
+    totals = defaultdict(lambda: {"sessions": 0, "score": 0, "rounds": 0, "wins": 0})
+    for _, identity_id, score, rounds, wins in _identity_totals(db):
+        entry = totals[identity_id]
+        entry["sessions"] += 1
+        entry["score"] += score
+        entry["rounds"] += rounds
+        entry["wins"] += wins
+    names = _identity_names(db)
+    result = [{"identity_id": identity_id, "name": names[identity_id], **t,
+               "win_rate": round(t["wins"] / t["rounds"] * 100, 1) if t["rounds"] else 0,
+               "avg": round(t["score"] / t["rounds"], 1) if t["rounds"] else 0}
+              for identity_id, t in totals.items()]
+    return sorted(result, key=lambda e: (-e["score"], e["name"]))
+
+def session_summaries(db: Session) -> list[dict]:
+    sessions = db.execute(select(models.Session, models.SessionTotal.rounds).outerjoin(
+        models.SessionTotal, models.SessionTotal.session_id == models.Session.id
+    ).order_by(models.Session.created_at.desc(), models.Session.id.desc())).all()
+    players = defaultdict(list)
+    for session_id, identity_id, score, rounds, _ in _identity_totals(db):
+        if rounds:
+            players[session_id].append((score, identity_id))
+    names = _identity_names(db)
+    result = []
+    for session, rounds in sessions:
+        standings = sorted(players[session.id], reverse=True)
+        leader = {"identity_id": standings[0][1], "name": names[standings[0][1]], "score": standings[0][0]} \
+            if standings else None
+        result.append({"id": session.id, "name": session.name, "created_at": session.created_at,
+                       "is_active": session.is_active, "table": session.table_key, "rounds": rounds or 0,
+                       "players": len(standings), "leader": leader})
+    return result
+
+def competition_ranks(totals: dict) -> dict:
+    """Rank per key, highest total first; tied totals share a rank (1, 2, 2, 4)."""
+    rank_of = {}
+    for position, total in enumerate(sorted(totals.values(), reverse=True), 1):
+        rank_of.setdefault(total, position)
+    return {key: rank_of[total] for key, total in totals.items()}
+
+def history(db: Session) -> dict:
+    """Cumulative score and rank of every identity after each session, sessions in creation order.
+
+    Identities that have not played yet score 0 and have no rank (None).
+    """
+    per_session = defaultdict(dict)
+    for session_id, identity_id, score, rounds, _ in _identity_totals(db):
+        if rounds:
+            per_session[session_id][identity_id] = score
+    order = list(db.scalars(select(models.Session.id).order_by(models.Session.created_at, models.Session.id)))
+    session_ids = ([None] if None in per_session else []) + [s for s in order if s in per_session]
+    totals: dict[int, int] = {}
+    scores: dict[int, list[int]] = {}
+    ranks: dict[int, list[int | None]] = {}
+    for index, session_id in enumerate(session_ids):
+        for identity_id, score in per_session[session_id].items():
+            if identity_id not in totals:
+                totals[identity_id] = 0
+                scores[identity_id] = [0] * index
+                ranks[identity_id] = [None] * index
+            totals[identity_id] += score
+        rank_of = competition_ranks(totals)
+        for identity_id, total in totals.items():
+            scores[identity_id].append(total)
+            ranks[identity_id].append(rank_of[identity_id])
+    names = _identity_names(db)
+    return {"session_ids": session_ids, "names": {i: names[i] for i in totals}, "scores": scores, "ranks": ranks}
@@ -0,0 +1,147 @@
+"""Set-based removal of a session's rows, and archiving of finished sessions.
+
+Archiving moves a session's rounds and scores (the only tables that grow with
+play) into one zlib-compressed, columnar row of session_archives. Players and
+the player/session totals stay in place, so standings and cross-session
+analytics still include archived sessions. Restoring puts the rows back.
+"""
+import json
+import zlib
+from datetime import datetime
+from sqlalchemy import delete, insert, select, update, func
+from sqlalchemy.orm import Session
+from . import models, journal, progression
+from .ledger import in_session
+from .database import next_id
+
+# Bulk statements: skip syncing the identity map (and the RETURNING that needs)
+BULK = {"synchronize_session": False}
+
+def session_rounds(session_id: int | None):
+    return select(models.Round.id).where(in_session(models.Round.session_id, session_id))
+
+def delete_rounds(db: Session, session_id: int | None) -> int:
+    """Delete every round of a session and its scores with two statements; returns the number of rounds."""
+    db.execute(delete(models.RoundScore).where(models.RoundScore.round_id.in_(session_rounds(session_id))),
+               execution_options=BULK)
+    return db.execute(delete(models.Round).where(in_session(models.Round.session_id, session_id)),
+                      execution_options=BULK).rowcount
+
+def delete_players(db: Session, player_ids) -> None:
+    """Delete players along with their scores and totals; rounds they recorded keep no recorder."""
+    player_ids = list(player_ids)
+    if not player_ids:
+        return
+    # Standings change from each session's first round with one of them on
+    first_rounds = db.execute(select(models.Round.session_id, func.min(models.Round.id)).join(
+        models.RoundScore, models.RoundScore.round_id == models.Round.id
+    ).where(models.RoundScore.player_id.in_(player_ids)).group_by(models.Round.session_id)).all()
+    db.execute(delete(models.RoundScore).where(models.RoundScore.player_id.in_(player_ids)), execution_options=BULK)
+    db.execute(update(models.Round).where(models.Round.recorder_id.in_(player_ids)).values(recorder_id=None),
+               execution_options=BULK)
+    db.execute(delete(models.PlayerTotal).where(models.PlayerTotal.player_id.in_(player_ids)), execution_options=BULK)
+    db.execute(delete(models.Player).where(models.Player.id.in_(player_ids)), execution_options=BULK)
+    for session_id, round_id in first_rounds:
+        progression.refresh(db, session_id, round_id)
+
+def reset_session(db: Session, session_id: int | None):
+    """Drop every round of a session, archived ones included; totals are the caller's (ledger's) business."""
+    delete_rounds(db, session_id)
+    progression.clear(db, session_id)
+    if session_id:
+        db.execute(delete(models.SessionArchive).where(models.SessionArchive.session_id == session_id),
+                   execution_options=BULK)
+        db.execute(update(models.Session).where(models.Session.id == session_id).values(archived_at=None))
+
+def purge_session(db: Session, session_id: int):
+    """Delete a session and everything in it (avatar files stay for scripts/clean_avatars.py)."""
+    delete_rounds(db, session_id)
+    delete_players(db, db.scalars(select(models.Player.id).where(models.Player.session_id == session_id)).all())
+    for table in (models.PlayerTotal, models.SessionTotal, models.SessionArchive, models.JournalEntry,
+                  models.RoundStanding):
+        db.execute(delete(table).where(table.session_id == session_id), execution_options=BULK)
+    db.execute(delete(models.Session).where(models.Session.id == session_id), execution_options=BULK)
+
+def _deltas(values: list[int]) -> list[int]:
+    return [value - prev for prev, value in zip([0] + values, values)]
+
+def _undelta(values: list[int]) -> list[int]:
+    total, result = 0, []
+    for value in values:
+        total += value
+        result.append(total)
+    return result
+
+def archive_session(db: Session, session_id: int) -> int:
+    """Move a session's rounds and scores into session_archives; returns the number of rounds archived."""
+    rounds = db.execute(select(
+        models.Round.id, models.Round.recorder_id, models.Round.recorder_ip, models.Round.client_key,
+        models.Round.created_at
+    ).where(models.Round.session_id == session_id).order_by(models.Round.id)).all()
+    scores = db.execute(select(models.RoundScore.round_id, models.RoundScore.player_id, models.RoundScore.delta).join(
+        models.Round, models.RoundScore.round_id == models.Round.id
+    ).where(models.Round.session_id == session_id).order_by(models.RoundScore.round_id, models.RoundScore.id)).all()
+    columns = {
+        # Ids are increasing, so they are stored as small gaps
+        "id": _deltas([r.id for r in rounds]),
+        "recorder_id": [r.recorder_id for r in rounds],
+        "recorder_ip": [r.recorder_ip for r in rounds],
+        "client_key": [r.client_key for r in rounds],
+        "created_at": [r.created_at.isoformat() if r.created_at else None for r in rounds],
+        "score_round_id": _deltas([s.round_id for s in scores]),
+        "score_player_id": [s.player_id for s in scores],
+        "score_delta": [s.delta for s in scores],
+    }
+    payload = zlib.compress(json.dumps(columns, separators=(",", ":")).encode(), 9)
+    db.add(models.SessionArchive(session_id=session_id, rounds=len(rounds), payload=payload))
+    delete_rounds(db, session_id)
+    db.execute(update(models.Session).where(models.Session.id == session_id).values(archived_at=func.now()))
+    return len(rounds)
+
+def highest_round_id(db: Session) -> int:
+    """The highest round id in use anywhere: live rounds, per-round standings (kept when a session is
+    archived) and archived rounds (archives made before standings existed have none)."""
+    highest = max(db.scalar(select(func.max(models.Round.id))) or 0,
+                  db.scalar(select(func.max(models.RoundStanding.round_id))) or 0)
+    for payload in db.scalars(select(models.SessionArchive.payload)):
+        highest = max(highest, *_undelta(json.loads(zlib.decompress(payload))["id"]), 0)
+    return highest
+
+def restore_session(db: Session, session_id: int) -> int:
+    """Move an archived session's rounds back into the hot tables; returns the number of rounds restored.
+
+    Round ids are kept unless newer rounds took them, in which case the session is renumbered after
+    the current maximum (order is preserved) and the journal gets a barrier. Scores of players deleted
+    since are dropped, like deleting a player drops their scores.
+    """
+    archive = db.get(models.SessionArchive, session_id)
+    columns = json.loads(zlib.decompress(archive.payload))
+    round_ids = _undelta(columns["id"])
+    score_round_ids = _undelta(columns["score_round_id"])
+    if round_ids and db.scalar(select(func.count(models.Round.id)).where(models.Round.id.in_(round_ids))):
+        start = next_id(db, models.Round, highest_round_id(db))
+        mapping = {old: start + i for i, old in enumerate(round_ids)}
+        round_ids = [mapping[r] for r in round_ids]
+        score_round_ids = [mapping[r] for r in score_round_ids]
+        # Journal snapshots refer to the old ids; don't let undo reach past this point
+        journal.record(db, session_id, "session_restored", {"renumbered_to": start})
+    players = set(db.scalars(select(models.Player.id).where(models.Player.id.in_(
+        set(columns["score_player_id"]) | {r for r in columns["recorder_id"] if r}))))
+    taken = set(db.scalars(select(models.Round.client_key).where(
+        models.Round.client_key.in_([k for k in columns["client_key"] if k]))))
+    if round_ids:
+        db.execute(insert(models.Round), [
+            {"id": round_id, "session_id": session_id, "recorder_id": recorder if recorder in players else None,
+             "recorder_ip": ip, "client_key": key if key not in taken else None,
+             "created_at": datetime.fromisoformat(created) if created else None}
+            for round_id, recorder, ip, key, created in zip(round_ids, columns["recorder_id"], columns["recorder_ip"],
+                                                             columns["client_key"], columns["created_at"])])
+    scores = [{"round_id": r, "player_id": p, "delta": d}
+              for r, p, d in zip(score_round_ids, columns["score_player_id"], columns["score_delta"]) if p in players]
+    if scores:
+        db.execute(insert(models.RoundScore), scores)
+    db.delete(archive)
+    db.execute(update(models.Session).where(models.Session.id == session_id).values(archived_at=None))
+    # Ids may have been renumbered and deleted players' scores dropped
+    progression.refresh(db, session_id)
+    return len(round_ids)
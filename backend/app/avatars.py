@@ -0,0 +1,150 @@
+"""Avatar storage: streamed, size-capped uploads stored under their content hash, with fixed-size thumbnails.
+
+Files are named ``<sha256>.<ext>`` so identical uploads share one file and a name
+never changes content, which lets them be served as immutable. Thumbnails are
+``<sha256>_<size>.webp`` and need Pillow; without it only the original is kept
+and thumbnail requests fall back to it. Files no player uses any more are left
+in place until ``scripts/clean_avatars.py`` sweeps them.
+"""
+import asyncio
+import glob
+import hashlib
+import os
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException, UploadFile
+from fastapi.staticfiles import StaticFiles
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.types import Scope
+import anyio
+
+AVATARS_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "static", "avatars")
+MAX_AVATAR_BYTES = 5 * 1024 * 1024
+THUMBNAIL_SIZES = (64, 128, 256)
+CHUNK_SIZE = 64 * 1024
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+FALLBACK_CACHE_CONTROL = "public, no-cache"
+# Avatars nothing references are only removed by scripts/clean_avatars.py, never while handling a request, where
+# another request's upload could be reusing the file before committing its reference
+SWEEP_MIN_AGE = 3600
+
+THUMBNAIL_NAME = re.compile(r"^(?P<digest>[0-9a-f]{64})_(?P<size>\d+)\.webp$")
+
+# Threads, not processes: Pillow releases the GIL while it decodes, resizes and encodes, so thumbnails
+# don't hold up the event loop, and a thread needs no fork or pickling. Created on the first upload,
+# like Pillow is imported then.
+_thumbnail_pool: ThreadPoolExecutor | None = None
+
+def ensure_dir():
+    os.makedirs(AVATARS_DIR, exist_ok=True)
+
+def thumbnail_pool() -> ThreadPoolExecutor:
+    global _thumbnail_pool
+    if _thumbnail_pool is None:
+        _thumbnail_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="avatar-thumbs")
+    return _thumbnail_pool
+
+def sniff_extension(head: bytes) -> str | None:
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ".png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return ".jpg"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return ".gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+def thumbnail_paths(filename: str) -> list[str]:
+    digest = os.path.splitext(filename)[0]
+    return [os.path.join(AVATARS_DIR, f"{digest}_{size}.webp") for size in THUMBNAIL_SIZES]
+
+def make_thumbnails(path: str):
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image).convert("RGBA")
+        for size, target in zip(THUMBNAIL_SIZES, thumbnail_paths(os.path.basename(path))):
+            if not os.path.exists(target):
+                thumb = ImageOps.fit(image, (size, size))
+                thumb.save(target + ".tmp", "WEBP", quality=85)
+                os.replace(target + ".tmp", target)
+
+async def store_upload(file: UploadFile) -> str:
+    """Stream an upload to disk under its content hash; returns the stored filename."""
+    ensure_dir()
+    tmp_path = os.path.join(AVATARS_DIR, f".upload-{uuid.uuid4()}")
+    digest, size, head = hashlib.sha256(), 0, b""
+    try:
+        async with await anyio.open_file(tmp_path, "wb") as f:
+            while chunk := await file.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_AVATAR_BYTES:
+                    raise HTTPException(413, f"Avatar larger than {MAX_AVATAR_BYTES // (1024 * 1024)} MB")
+                if len(head) < 16:
+                    head += chunk[:16]
+                digest.update(chunk)
+                await f.write(chunk)
+        ext = sniff_extension(head)
+        if not ext:
+            raise HTTPException(415, "Avatar must be a PNG, JPEG, GIF or WebP image")
+        filename = digest.hexdigest() + ext
+        path = os.path.join(AVATARS_DIR, filename)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            os.utime(path)  # freshly in use again, as far as sweep_orphans is concerned
+        else:
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    try:
+        await asyncio.get_running_loop().run_in_executor(thumbnail_pool(), make_thumbnails, path)
+    except Exception:
+        # Sniffed as an image but Pillow can't decode it: keep the original, skip thumbnails
+        pass
+    return filename
+
+def sweep_orphans(referenced: set[str], min_age: float = SWEEP_MIN_AGE) -> list[str]:
+    """Remove every stored avatar not in ``referenced`` (plus their thumbnails); returns removed names.
+
+    Files stored or reused in the last ``min_age`` seconds are kept: their upload may not have committed the
+    reference yet.
+    """
+    removed = []
+    keep = {os.path.splitext(name)[0] for name in referenced}
+    cutoff = time.time() - min_age
+    for path in glob.glob(os.path.join(AVATARS_DIR, "*")):
+        name = os.path.basename(path)
+        match = THUMBNAIL_NAME.match(name)
+        if name.startswith(".") or (match["digest"] if match else os.path.splitext(name)[0]) in keep:
+            continue
+        if os.path.getmtime(path) > cutoff:
+            continue
+        os.remove(path)
+        removed.append(name)
+    return removed
+
+class AvatarFiles(StaticFiles):
+    """Serves avatars as immutable; a missing thumbnail falls back to the original image, which is not, as the
+    thumbnail may appear at that URL later."""
+
+    async def get_response(self, path: str, scope: Scope):
+        cache_control = CACHE_CONTROL
+        try:
+            response = await super().get_response(path, scope)
+        except StarletteHTTPException as exc:
+            match = THUMBNAIL_NAME.match(os.path.basename(path))
+            originals = glob.glob(os.path.join(AVATARS_DIR, match["digest"] + ".*")) if match else []
+            if exc.status_code != 404 or not originals:
+                raise
+            response = await super().get_response(os.path.basename(originals[0]), scope)
+            cache_control = FALLBACK_CACHE_CONTROL
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = cache_control
+        return response
@@ -1,15 +1,146 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+import asyncio
+import os
+from fastapi import Request
+from sqlalchemy import create_engine, event, func, select, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.util import await_only
+from . import tables
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./mahjong.db"
+SQLALCHEMY_DATABASE_URL = os.environ.get("MAHJONG_DATABASE_URL", "sqlite:///./mahjong.db")
+ASYNC_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1)
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+# Applied to every new SQLite connection. Override with e.g. MAHJONG_SQLITE_PRAGMAS="cache_size=-64000,mmap_size=0"
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "cache_size": -20000,  # KiB
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    "foreign_keys": "ON",
+}
+
+def parse_pragmas(spec: str) -> dict[str, str]:
+    return dict(item.split("=", 1) for item in spec.split(",") if "=" in item)
+
+def apply_sqlite_pragmas(engine, pragmas: dict | None = None):
+    if engine.dialect.name != "sqlite":
+        return
+    settings = {**SQLITE_PRAGMAS, **parse_pragmas(os.environ.get("MAHJONG_SQLITE_PRAGMAS", "")), **(pragmas or {})}
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in settings.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+def serialize_writes(engine):
+    """Emit BEGIN ourselves, as BEGIN IMMEDIATE on connections with the sqlite_immediate execution option.
+
+    A deferred transaction that reads before it writes can't wait for the write lock: SQLite fails the
+    upgrade at once with "database is locked" when another connection is writing. Taking the lock up
+    front makes concurrent writers queue on busy_timeout instead.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def disable_driver_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def begin(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE" if conn.get_execution_options().get("sqlite_immediate") else "BEGIN")
+
+def create_db_engine(url: str = SQLALCHEMY_DATABASE_URL, pragmas: dict | None = None):
+    engine = create_engine(url, connect_args={"check_same_thread": False})
+    apply_sqlite_pragmas(engine, pragmas)
+    return engine
+
+def create_async_db_engine(url: str = ASYNC_DATABASE_URL, pragmas: dict | None = None, **kwargs):
+    engine = create_async_engine(url, **kwargs)
+    apply_sqlite_pragmas(engine.sync_engine, pragmas)
+    serialize_writes(engine.sync_engine)
+    return engine
+
+# Sync engine for migrations and scripts; request handlers use the async one
+engine = create_db_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_db_engine()
+# Same pool; transactions on it start with BEGIN IMMEDIATE
+async_write_engine = async_engine.execution_options(sqlite_immediate=True)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
+def next_id(db: Session, model, used: int = 0) -> int:
+    """The id an AUTOINCREMENT table hands out next: past every id it ever used, deleted rows' included, and
+    past ``used``, the highest id still referenced elsewhere (e.g. archive.highest_round_id)."""
+    seq = db.execute(text("SELECT seq FROM sqlite_sequence WHERE name = :name"), {"name": model.__tablename__}).scalar()
+    return max(seq or 0, db.scalar(select(func.max(model.id))) or 0, used) + 1
+
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# One writer per process at a time; the rest queue here instead of piling onto SQLite's busy handler,
+# which only has to arbitrate between worker processes. Writers queue per table first, so a busy table
+# holds at most one place in this queue and can't hold up the other tables' writes behind a burst of its own.
+_write_lock = asyncio.Lock()
+
+class WriteLocks:
+    """A write request's place in the table's queue and then the process's, taken when its transaction begins.
+
+    Until the request first touches the database it holds nothing, so whatever it does first (reading the
+    upload, hashing) doesn't hold up other writers.
+    """
+
+    def __init__(self, table: str):
+        self.locks = [tables.write_lock(table), _write_lock]
+        self.held: list[asyncio.Lock] = []
+
+    def acquire(self):
+        """Called from the connection's begin event, inside SQLAlchemy's greenlet, before BEGIN IMMEDIATE."""
+        for lock in self.locks[len(self.held):]:
+            await_only(lock.acquire())
+            self.held.append(lock)
+
+    def release(self):
+        while self.held:
+            self.held.pop().release()
+
+async def get_read_db():
+    """A session that never takes the write locks, for requests that only read whatever their method."""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_async_db(request: Request):
+    if request.method in READ_METHODS:
+        async with AsyncSessionLocal() as db:
+            yield db
+        return
+    # Mutating requests take SQLite's write lock when their transaction begins, so they serialize cleanly
+    locks = WriteLocks(tables.current_table(request))
+    db = AsyncSessionLocal(bind=async_write_engine.execution_options(write_locks=locks))
+    db.sync_session.info["write_locks"] = locks
     try:
         yield db
     finally:
-        db.close()
+        await db.close()
+        locks.release()
+
+@event.listens_for(async_write_engine.sync_engine, "begin", insert=True)
+def _acquire_write_locks(conn):
+    if locks := conn.get_execution_options().get("write_locks"):
+        locks.acquire()
+
+@event.listens_for(Session, "after_commit")
+def _release_write_locks(db: Session):
+    """Let the next writer in as soon as the transaction commits, rather than when the request finishes.
+
+    Whatever the handler reads afterwards (standings for the response and the event hub) runs in an
+    ordinary deferred transaction, outside the lock.
+    """
+    locks = db.info.pop("write_locks", None)
+    if locks:
+        db.bind = async_engine.sync_engine
+        locks.release()
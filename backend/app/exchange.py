@@ -0,0 +1,318 @@
+"""Session export/import.
+
+The columnar format is newline-delimited JSON: a header record with the
+session and its players, then one record per chunk of rounds whose integer
+columns (round ids, timestamps) are delta-encoded, then an end record:
+
+    {"type": "header", "format": "mahjong-session", "version": 1, "session": {...}, "players": {...}}
+    {"type": "rounds", "id": [...], "created_at": [...], "score_count": [...], "score_player": [...], ...}
+    {"type": "end", "rounds": 100000}
+
+Players are referenced by their index in the header. The CSV format has one
+row per score (round_id, created_at, recorder, player, delta) and is meant for
+spreadsheets and offline analysis. Either can be gzip or zstd (if the
+zstandard package is installed) compressed.
+"""
+import codecs
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timezone
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, ledger, analytics, progression
+
+FORMAT = "mahjong-session"
+VERSION = 1
+CHUNK_ROUNDS = 5000
+CSV_COLUMNS = ["round_id", "created_at", "recorder", "player", "delta"]
+MEDIA_TYPES = {"gzip": "application/gzip", "zstd": "application/zstd"}
+EXTENSIONS = {"columnar": "jsonl", "csv": "csv"}
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise HTTPException(400, "zstd compression needs the zstandard package")
+    return zstandard
+
+def compressor(compression: str):
+    """Object with compress(bytes) and flush(), or None for no compression."""
+    if compression == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if compression == "zstd":
+        return _zstd().ZstdCompressor(level=3).compressobj()
+    return None
+
+async def compress_stream(chunks, compression: str):
+    packer = compressor(compression)
+    async for chunk in chunks:
+        data = packer.compress(chunk) if packer else chunk
+        if data:
+            yield data
+    if packer:
+        yield packer.flush()
+
+def _epoch(value: datetime | None) -> int | None:
+    return int(value.replace(tzinfo=timezone.utc).timestamp()) if value else None
+
+def _deltas(values: list[int], prev: int = 0) -> list[int]:
+    result = []
+    for value in values:
+        result.append(value - prev)
+        prev = value
+    return result
+
+def _undelta(values: list[int], prev: int = 0) -> list[int]:
+    result = []
+    for value in values:
+        prev += value
+        result.append(prev)
+    return result
+
+def _line(record: dict) -> bytes:
+    return json.dumps(record, separators=(",", ":")).encode() + b"\n"
+
+def _rounds_query(session_id: int):
+    return select(
+        models.Round.id, models.Round.recorder_id, models.Round.recorder_ip, models.Round.client_key,
+        models.Round.created_at, models.RoundScore.player_id, models.RoundScore.delta
+    ).outerjoin(models.RoundScore, models.RoundScore.round_id == models.Round.id).where(
+        models.Round.session_id == session_id
+    ).order_by(models.Round.id, models.RoundScore.id).execution_options(yield_per=CHUNK_ROUNDS * 4)
+
+async def _round_groups(db: AsyncSession, session_id: int):
+    """(round row, [(player_id, delta), ...]) per round, read through a server-side cursor."""
+    result = await db.stream(_rounds_query(session_id))
+    current, scores = None, []
+    async for row in result:
+        if current is None or row.id != current.id:
+            if current is not None:
+                yield current, scores
+            current, scores = row, []
+        if row.player_id is not None:
+            scores.append((row.player_id, row.delta))
+    if current is not None:
+        yield current, scores
+
+async def _players(db: AsyncSession, session_id: int) -> list[models.Player]:
+    return list(await db.scalars(select(models.Player).where(models.Player.session_id == session_id)
+                                 .order_by(models.Player.id)))
+
+async def export_columnar(db: AsyncSession, session: models.Session):
+    players = await _players(db, session.id)
+    index = {p.id: i for i, p in enumerate(players)}
+    yield _line({"type": "header", "format": FORMAT, "version": VERSION,
+                 "session": {"id": session.id, "name": session.name, "created_at": _epoch(session.created_at)},
+                 "players": {"name": [p.name for p in players], "color": [p.color for p in players],
+                             "avatar_path": [p.avatar_path for p in players]}})
+    total, chunk = 0, []
+    last_id = last_time = 0
+
+    def flush():
+        nonlocal last_id, last_time
+        ids = [r.id for r, _ in chunk]
+        times = [_epoch(r.created_at) or last_time for r, _ in chunk]
+        record = {"type": "rounds",
+                  "id": _deltas(ids, last_id), "created_at": _deltas(times, last_time),
+                  "recorder": [index.get(r.recorder_id) for r, _ in chunk],
+                  "recorder_ip": [r.recorder_ip for r, _ in chunk],
+                  "client_key": [r.client_key for r, _ in chunk],
+                  "score_count": [len(scores) for _, scores in chunk],
+                  "score_player": [index.get(p, -1) for _, scores in chunk for p, _ in scores],
+                  "score_delta": [d for _, scores in chunk for _, d in scores]}
+        last_id, last_time = ids[-1], times[-1]
+        return _line(record)
+
+    async for group in _round_groups(db, session.id):
+        chunk.append(group)
+        total += 1
+        if len(chunk) == CHUNK_ROUNDS:
+            yield flush()
+            chunk = []
+    if chunk:
+        yield flush()
+    yield _line({"type": "end", "rounds": total})
+
+async def export_csv(db: AsyncSession, session: models.Session):
+    names = {p.id: p.name for p in await _players(db, session.id)}
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    async for r, scores in _round_groups(db, session.id):
+        created = r.created_at.isoformat() if r.created_at else ""
+        for player_id, delta in scores:
+            writer.writerow([r.id, created, names.get(r.recorder_id, ""), names.get(player_id, ""), delta])
+        if buffer.tell() > 64 * 1024:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+async def read_lines(file: UploadFile, chunk_size: int = 64 * 1024):
+    """Decompress (gzip or zstd, detected from the magic bytes) and split an upload into lines."""
+    head = await file.read(chunk_size)
+    if head[:2] == b"\x1f\x8b":
+        unpacker = zlib.decompressobj(47)
+    elif head[:4] == b"\x28\xb5\x2f\xfd":
+        unpacker = _zstd().ZstdDecompressor().decompressobj()
+    else:
+        unpacker = None
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    data = head
+    while data:
+        text = decoder.decode(unpacker.decompress(data) if unpacker else data)
+        lines = (pending + text).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line
+        data = await file.read(chunk_size)
+    if pending:
+        yield pending
+
+class Importer:
+    """Writes imported rounds into a new session, a chunk at a time, inside the caller's transaction."""
+
+    def __init__(self, db: AsyncSession, session: models.Session):
+        self.db = db
+        self.session = session
+        self.player_ids: list[int] = []
+        self.rounds = 0
+
+    async def add_players(self, names: list[str], colors: list[str] | None = None, avatars: list | None = None):
+        for i, name in enumerate(names):
+            identity_id = await self.db.run_sync(analytics.resolve_identity, name)
+            player = models.Player(session_id=self.session.id, name=name, identity_id=identity_id,
+                                   color=(colors[i] if colors else None) or "#808080",
+                                   avatar_path=avatars[i] if avatars else None)
+            self.db.add(player)
+            await self.db.flush()
+            self.player_ids.append(player.id)
+
+    async def add_rounds(self, rounds: list[dict], scores: list[list[tuple[int, int]]]):
+        """rounds: Round column values (recorder as a player index); scores: (player index, delta) per round."""
+        if not rounds:
+            return
+        for number, round_scores in enumerate(scores, self.rounds + 1):
+            if any(not 0 <= p < len(self.player_ids) for p, _ in round_scores):
+                raise HTTPException(400, f"Round {number} has a score for an unknown player")
+            if total := sum(d for _, d in round_scores):
+                raise HTTPException(400, f"Round {number} scores must sum to zero, got {total}")
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        keys = {r["client_key"] for r in rounds if r.get("client_key")}
+        taken = set(await self.db.scalars(select(models.Round.client_key).where(models.Round.client_key.in_(keys)))) \
+            if keys else set()
+        round_ids = sorted(await self.db.scalars(insert(models.Round).returning(models.Round.id), [
+            {"session_id": self.session.id, "recorder_id": self._player(r.get("recorder")),
+             "recorder_ip": r.get("recorder_ip"), "created_at": r.get("created_at") or now,
+             "client_key": r.get("client_key") if r.get("client_key") not in taken else None} for r in rounds]))
+        rows = [{"round_id": round_id, "player_id": self.player_ids[p], "delta": d}
+                for round_id, round_scores in zip(round_ids, scores) for p, d in round_scores]
+        if rows:
+            await self.db.execute(insert(models.RoundScore), rows)
+        await self.db.run_sync(ledger.apply_scores, self.session.id, [(r["player_id"], r["delta"]) for r in rows])
+        await self.db.run_sync(ledger.apply_rounds, self.session.id, len(rounds))
+        await self.db.run_sync(progression.refresh, self.session.id, round_ids[0])
+        # The session doesn't autoflush; flush so the next chunk finds the totals created by this one
+        await self.db.flush()
+        self.rounds += len(rounds)
+
+    def _player(self, index) -> int | None:
+        if index is None:
+            return None
+        if not 0 <= index < len(self.player_ids):
+            raise HTTPException(400, f"Unknown recorder (player {index})")
+        return self.player_ids[index]
+
+ROUND_COLUMNS = ("id", "created_at", "recorder", "recorder_ip", "client_key", "score_count")
+
+def _check_chunk(record: dict):
+    """400 unless every column of a rounds record is a list of the right length."""
+    columns = {name: record.get(name) for name in (*ROUND_COLUMNS, "score_player", "score_delta")}
+    if not all(isinstance(values, list) for values in columns.values()):
+        raise HTTPException(400, f"Rounds record needs the columns {', '.join(columns)}")
+    rounds = len(columns["id"])
+    if not rounds or any(len(columns[name]) != rounds for name in ROUND_COLUMNS):
+        raise HTTPException(400, "Rounds record columns are empty or of different lengths")
+    if any(not isinstance(count, int) or count < 0 for count in columns["score_count"]):
+        raise HTTPException(400, "Rounds record has an invalid score_count")
+    scores = sum(columns["score_count"])
+    if len(columns["score_player"]) != scores or len(columns["score_delta"]) != scores:
+        raise HTTPException(400, "Rounds record score_player and score_delta don't match score_count")
+
+def _from_epoch(value: int) -> datetime:
+    return datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None)
+
+async def import_columnar(importer: Importer, lines) -> str | None:
+    """Feed a columnar export into the importer; returns the session name from the header."""
+    header = None
+    last_id = last_time = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if not isinstance(record, dict):
+            raise HTTPException(400, "Not a mahjong session export")
+        if header is None:
+            if record.get("type") != "header" or record.get("format") != FORMAT:
+                raise HTTPException(400, "Not a mahjong session export")
+            if record.get("version", 0) > VERSION:
+                raise HTTPException(400, f"Unsupported export version {record['version']}")
+            header = record
+            players = record["players"]
+            await importer.add_players(players["name"], players.get("color"), players.get("avatar_path"))
+        elif record["type"] == "rounds":
+            _check_chunk(record)
+            ids = _undelta(record["id"], last_id)
+            times = _undelta(record["created_at"], last_time)
+            last_id, last_time = ids[-1], times[-1]
+            flat = list(zip(record["score_player"], record["score_delta"]))
+            scores, offset = [], 0
+            for count in record["score_count"]:
+                scores.append(flat[offset:offset + count])
+                offset += count
+            await importer.add_rounds([
+                {"recorder": recorder, "recorder_ip": ip, "client_key": key, "created_at": _from_epoch(t)}
+                for recorder, ip, key, t in zip(record["recorder"], record["recorder_ip"], record["client_key"], times)
+            ], scores)
+        elif record["type"] == "end":
+            if record["rounds"] != importer.rounds:
+                raise HTTPException(400, f"Export is incomplete: expected {record['rounds']} rounds, got {importer.rounds}")
+            return header["session"].get("name")
+    raise HTTPException(400, "Export is truncated (no end record)")
+
+async def import_csv(importer: Importer, lines) -> None:
+    """Feed CSV rows (grouped by round_id, in order) into the importer, creating players as names appear."""
+    index: dict[str, int] = {}
+    rounds, scores, current = [], [], None
+
+    async def player(name: str) -> int:
+        if name not in index:
+            index[name] = len(importer.player_ids)
+            await importer.add_players([name])
+        return index[name]
+
+    header = None
+    async for line in lines:
+        if not line.strip():
+            continue
+        if header is None:
+            header = next(csv.reader([line]))
+            if not {"round_id", "player", "delta"} <= set(header):
+                raise HTTPException(400, "CSV needs at least the columns round_id, player and delta")
+            continue
+        row = dict(zip(header, next(csv.reader([line]))))
+        if row["round_id"] != current:
+            current = row["round_id"]
+            recorder = row.get("recorder")
+            rounds.append({"recorder": await player(recorder) if recorder else None,
+                           "created_at": datetime.fromisoformat(row["created_at"]) if row.get("created_at") else None})
+            scores.append([])
+        scores[-1].append((await player(row["player"]), int(row["delta"])))
+        if len(rounds) > CHUNK_ROUNDS:
+            await importer.add_rounds(rounds[:-1], scores[:-1])
+            rounds, scores = rounds[-1:], scores[-1:]
+    await importer.add_rounds(rounds, scores)
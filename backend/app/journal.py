@@ -0,0 +1,185 @@
+"""Per-session operation journal with undo/redo.
+
+Every undoable change appends an entry: ``round_added`` / ``round_removed`` hold
+snapshots of the rounds involved and the standings delta they applied,
+``player_edited`` holds the fields before and after. Undo and redo never edit
+or drop history; they flip the target's ``undone`` flag, apply the inverse (or
+the original) change to the rows and the ledger, and append an ``undo`` /
+``redo`` entry of their own, so the journal doubles as an audit log.
+
+A new change clears the redo stack. Resets, player deletions (which take the
+player's scores out of every round) and restores that had to renumber round ids
+append a barrier entry that nothing is undone across.
+"""
+import json
+from collections import defaultdict
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy import delete, insert, select, exists
+from sqlalchemy.orm import Session, aliased
+from . import models, schemas, ledger, versioning, progression
+
+UNDOABLE = ("round_added", "round_removed", "player_edited")
+BARRIERS = ("game_reset", "player_deleted", "session_restored")
+PLAYER_FIELDS = ("name", "color", "identity_id")
+
+def to_schema(entry: models.JournalEntry) -> schemas.JournalEntry:
+    return schemas.JournalEntry(id=entry.id, session_id=entry.session_id, action=entry.action, target_id=entry.target_id,
+                                undone=entry.undone, revision=entry.revision, actor_id=entry.actor_id,
+                                actor_ip=entry.actor_ip, created_at=entry.created_at, data=json.loads(entry.data))
+
+def since(db: Session, session_id: int | None, revision: int, limit: int = 100) -> list[models.JournalEntry]:
+    """Entries recorded after a session revision, oldest first."""
+    return list(db.scalars(select(models.JournalEntry).where(
+        _in_session(session_id), models.JournalEntry.revision > revision
+    ).order_by(models.JournalEntry.id).limit(limit)))
+
+def snapshot_rounds(db: Session, round_ids) -> list[dict]:
+    """Everything needed to put the rounds back exactly as they were."""
+    round_ids = list(round_ids)
+    rounds = db.execute(select(
+        models.Round.id, models.Round.recorder_id, models.Round.recorder_ip, models.Round.client_key,
+        models.Round.created_at
+    ).where(models.Round.id.in_(round_ids)).order_by(models.Round.id)).all()
+    scores = defaultdict(list)
+    for round_id, player_id, delta in db.execute(select(
+        models.RoundScore.round_id, models.RoundScore.player_id, models.RoundScore.delta
+    ).where(models.RoundScore.round_id.in_(round_ids)).order_by(models.RoundScore.id)):
+        scores[round_id].append([player_id, delta])
+    return [{"id": r.id, "recorder_id": r.recorder_id, "recorder_ip": r.recorder_ip, "client_key": r.client_key,
+             "created_at": r.created_at.isoformat() if r.created_at else None, "scores": scores[r.id]}
+            for r in rounds]
+
+def standings_delta(rounds: list[dict], sign: int = 1) -> dict[str, int]:
+    totals = defaultdict(int)
+    for r in rounds:
+        for player_id, delta in r["scores"]:
+            totals[str(player_id)] += sign * delta
+    return dict(totals)
+
+def player_fields(player: models.Player) -> dict:
+    return {field: getattr(player, field) for field in PLAYER_FIELDS}
+
+def record(db: Session, session_id: int | None, action: str, data: dict, actor_id: int | None = None,
+           actor_ip: str | None = None, target_id: int | None = None) -> models.JournalEntry:
+    scope = versioning.session_scope(session_id)
+    versioning.bump(db, scope)
+    entry = models.JournalEntry(session_id=session_id, action=action, data=json.dumps(data, separators=(",", ":")),
+                                actor_id=actor_id, actor_ip=actor_ip, target_id=target_id,
+                                revision=versioning.stored(db, scope))
+    db.add(entry)
+    db.flush()
+    return entry
+
+def record_rounds(db: Session, session_id: int | None, action: str, round_ids, actor_id: int | None = None,
+                  actor_ip: str | None = None) -> models.JournalEntry:
+    rounds = snapshot_rounds(db, round_ids)
+    sign = 1 if action == "round_added" else -1
+    return record(db, session_id, action, {"rounds": rounds, "delta": standings_delta(rounds, sign)},
+                  actor_id, actor_ip)
+
+def record_player_edit(db: Session, player: models.Player, before: dict, actor_ip: str | None = None):
+    after = player_fields(player)
+    if after != before:
+        record(db, player.session_id, "player_edited", {"player_id": player.id, "before": before, "after": after},
+               actor_ip=actor_ip)
+
+def _in_session(session_id: int | None):
+    return ledger.in_session(models.JournalEntry.session_id, session_id)
+
+def _barrier(db: Session, session_id: int | None) -> int:
+    return db.scalar(select(models.JournalEntry.id).where(
+        _in_session(session_id), models.JournalEntry.action.in_(BARRIERS)
+    ).order_by(models.JournalEntry.id.desc()).limit(1)) or 0
+
+def _undo_target(db: Session, session_id: int | None) -> models.JournalEntry | None:
+    return db.scalar(select(models.JournalEntry).where(
+        _in_session(session_id), models.JournalEntry.id > _barrier(db, session_id),
+        models.JournalEntry.action.in_(UNDOABLE), models.JournalEntry.undone == False
+    ).order_by(models.JournalEntry.id.desc()).limit(1))
+
+def _redo_target(db: Session, session_id: int | None) -> models.JournalEntry | None:
+    target = aliased(models.JournalEntry)
+    undo = db.scalar(select(models.JournalEntry).join(target, models.JournalEntry.target_id == target.id).where(
+        _in_session(session_id), models.JournalEntry.id > _barrier(db, session_id),
+        models.JournalEntry.action == "undo", target.undone == True
+    ).order_by(models.JournalEntry.id.desc()).limit(1))
+    if undo is None:
+        return None
+    # A change made after the undo discards what could have been redone
+    if db.scalar(select(exists().where(_in_session(session_id), models.JournalEntry.id > undo.id,
+                                       models.JournalEntry.action.in_(UNDOABLE)))):
+        return None
+    return db.get(models.JournalEntry, undo.target_id)
+
+def _insert_rounds(db: Session, session_id: int | None, rounds: list[dict]):
+    player_ids = {p for r in rounds for p, _ in r["scores"]}
+    # The same check as recording a round: the players must (still) be the session's own
+    existing = set(db.scalars(ledger.session_players(
+        session_id, player_ids | {r["recorder_id"] for r in rounds if r["recorder_id"]})))
+    if player_ids - existing:
+        raise HTTPException(409, "A player in these rounds has been deleted since")
+    taken_ids = set(db.scalars(select(models.Round.id).where(models.Round.id.in_([r["id"] for r in rounds]))))
+    taken_keys = set(db.scalars(select(models.Round.client_key).where(
+        models.Round.client_key.in_([r["client_key"] for r in rounds if r["client_key"]]))))
+    for r in rounds:
+        values = {"session_id": session_id, "recorder_id": r["recorder_id"] if r["recorder_id"] in existing else None,
+                  "recorder_ip": r["recorder_ip"], "client_key": r["client_key"] if r["client_key"] not in taken_keys else None,
+                  "created_at": datetime.fromisoformat(r["created_at"]) if r["created_at"] else None}
+        if r["id"] not in taken_ids:
+            values["id"] = r["id"]
+        # Keep the snapshot pointing at the round, in case its old id went to another round meanwhile
+        r["id"] = db.scalar(insert(models.Round).values(**values).returning(models.Round.id))
+    db.execute(insert(models.RoundScore), [{"round_id": r["id"], "player_id": p, "delta": d}
+                                           for r in rounds for p, d in r["scores"]])
+    ledger.apply_scores(db, session_id, [(p, d) for r in rounds for p, d in r["scores"]])
+    ledger.apply_rounds(db, session_id, len(rounds))
+    progression.refresh(db, session_id, min(r["id"] for r in rounds))
+
+def _remove_rounds(db: Session, session_id: int | None, rounds: list[dict]):
+    round_ids = [r["id"] for r in rounds]
+    found = set(db.scalars(select(models.Round.id).where(
+        models.Round.id.in_(round_ids), ledger.in_session(models.Round.session_id, session_id))))
+    if found != set(round_ids):
+        raise HTTPException(409, "These rounds have changed since")
+    # The snapshot's deltas are only the rows' (and the ledger's) while every player in it is still there
+    player_ids = {p for r in rounds for p, _ in r["scores"]}
+    if len(set(db.scalars(select(models.Player.id).where(models.Player.id.in_(player_ids))))) != len(player_ids):
+        raise HTTPException(409, "A player in these rounds has been deleted since")
+    db.execute(delete(models.RoundScore).where(models.RoundScore.round_id.in_(round_ids)),
+               execution_options={"synchronize_session": False})
+    db.execute(delete(models.Round).where(models.Round.id.in_(round_ids)),
+               execution_options={"synchronize_session": False})
+    ledger.apply_scores(db, session_id, [(p, d) for r in rounds for p, d in r["scores"]], -1)
+    ledger.apply_rounds(db, session_id, -len(rounds))
+    progression.refresh(db, session_id, min(round_ids))
+
+def _apply(db: Session, entry: models.JournalEntry, forward: bool) -> dict:
+    """Redo (forward) or undo an entry's change; returns its (possibly updated) data."""
+    data = json.loads(entry.data)
+    if entry.action == "player_edited":
+        player = db.get(models.Player, data["player_id"])
+        if player is None:
+            raise HTTPException(409, "Player has been deleted since")
+        for field, value in data["after" if forward else "before"].items():
+            setattr(player, field, value)
+    elif (entry.action == "round_added") == forward:
+        _insert_rounds(db, entry.session_id, data["rounds"])
+        entry.data = json.dumps(data, separators=(",", ":"))
+    else:
+        _remove_rounds(db, entry.session_id, data["rounds"])
+    entry.undone = not forward
+    return data
+
+def step(db: Session, session_id: int | None, redo: bool, actor_ip: str | None = None) -> tuple[models.JournalEntry, dict]:
+    """Undo the latest change (or redo the latest undone one); returns the new undo/redo entry and the
+    standings delta it applied, as {player_id: delta}."""
+    target = (_redo_target if redo else _undo_target)(db, session_id)
+    if target is None:
+        raise HTTPException(409, "Nothing to redo" if redo else "Nothing to undo")
+    data = _apply(db, target, forward=redo)
+    sign = 1 if redo else -1
+    delta = {k: sign * v for k, v in data.get("delta", {}).items()}
+    entry = record(db, session_id, "redo" if redo else "undo", {"action": target.action, "delta": delta},
+                   actor_ip=actor_ip, target_id=target.id)
+    return entry, delta
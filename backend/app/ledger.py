@@ -0,0 +1,116 @@
+from sqlalchemy import func, case, or_, select
+from sqlalchemy.orm import Session
+from . import models
+
+def in_session(column, session_id: int | None):
+    return column == session_id if session_id else column.is_(None)
+
+def session_players(session_id: int | None, player_ids):
+    """The ids among player_ids of the session's own players, the only ones its rounds may score."""
+    return select(models.Player.id).where(models.Player.id.in_(player_ids),
+                                          in_session(models.Player.session_id, session_id))
+
+def apply_scores(db: Session, session_id: int | None, scores, sign: int = 1):
+    """Add (sign=1) or remove (sign=-1) one round's (player_id, delta) pairs from the running totals."""
+    scores = list(scores)
+    if not scores:
+        return
+    player_ids = [player_id for player_id, _ in scores]
+    rows = {t.player_id: t for t in db.query(models.PlayerTotal).filter(
+        in_session(models.PlayerTotal.session_id, session_id),
+        models.PlayerTotal.player_id.in_(player_ids)
+    )}
+    for player_id, delta in scores:
+        total = rows.get(player_id)
+        if total is None:
+            total = models.PlayerTotal(session_id=session_id, player_id=player_id, score=0, rounds=0, wins=0)
+            db.add(total)
+            rows[player_id] = total
+        total.score += sign * delta
+        total.rounds += sign
+        if delta > 0:
+            total.wins += sign
+
+def apply_rounds(db: Session, session_id: int | None, count: int):
+    """Add (or, with a negative count, remove) rounds from the session's round count."""
+    total = db.query(models.SessionTotal).filter(in_session(models.SessionTotal.session_id, session_id)).first()
+    if total is None:
+        total = models.SessionTotal(session_id=session_id, rounds=0)
+        db.add(total)
+    total.rounds += count
+
+def clear_session(db: Session, session_id: int | None):
+    db.query(models.PlayerTotal).filter(
+        in_session(models.PlayerTotal.session_id, session_id)
+    ).delete(synchronize_session=False)
+    db.query(models.SessionTotal).filter(
+        in_session(models.SessionTotal.session_id, session_id)
+    ).delete(synchronize_session=False)
+
+def compute_totals(db: Session) -> dict[tuple[int | None, int], tuple[int, int, int]]:
+    """Recompute (score, rounds, wins) per (session_id, player_id) straight from round_scores."""
+    rows = db.query(
+        models.Round.session_id, models.RoundScore.player_id,
+        func.sum(models.RoundScore.delta), func.count(models.RoundScore.id),
+        func.sum(case((models.RoundScore.delta > 0, 1), else_=0))
+    ).join(models.Round, models.RoundScore.round_id == models.Round.id).group_by(
+        models.Round.session_id, models.RoundScore.player_id
+    ).all()
+    return {(s, p): (score, rounds, wins) for s, p, score, rounds, wins in rows}
+
+def archived_session_ids(db: Session) -> set[int]:
+    """Sessions whose rounds live in session_archives; their stored totals are kept as they are."""
+    return set(db.scalars(select(models.Session.id).where(models.Session.archived_at.is_not(None))))
+
+def not_archived(column, archived: set[int]):
+    return or_(column.is_(None), column.not_in(archived))
+
+def compute_session_totals(db: Session) -> dict[int | None, int]:
+    return dict(db.query(models.Round.session_id, func.count(models.Round.id)).group_by(models.Round.session_id).all())
+
+def find_drift(db: Session) -> list[dict]:
+    """Compare stored totals against round_scores; returns one entry per mismatching (session, player).
+
+    Session round counts are checked too and reported with player_id None. Archived sessions are skipped.
+    """
+    archived = archived_session_ids(db)
+    expected = compute_totals(db)
+    stored = {(t.session_id, t.player_id): (t.score, t.rounds, t.wins) for t in db.query(models.PlayerTotal).filter(
+        not_archived(models.PlayerTotal.session_id, archived))}
+    drift = []
+    expected_rounds = compute_session_totals(db)
+    stored_rounds = {t.session_id: t.rounds for t in db.query(models.SessionTotal).filter(
+        not_archived(models.SessionTotal.session_id, archived))}
+    for session_id in sorted(set(expected_rounds) | set(stored_rounds), key=lambda s: s or 0):
+        want, have = expected_rounds.get(session_id, 0), stored_rounds.get(session_id, 0)
+        if want != have:
+            drift.append({"session_id": session_id, "player_id": None,
+                          "expected": {"rounds": want}, "stored": {"rounds": have}})
+    for key in sorted(set(expected) | set(stored), key=lambda k: (k[0] or 0, k[1])):
+        want = expected.get(key, (0, 0, 0))
+        have = stored.get(key, (0, 0, 0))
+        if want != have:
+            drift.append({"session_id": key[0], "player_id": key[1],
+                          "expected": dict(zip(("score", "rounds", "wins"), want)),
+                          "stored": dict(zip(("score", "rounds", "wins"), have))})
+    return drift
+
+def rebuild(db: Session) -> list[dict]:
+    """Replace every stored total with values recomputed from round_scores. Returns the drift that was fixed."""
+    drift = find_drift(db)
+    archived = archived_session_ids(db)
+    db.query(models.PlayerTotal).filter(not_archived(models.PlayerTotal.session_id, archived)).delete(
+        synchronize_session=False)
+    db.add_all(models.PlayerTotal(session_id=s, player_id=p, score=score, rounds=rounds, wins=wins)
+               for (s, p), (score, rounds, wins) in compute_totals(db).items())
+    db.query(models.SessionTotal).filter(not_archived(models.SessionTotal.session_id, archived)).delete(
+        synchronize_session=False)
+    db.add_all(models.SessionTotal(session_id=s, rounds=rounds) for s, rounds in compute_session_totals(db).items())
+    return drift
+
+def ensure_built(db: Session):
+    """Populate the ledger once for databases that predate it."""
+    if db.query(models.PlayerTotal.id).first() is None and db.query(models.RoundScore.id).first() is not None:
+        db.add_all(models.PlayerTotal(session_id=s, player_id=p, score=score, rounds=rounds, wins=wins)
+                   for (s, p), (score, rounds, wins) in compute_totals(db).items())
+        db.flush()
@@ -0,0 +1,200 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import asynccontextmanager, closing
+
+EVENTS_BROKER = os.environ.get("MAHJONG_EVENTS_BROKER")  # path to a shared SQLite file, unset = in-process only
+
+log = logging.getLogger("mahjong.live")
+
+class LocalBackend:
+    """Delivers events to subscribers of this process only."""
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self._deliver = None
+
+    async def start(self, deliver) -> int:
+        self._deliver = deliver
+        return 0
+
+    async def stop(self):
+        self._deliver = None
+
+    def publish(self, event: dict):
+        event["id"] = next(self._ids)
+        if self._deliver:
+            self._deliver(event)
+
+class SQLiteBrokerBackend:
+    """Fans events out across uvicorn workers on one host through a shared SQLite table.
+
+    Each worker runs a single poller, so the broker is read once per interval
+    regardless of how many clients are connected, and a single writer task, so
+    publishing never blocks the event loop: events are queued and written in
+    batches from a worker thread, with old rows pruned every ``prune_interval``.
+    """
+    def __init__(self, path: str, interval: float = 0.25, retention: float = 300, prune_interval: float = 30):
+        self.path = path
+        self.interval = interval
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self._loop = None
+        self._queue: asyncio.Queue | None = None
+        self._tasks = []
+        self._writer = None
+        self._writer_lock = threading.Lock()  # a batch still being written when stop() flushes the rest
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _setup(self) -> int:
+        with closing(self._connect()) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                         "created REAL NOT NULL, body TEXT NOT NULL)")
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    async def start(self, deliver) -> int:
+        last_id = await asyncio.to_thread(self._setup)
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._writer = await asyncio.to_thread(self._connect)
+        self._tasks = [asyncio.create_task(self._poll(deliver, last_id)), asyncio.create_task(self._write())]
+        return last_id
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        pending = self._drain()
+        if pending:
+            await asyncio.to_thread(self._insert, pending, False)
+        with self._writer_lock:
+            self._writer.close()
+        self._loop = self._queue = self._writer = None
+
+    def publish(self, event: dict):
+        if self._loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._queue.put_nowait(event)
+        else:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, event)
+
+    def _drain(self) -> list[dict]:
+        events = []
+        while self._queue is not None and not self._queue.empty():
+            events.append(self._queue.get_nowait())
+        return events
+
+    def _insert(self, events: list[dict], prune: bool):
+        now = time.time()
+        with self._writer_lock:
+            conn = self._writer
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany("INSERT INTO events (created, body) VALUES (?, ?)",
+                                 [(now, json.dumps(event)) for event in events])
+                if prune:
+                    conn.execute("DELETE FROM events WHERE created < ?", (now - self.retention,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    async def _write(self):
+        pruned = 0.0
+        while True:
+            events = [await self._queue.get()] + self._drain()
+            prune = time.monotonic() - pruned >= self.prune_interval
+            try:
+                await asyncio.to_thread(self._insert, events, prune)
+            except sqlite3.Error:
+                log.exception("Dropped %d event(s): broker write failed", len(events))
+                continue
+            if prune:
+                pruned = time.monotonic()
+
+    def _fetch(self, last_id: int):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT id, body FROM events WHERE id > ? ORDER BY id", (last_id,)).fetchall()
+
+    async def _poll(self, deliver, last_id: int):
+        while True:
+            for row_id, body in await asyncio.to_thread(self._fetch, last_id):
+                last_id = row_id
+                deliver({**json.loads(body), "id": row_id})
+            await asyncio.sleep(self.interval)
+
+class Hub:
+    """Pub/sub hub between mutating routers and connected event-stream clients."""
+    def __init__(self, backend):
+        self.backend = backend
+        self.last_id = 0
+        self._loop = None
+        self._subscribers: set[asyncio.Queue] = set()
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Register an in-process callback invoked on the event loop for every delivered event."""
+        self._listeners.append(callback)
+
+    @asynccontextmanager
+    async def running(self):
+        self._loop = asyncio.get_running_loop()
+        self.last_id = await self.backend.start(self._deliver)
+        try:
+            yield self
+        finally:
+            await self.backend.stop()
+            self._loop = None
+
+    def publish(self, event_type: str, session_id: int | None, *, table: str, **payload):
+        """Publish after a commit to the table's streams. Safe to call from threadpool handlers; a no-op when the
+        hub isn't running."""
+        if self._loop is None:
+            return
+        self.backend.publish({"type": event_type, "session_id": session_id, "table": table, **payload})
+
+    def _deliver(self, event: dict):
+        if self._loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not self._loop:
+            self._loop.call_soon_threadsafe(self._deliver, event)
+            return
+        self.last_id = max(self.last_id, event["id"])
+        for callback in self._listeners:
+            callback(event)
+        for queue in self._subscribers:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Slow client: drop its backlog and tell it to refetch everything
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"type": "resync", "id": event["id"]})
+
+    @asynccontextmanager
+    async def subscribe(self, maxsize: int = 100):
+        queue = asyncio.Queue(maxsize=maxsize)
+        self._subscribers.add(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers.discard(queue)
+
+hub = Hub(SQLiteBrokerBackend(EVENTS_BROKER) if EVENTS_BROKER else LocalBackend())
@@ -1,13 +1,35 @@
+import time
+_import_started = time.perf_counter()
+
+from contextlib import asynccontextmanager, AsyncExitStack
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from .database import engine, Base
-from .routers import players, rounds, game, admin, sessions
-import os
+from starlette.concurrency import run_in_threadpool
+from .database import engine, async_engine
+from . import migrations, metrics, versioning, avatars
+from .avatars import AVATARS_DIR, AvatarFiles
+from .live import hub
+from .startup import StartupReport
+from .routers import players, rounds, game, admin, sessions, events, analytics, journal
 
-Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    report = StartupReport()
+    report.add("import", IMPORT_SECONDS)
+    async with AsyncExitStack() as stack:
+        with report.step("migrations"):
+            await run_in_threadpool(migrations.upgrade, engine)
+        with report.step("avatar storage"):
+            avatars.ensure_dir()
+        with report.step("version cache"):
+            versioning.load_all()
+        with report.step("event hub"):
+            await stack.enter_async_context(hub.running())
+        report.finish()
+        yield
 
-app = FastAPI(title="Mahjong Tracker API")
+app = FastAPI(title="Mahjong Tracker API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,19 +37,30 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Query-Count", "X-SQL-Time-Ms", "ETag"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.instrument(engine)
+metrics.instrument(async_engine.sync_engine)
 
 app.include_router(players.router)
 app.include_router(rounds.router)
 app.include_router(game.router)
 app.include_router(admin.router)
 app.include_router(sessions.router)
+app.include_router(events.router)
+app.include_router(analytics.router)
+app.include_router(journal.router)
 
-# Serve avatars
-avatars_dir = os.path.join(os.path.dirname(__file__), "..", "..", "static", "avatars")
-if os.path.exists(avatars_dir):
-    app.mount("/static/avatars", StaticFiles(directory=avatars_dir), name="avatars")
+# Serve avatars (content-addressed, so cacheable forever); the directory is created at startup
+app.mount("/static/avatars", AvatarFiles(directory=AVATARS_DIR, check_dir=False), name="avatars")
 
 @app.get("/api/health")
 def health():
     return {"status": "ok"}
+
+@app.get("/api/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
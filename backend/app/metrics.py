@@ -0,0 +1,159 @@
+"""Per-route request latency, SQL query counts and a slow-query log, exported as Prometheus text.
+
+Thresholds come from MAHJONG_SLOW_QUERY_MS (default 100) and MAHJONG_SLOW_REQUEST_MS
+(default 1000). Requests sent with ``X-Debug-Queries: 1`` (or every request when
+MAHJONG_DEBUG_QUERIES=1) get X-Query-Count and X-SQL-Time-Ms response headers.
+"""
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from sqlalchemy import event
+
+SLOW_QUERY_SECONDS = float(os.environ.get("MAHJONG_SLOW_QUERY_MS", 100)) / 1000
+SLOW_REQUEST_SECONDS = float(os.environ.get("MAHJONG_SLOW_REQUEST_MS", 1000)) / 1000
+DEBUG_QUERIES = os.environ.get("MAHJONG_DEBUG_QUERIES") == "1"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+log = logging.getLogger("mahjong.metrics")
+
+class RequestStats:
+    __slots__ = ("queries", "sql_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+
+class RouteMetrics:
+    __slots__ = ("buckets", "count", "seconds", "queries", "sql_seconds", "statuses")
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.statuses = defaultdict(int)
+
+_current: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+_routes: dict[tuple[str, str], RouteMetrics] = defaultdict(RouteMetrics)
+_slow_queries = 0
+_startup: list[tuple[str, float]] = []
+_lock = threading.Lock()
+
+def instrument(engine):
+    """Count and time every statement run on a (sync) engine; async engines pass ``.sync_engine``."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        global _slow_queries
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        stats = _current.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.sql_seconds += elapsed
+        if elapsed >= SLOW_QUERY_SECONDS:
+            with _lock:
+                _slow_queries += 1
+            log.warning("slow query (%.1f ms): %s", elapsed * 1000, " ".join(statement.split())[:500])
+
+def record(method: str, route: str, status: int, seconds: float, stats: RequestStats):
+    with _lock:
+        metrics = _routes[method, route]
+        metrics.count += 1
+        metrics.seconds += seconds
+        metrics.queries += stats.queries
+        metrics.sql_seconds += stats.sql_seconds
+        metrics.statuses[status] += 1
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                metrics.buckets[i] += 1
+
+class MetricsMiddleware:
+    """ASGI middleware; streaming responses (the event stream) are not timed."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        debug = DEBUG_QUERIES or (b"x-debug-queries", b"1") in scope["headers"]
+        response = {"status": 500, "streaming": False}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                headers = message.setdefault("headers", [])
+                response["streaming"] = any(k == b"content-type" and v.startswith(b"text/event-stream")
+                                            for k, v in headers)
+                if debug:
+                    headers.append((b"x-query-count", str(stats.queries).encode()))
+                    headers.append((b"x-sql-time-ms", f"{stats.sql_seconds * 1000:.1f}".encode()))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            if not response["streaming"]:
+                elapsed = time.perf_counter() - start
+                route = scope.get("route")
+                # Label by route template, not raw path, to keep the series count bounded
+                path = getattr(route, "path", None) or "unmatched"
+                record(scope["method"], path, response["status"], elapsed, stats)
+                if elapsed >= SLOW_REQUEST_SECONDS:
+                    log.warning("slow request (%.1f ms, %d queries, %.1f ms SQL): %s %s", elapsed * 1000,
+                                stats.queries, stats.sql_seconds * 1000, scope["method"], scope["path"])
+
+def record_startup(steps: list[tuple[str, float]]):
+    with _lock:
+        _startup[:] = steps
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+def render() -> str:
+    """All collected metrics in the Prometheus text exposition format."""
+    with _lock:
+        routes = sorted(_routes.items())
+        slow_queries = _slow_queries
+        startup = list(_startup)
+        lines = [
+            "# HELP mahjong_http_request_duration_seconds Request latency by route.",
+            "# TYPE mahjong_http_request_duration_seconds histogram",
+        ]
+        for (method, route), m in routes:
+            for bound, count in zip(BUCKETS, m.buckets):
+                lines.append(f"mahjong_http_request_duration_seconds_bucket{_labels(method=method, route=route, le=bound)} {count}")
+            lines.append(f"mahjong_http_request_duration_seconds_bucket{_labels(method=method, route=route, le='+Inf')} {m.count}")
+            lines.append(f"mahjong_http_request_duration_seconds_sum{_labels(method=method, route=route)} {m.seconds}")
+            lines.append(f"mahjong_http_request_duration_seconds_count{_labels(method=method, route=route)} {m.count}")
+        lines += ["# HELP mahjong_http_requests_total Requests by route and status.",
+                  "# TYPE mahjong_http_requests_total counter"]
+        for (method, route), m in routes:
+            for status, count in sorted(m.statuses.items()):
+                lines.append(f"mahjong_http_requests_total{_labels(method=method, route=route, status=status)} {count}")
+        lines += ["# HELP mahjong_db_queries_total SQL statements issued while serving each route.",
+                  "# TYPE mahjong_db_queries_total counter"]
+        lines += [f"mahjong_db_queries_total{_labels(method=method, route=route)} {m.queries}" for (method, route), m in routes]
+        lines += ["# HELP mahjong_db_query_seconds_total Time spent in SQL while serving each route.",
+                  "# TYPE mahjong_db_query_seconds_total counter"]
+        lines += [f"mahjong_db_query_seconds_total{_labels(method=method, route=route)} {m.sql_seconds}"
+                  for (method, route), m in routes]
+    lines += ["# HELP mahjong_db_slow_queries_total Statements slower than the slow-query threshold.",
+              "# TYPE mahjong_db_slow_queries_total counter",
+              f"mahjong_db_slow_queries_total {slow_queries}",
+              "# HELP mahjong_startup_seconds Time spent in each startup step of this worker.",
+              "# TYPE mahjong_startup_seconds gauge"]
+    lines += [f"mahjong_startup_seconds{_labels(step=name)} {seconds}" for name, seconds in startup]
+    return "\n".join(lines) + "\n"
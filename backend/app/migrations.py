@@ -0,0 +1,171 @@
+"""Versioned schema migrations, tracked in SQLite's PRAGMA user_version.
+
+Append new steps to MIGRATIONS; never edit or reorder applied ones. Steps must
+tolerate a fresh database, where the baseline already creates every table from
+the current models.
+"""
+from sqlalchemy import Connection, Engine, Table
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.orm import Session
+from .database import Base
+from . import ledger, admin_code, analytics, archive, models, progression
+
+def baseline(conn: Connection):
+    Base.metadata.create_all(bind=conn)
+
+def hot_path_indexes(conn: Connection):
+    for statement in (
+        "CREATE INDEX IF NOT EXISTS ix_sessions_is_active ON sessions (is_active)",
+        "CREATE INDEX IF NOT EXISTS ix_players_session_id ON players (session_id)",
+        "CREATE INDEX IF NOT EXISTS ix_rounds_session_id_id ON rounds (session_id, id)",
+        "CREATE INDEX IF NOT EXISTS ix_round_scores_round_player_delta ON round_scores (round_id, player_id, delta)",
+        "CREATE INDEX IF NOT EXISTS ix_round_scores_player_round_delta ON round_scores (player_id, round_id, delta)",
+        "ANALYZE",
+    ):
+        conn.exec_driver_sql(statement)
+
+def populate_player_totals(conn: Connection):
+    with Session(bind=conn) as db:
+        ledger.ensure_built(db)
+
+def round_client_keys(conn: Connection):
+    add_column(conn, "rounds", "client_key", "VARCHAR(64)")
+    conn.exec_driver_sql("CREATE UNIQUE INDEX IF NOT EXISTS ix_rounds_client_key ON rounds (client_key)")
+
+def hash_admin_code(conn: Connection):
+    row = conn.exec_driver_sql("SELECT value FROM settings WHERE key = 'admin_code'").first()
+    if row and not admin_code.is_hashed(row[0]):
+        conn.exec_driver_sql("UPDATE settings SET value = ? WHERE key = 'admin_code'", (admin_code.hash_code(row[0]),))
+
+def cross_session_rollups(conn: Connection):
+    Base.metadata.create_all(bind=conn, tables=[models.PlayerIdentity.__table__, models.SessionTotal.__table__])
+    add_column(conn, "players", "identity_id", "INTEGER REFERENCES player_identities (id)")
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_players_identity_id ON players (identity_id)")
+    with Session(bind=conn) as db:
+        analytics.link_players(db)
+        if db.query(models.SessionTotal.id).first() is None:
+            db.add_all(models.SessionTotal(session_id=s, rounds=rounds)
+                       for s, rounds in ledger.compute_session_totals(db).items())
+        db.flush()
+
+def session_archives(conn: Connection):
+    Base.metadata.create_all(bind=conn, tables=[models.SessionArchive.__table__])
+    add_column(conn, "sessions", "archived_at", "DATETIME")
+    # Rows orphaned while foreign keys were not enforced (deleted sessions and players)
+    for statement in (
+        "DELETE FROM rounds WHERE session_id IS NOT NULL AND session_id NOT IN (SELECT id FROM sessions)",
+        "DELETE FROM round_scores WHERE round_id NOT IN (SELECT id FROM rounds)",
+        "DELETE FROM round_scores WHERE player_id IN (SELECT id FROM players WHERE session_id IS NOT NULL "
+        "AND session_id NOT IN (SELECT id FROM sessions))",
+        "DELETE FROM player_totals WHERE player_id IN (SELECT id FROM players WHERE session_id IS NOT NULL "
+        "AND session_id NOT IN (SELECT id FROM sessions))",
+        "DELETE FROM players WHERE session_id IS NOT NULL AND session_id NOT IN (SELECT id FROM sessions)",
+        "DELETE FROM round_scores WHERE player_id NOT IN (SELECT id FROM players)",
+        "UPDATE rounds SET recorder_id = NULL WHERE recorder_id NOT IN (SELECT id FROM players)",
+        "DELETE FROM player_totals WHERE player_id NOT IN (SELECT id FROM players) "
+        "OR session_id NOT IN (SELECT id FROM sessions)",
+        "DELETE FROM session_totals WHERE session_id NOT IN (SELECT id FROM sessions)",
+    ):
+        conn.exec_driver_sql(statement)
+
+def operation_journal(conn: Connection):
+    Base.metadata.create_all(bind=conn, tables=[models.JournalEntry.__table__])
+
+def journal_revisions(conn: Connection):
+    add_column(conn, "journal", "revision", "INTEGER")
+
+def session_tables(conn: Connection):
+    add_column(conn, "sessions", "table_key", "VARCHAR(40) NOT NULL DEFAULT 'default'")
+    # Everything so far belongs to the default table, which may have had several sessions flagged active
+    conn.exec_driver_sql("UPDATE sessions SET is_active = 0 WHERE is_active "
+                         "AND id <> (SELECT MAX(id) FROM sessions WHERE is_active)")
+    conn.exec_driver_sql("CREATE UNIQUE INDEX IF NOT EXISTS ix_sessions_table_active ON sessions (table_key) "
+                         "WHERE is_active")
+
+def round_standings(conn: Connection):
+    Base.metadata.create_all(bind=conn, tables=[models.RoundStanding.__table__])
+    with Session(bind=conn) as db:
+        progression.rebuild_all(db)
+        db.flush()
+
+def autoincrement_ids(conn: Connection):
+    for model in (models.Round, models.Player):
+        rebuild_with_autoincrement(conn, model.__table__)
+
+def seed_round_ids(conn: Connection):
+    # Step 12 seeded the sequence from the rounds table alone, which archived sessions' rounds had left
+    highest = archive.highest_round_id(conn)
+    if conn.exec_driver_sql("SELECT 1 FROM sqlite_sequence WHERE name = 'rounds'").first():
+        conn.exec_driver_sql("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'rounds'", (highest,))
+    elif highest:
+        conn.exec_driver_sql("INSERT INTO sqlite_sequence (name, seq) VALUES ('rounds', ?)", (highest,))
+
+MIGRATIONS = [
+    (1, "baseline schema", baseline),
+    (2, "hot path indexes", hot_path_indexes),
+    (3, "populate player totals", populate_player_totals),
+    (4, "round idempotency keys", round_client_keys),
+    (5, "hash admin code", hash_admin_code),
+    (6, "cross-session rollups", cross_session_rollups),
+    (7, "session archives and orphan cleanup", session_archives),
+    (8, "operation journal", operation_journal),
+    (9, "journal revisions", journal_revisions),
+    (10, "per-table active sessions", session_tables),
+    (11, "round standings", round_standings),
+    (12, "never reuse round and player ids", autoincrement_ids),
+    (13, "never reuse archived round ids", seed_round_ids),
+]
+
+def schema_version(conn: Connection) -> int:
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+def add_column(conn: Connection, table: str, column: str, ddl: str):
+    """ALTER TABLE ADD COLUMN unless the baseline already created it."""
+    existing = {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+    if column not in existing:
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+def rebuild_with_autoincrement(conn: Connection, table: Table):
+    """Recreate a table from its (sqlite_autoincrement) model, keeping rows and ids; SQLite can't ALTER that in.
+
+    Runs with foreign keys off, as every step does, so dropping the old table leaves the references to it in
+    place; they point at the new one once it takes the name.
+    """
+    if "AUTOINCREMENT" in conn.exec_driver_sql("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                               (table.name,)).scalar():
+        return
+    ddl = str(CreateTable(table).compile(conn))
+    conn.exec_driver_sql(ddl.replace(f"CREATE TABLE {table.name} ", f"CREATE TABLE {table.name}_new ", 1))
+    columns = ", ".join(column.name for column in table.columns)
+    conn.exec_driver_sql(f"INSERT INTO {table.name}_new ({columns}) SELECT {columns} FROM {table.name}")
+    conn.exec_driver_sql(f"DROP TABLE {table.name}")
+    conn.exec_driver_sql(f"ALTER TABLE {table.name}_new RENAME TO {table.name}")
+    for index in table.indexes:
+        index.create(conn)
+    conn.exec_driver_sql(f"ANALYZE {table.name}")  # dropping the old table dropped its planner statistics
+
+def upgrade(engine: Engine, log=print) -> int:
+    """Apply pending migrations, each in its own transaction. Safe to run from several workers at once."""
+    with engine.connect() as conn:
+        # Up to date (the usual case on a restart): one read, no write locks
+        if (current := schema_version(conn)) >= MIGRATIONS[-1][0]:
+            return current
+    for version, name, step in MIGRATIONS:
+        with engine.connect() as conn:
+            # Older databases can hold orphaned rows (cleaned up by step 7); don't let them fail earlier steps
+            conn.exec_driver_sql("PRAGMA foreign_keys = OFF")
+            try:
+                # Take the write lock before reading the version so concurrent workers apply each step once
+                conn.exec_driver_sql("BEGIN IMMEDIATE")
+                if schema_version(conn) >= version:
+                    conn.rollback()
+                    continue
+                step(conn)
+                conn.exec_driver_sql(f"PRAGMA user_version = {version}")
+                conn.commit()
+                log(f"Applied migration {version}: {name}")
+            finally:
+                conn.rollback()
+                conn.exec_driver_sql("PRAGMA foreign_keys = ON")
+    with engine.connect() as conn:
+        return schema_version(conn)
@@ -1,34 +1,57 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Boolean, UniqueConstraint, Index, LargeBinary
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from .database import Base
 
 class Session(Base):
     __tablename__ = "sessions"
+    # At most one active session per table
+    __table_args__ = (Index("ix_sessions_table_active", "table_key", unique=True, sqlite_where=text("is_active")),)
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100), nullable=False)
     created_at = Column(DateTime, server_default=func.now())
-    is_active = Column(Boolean, default=False)
+    is_active = Column(Boolean, default=False, index=True)
+    table_key = Column(String(40), nullable=False, default="default", server_default="default")
+    archived_at = Column(DateTime, nullable=True)  # rounds moved to session_archives
     rounds = relationship("Round", back_populates="session")
     players = relationship("Player", back_populates="session")
 
 class Player(Base):
     __tablename__ = "players"
+    # Ids are never reused, so a journal snapshot can't point at a newer player
+    __table_args__ = {"sqlite_autoincrement": True}
     id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(Integer, ForeignKey("sessions.id"), nullable=True)
+    session_id = Column(Integer, ForeignKey("sessions.id"), nullable=True, index=True)
     name = Column(String(100), nullable=False)
     color = Column(String(7), default="#808080")
     avatar_path = Column(Text, nullable=True)
+    identity_id = Column(Integer, ForeignKey("player_identities.id"), nullable=True, index=True)
     created_at = Column(DateTime, server_default=func.now())
     scores = relationship("RoundScore", back_populates="player")
     session = relationship("Session", back_populates="players")
+    identity = relationship("PlayerIdentity")
+
+class PlayerIdentity(Base):
+    """The same person across sessions; players are linked by normalized name unless linked explicitly."""
+    __tablename__ = "player_identities"
+    id = Column(Integer, primary_key=True)
+    key = Column(String(100), nullable=False, unique=True)
+    name = Column(String(100), nullable=False)
 
 class Round(Base):
     __tablename__ = "rounds"
+    # Session listing and keyset pagination walk (session_id, id); ids are never reused, so since_id sync
+    # can't miss a round that took a deleted round's id
+    __table_args__ = (
+        Index("ix_rounds_session_id_id", "session_id", "id"),
+        Index("ix_rounds_client_key", "client_key", unique=True),
+        {"sqlite_autoincrement": True},
+    )
     id = Column(Integer, primary_key=True, index=True)
     session_id = Column(Integer, ForeignKey("sessions.id"), nullable=True)
     recorder_id = Column(Integer, ForeignKey("players.id"), nullable=True)
     recorder_ip = Column(String(45), nullable=True)
+    client_key = Column(String(64), nullable=True)  # client-supplied idempotency key
     created_at = Column(DateTime, server_default=func.now())
     scores = relationship("RoundScore", back_populates="round", cascade="all, delete-orphan")
     recorder = relationship("Player")
@@ -36,6 +59,11 @@ class Round(Base):
 
 class RoundScore(Base):
     __tablename__ = "round_scores"
+    # Covering indexes: per-round reads (statistics, round lists) and per-player reads (ledger rebuild, lock check)
+    __table_args__ = (
+        Index("ix_round_scores_round_player_delta", "round_id", "player_id", "delta"),
+        Index("ix_round_scores_player_round_delta", "player_id", "round_id", "delta"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     round_id = Column(Integer, ForeignKey("rounds.id", ondelete="CASCADE"), nullable=False)
     player_id = Column(Integer, ForeignKey("players.id"), nullable=False)
@@ -43,6 +71,66 @@ class RoundScore(Base):
     round = relationship("Round", back_populates="scores")
     player = relationship("Player", back_populates="scores")
 
+class PlayerTotal(Base):
+    """Running totals per (session, player), maintained alongside round_scores."""
+    __tablename__ = "player_totals"
+    __table_args__ = (UniqueConstraint("session_id", "player_id"),)
+    id = Column(Integer, primary_key=True)
+    session_id = Column(Integer, ForeignKey("sessions.id"), nullable=True, index=True)
+    player_id = Column(Integer, ForeignKey("players.id"), nullable=False, index=True)
+    score = Column(Integer, nullable=False, default=0)
+    rounds = Column(Integer, nullable=False, default=0)
+    wins = Column(Integer, nullable=False, default=0)
+
+class SessionTotal(Base):
+    """Round count per session, maintained alongside player_totals."""
+    __tablename__ = "session_totals"
+    __table_args__ = (UniqueConstraint("session_id"),)
+    id = Column(Integer, primary_key=True)
+    session_id = Column(Integer, ForeignKey("sessions.id"), nullable=True)
+    rounds = Column(Integer, nullable=False, default=0)
+
+class RoundStanding(Base):
+    """Every player's cumulative score and rank after each round of a session, maintained alongside rounds."""
+    __tablename__ = "round_standings"
+    __table_args__ = (
+        Index("ix_round_standings_session_round", "session_id", "round_id"),
+        Index("ix_round_standings_session_seq", "session_id", "seq"),
+    )
+    round_id = Column(Integer, primary_key=True)  # no FK: archiving a session keeps its snapshots
+    session_id = Column(Integer, ForeignKey("sessions.id"), nullable=True)
+    seq = Column(Integer, nullable=False)  # 1-based position of the round in its session
+    standings = Column(Text, nullable=False)  # JSON {player_id: [score, rank]} over players who have played
+
+class SessionArchive(Base):
+    """Cold storage for an archived session's rounds and scores, as one compressed columnar blob."""
+    __tablename__ = "session_archives"
+    session_id = Column(Integer, ForeignKey("sessions.id"), primary_key=True)
+    rounds = Column(Integer, nullable=False)
+    payload = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+
+class JournalEntry(Base):
+    """Append-only log of undoable changes per session, plus the undos and redos applied to them."""
+    __tablename__ = "journal"
+    __table_args__ = (Index("ix_journal_session_id_id", "session_id", "id"),)
+    id = Column(Integer, primary_key=True)
+    session_id = Column(Integer, ForeignKey("sessions.id"), nullable=True)
+    action = Column(String(20), nullable=False)
+    target_id = Column(Integer, ForeignKey("journal.id"), nullable=True)  # entry an undo/redo applies to
+    data = Column(Text, nullable=False)  # JSON: round snapshots and standings delta, or player fields before/after
+    undone = Column(Boolean, nullable=False, default=False)
+    revision = Column(Integer, nullable=True)  # session revision this entry produced
+    actor_id = Column(Integer, nullable=True)  # recording player, when known; no FK so deleting players keeps history
+    actor_ip = Column(String(45), nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+
+class DataVersion(Base):
+    """Monotonic change counter per cache scope, used for ETags."""
+    __tablename__ = "data_versions"
+    scope = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
 class Setting(Base):
     __tablename__ = "settings"
     key = Column(String(50), primary_key=True)
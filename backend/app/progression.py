@@ -0,0 +1,83 @@
+"""Score progression: every player's cumulative score and rank after each round.
+
+One round_standings row per round holds the standings after it, so a chart is
+a handful of indexed row reads however long the session is. Rows are written
+as rounds are recorded; removing (or re-inserting) a round rewrites the rows
+from that round on, which for the usual undo of the latest round is none.
+Archiving a session keeps its rows; restoring it rebuilds them.
+"""
+import json
+from itertools import groupby
+from operator import itemgetter
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+from . import models
+from .analytics import competition_ranks
+from .ledger import in_session
+
+def _in_session(session_id: int | None):
+    return in_session(models.RoundStanding.session_id, session_id)
+
+def refresh(db: Session, session_id: int | None, from_round_id: int = 0):
+    """Recompute the session's snapshots from ``from_round_id`` on. Call after the rounds and scores are
+    written (or deleted) in the same transaction."""
+    prev = db.execute(select(models.RoundStanding.seq, models.RoundStanding.standings).where(
+        _in_session(session_id), models.RoundStanding.round_id < from_round_id
+    ).order_by(models.RoundStanding.round_id.desc()).limit(1)).first()
+    seq, totals = 0, {}
+    if prev:
+        seq, totals = prev.seq, {int(p): score for p, (score, _) in json.loads(prev.standings).items()}
+    db.execute(delete(models.RoundStanding).where(_in_session(session_id),
+                                                  models.RoundStanding.round_id >= from_round_id),
+               execution_options={"synchronize_session": False})
+    rows = db.execute(select(models.Round.id, models.RoundScore.player_id, models.RoundScore.delta).outerjoin(
+        models.RoundScore, models.RoundScore.round_id == models.Round.id
+    ).where(in_session(models.Round.session_id, session_id), models.Round.id >= from_round_id).order_by(
+        models.Round.id, models.RoundScore.player_id))
+    snapshots = []
+    for round_id, group in groupby(rows, key=itemgetter(0)):
+        for _, player_id, delta in group:
+            if player_id is not None:
+                totals[player_id] = totals.get(player_id, 0) + delta
+        seq += 1
+        ranks = competition_ranks(totals)
+        snapshots.append({"round_id": round_id, "session_id": session_id, "seq": seq, "standings": json.dumps(
+            {player_id: [total, ranks[player_id]] for player_id, total in totals.items()}, separators=(",", ":"))})
+    if snapshots:
+        db.execute(insert(models.RoundStanding), snapshots)
+
+def clear(db: Session, session_id: int | None):
+    db.execute(delete(models.RoundStanding).where(_in_session(session_id)),
+               execution_options={"synchronize_session": False})
+
+def rebuild_all(db: Session):
+    """Recompute every session with rounds in the hot tables; archived sessions keep what they have."""
+    for session_id in db.scalars(select(models.Round.session_id).distinct()):
+        refresh(db, session_id)
+
+def sample(total: int, points: int) -> list[int]:
+    """``points`` evenly spaced positions out of 1..total, always including the first and the last."""
+    if total <= points:
+        return list(range(1, total + 1))
+    return sorted({1 + round(i * (total - 1) / (points - 1)) for i in range(points)})
+
+def progression(db: Session, session_id: int | None, points: int) -> dict:
+    """Scores and ranks after (at most) ``points`` of the session's rounds; players score 0 and have no rank
+    (None) before their first round."""
+    total = db.scalar(select(func.max(models.RoundStanding.seq)).where(_in_session(session_id))) or 0
+    rows = db.execute(select(models.RoundStanding.round_id, models.RoundStanding.seq,
+                             models.RoundStanding.standings).where(
+        _in_session(session_id), models.RoundStanding.seq.in_(sample(total, points))
+    ).order_by(models.RoundStanding.seq)).all()
+    scores: dict[int, list[int]] = {}
+    ranks: dict[int, list[int | None]] = {}
+    for index, row in enumerate(rows):
+        for player_id, (score, rank) in json.loads(row.standings).items():
+            player_id = int(player_id)
+            if player_id not in scores:
+                scores[player_id] = [0] * index
+                ranks[player_id] = [None] * index
+            scores[player_id].append(score)
+            ranks[player_id].append(rank)
+    return {"rounds": total, "round_ids": [row.round_id for row in rows], "positions": [row.seq for row in rows],
+            "scores": scores, "ranks": ranks}
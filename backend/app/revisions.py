@@ -0,0 +1,56 @@
+"""Optimistic concurrency for session writes.
+
+A session's revision is the version of its ``session:<id>`` cache scope: every
+committed write to the session moves it by one, and the session's ETags carry it.
+Round and player mutations may say which revision they were based on, with
+``If-Match`` (a bare number, or an ETag from GET /api/players, /api/rounds or
+/api/game/standings) or ``?expected_revision=``. When the session has moved on
+they get a 409 listing the journal entries recorded since.
+"""
+from fastapi import Header, HTTPException, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import versioning, journal
+
+def expected_revision(if_match: str | None = Header(None),
+                      expected_revision: int | None = Query(None, ge=0)) -> str | None:
+    if if_match is not None:
+        return if_match
+    return str(expected_revision) if expected_revision is not None else None
+
+def parse(value: str, session_id: int | None) -> int | None:
+    """The revision an If-Match value names; None for "*"."""
+    value = value.strip()
+    if value == "*":
+        return None
+    value = value.removeprefix("W/").strip('"')
+    if value.isdigit():
+        return int(value)
+    scope, _, version = value.rpartition(".")
+    if not (scope.startswith("session:") and version.isdigit()):
+        raise HTTPException(400, "If-Match must be a session revision or a session ETag")
+    if scope != versioning.session_scope(session_id):
+        raise HTTPException(409, "If-Match refers to another session")
+    return int(version)
+
+def etag(session_id: int | None, revision: int) -> str:
+    return f'W/"{versioning.session_scope(session_id)}.{revision}"'
+
+async def check(db: AsyncSession, session_id: int | None, expected: str | None):
+    """Reject a write based on a stale revision. Call before changing anything, so the read happens inside
+    the write transaction (which already holds SQLite's write lock)."""
+    if expected is None or (revision := parse(expected, session_id)) is None:
+        return
+    current = await db.run_sync(versioning.stored, versioning.session_scope(session_id))
+    if revision != current:
+        changes = await db.run_sync(journal.since, session_id, revision)
+        raise HTTPException(409, {"message": f"Session is at revision {current}, not {revision}", "revision": current,
+                                  "changes": [journal.to_schema(e).model_dump(mode="json") for e in changes]},
+                            headers={"ETag": etag(session_id, current)})
+
+async def set_etag(response: Response, db: AsyncSession, session_id: int | None):
+    """After a commit: the revision the write produced, for the client's next If-Match."""
+    scope = versioning.session_scope(session_id)
+    revision = versioning.committed(db, scope)
+    if revision is None:
+        revision = (await versioning.read(db, scope))[scope]
+    response.headers["ETag"] = etag(session_id, revision)
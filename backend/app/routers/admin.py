@@ -1,28 +1,28 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from .. import models, schemas
-from ..database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import schemas, admin_code
+from ..admin_code import limiter
+from ..database import get_async_db, get_read_db
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
 
-def get_admin_code(db: Session) -> str:
-    setting = db.query(models.Setting).filter(models.Setting.key == "admin_code").first()
-    return setting.value if setting else "8888"
+async def require_code(request: Request, db: AsyncSession, code: str):
+    client = request.client.host if request.client else "unknown"
+    limiter.take(client)
+    if not await admin_code.check(db, code):
+        raise HTTPException(401, "Invalid admin code")
+    limiter.succeed(client)
 
 @router.post("/verify")
-def verify_admin(data: schemas.AdminVerify, db: Session = Depends(get_db)):
-    if data.code != get_admin_code(db):
-        raise HTTPException(401, "Invalid admin code")
+async def verify_admin(data: schemas.AdminVerify, request: Request, db: AsyncSession = Depends(get_read_db)):
+    await require_code(request, db, data.code)
     return {"ok": True}
 
 @router.patch("/code")
-def change_admin_code(data: schemas.AdminCodeChange, db: Session = Depends(get_db)):
-    if data.old_code != get_admin_code(db):
-        raise HTTPException(401, "Invalid admin code")
-    setting = db.query(models.Setting).filter(models.Setting.key == "admin_code").first()
-    if setting:
-        setting.value = data.new_code
-    else:
-        db.add(models.Setting(key="admin_code", value=data.new_code))
-    db.commit()
+async def change_admin_code(data: schemas.AdminCodeChange, request: Request,
+                            read_db: AsyncSession = Depends(get_read_db), db: AsyncSession = Depends(get_async_db)):
+    # Check the old code outside the write transaction; change() hashes the new one before opening it
+    await require_code(request, read_db, data.old_code)
+    await admin_code.change(db, data.new_code)
+    await db.commit()
     return {"ok": True}
@@ -0,0 +1,49 @@
+from fastapi import APIRouter, Depends, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import analytics, versioning
+from ..database import get_async_db
+
+router = APIRouter(prefix="/api/analytics", tags=["analytics"])
+
+# Round changes bump SESSIONS and roster changes bump IDENTITIES, so results are cached per pair of versions
+SCOPES = (versioning.SESSIONS, versioning.IDENTITIES)
+_cache: dict[str, tuple[str, object]] = {}
+
+async def cached_result(request: Request, response: Response, db: AsyncSession, name: str, compute):
+    if cached := await versioning.not_modified(request, response, db, *SCOPES):
+        return cached
+    tag = response.headers["ETag"]
+    if name not in _cache or _cache[name][0] != tag:
+        _cache[name] = (tag, await db.run_sync(compute))
+    return _cache[name][1]
+
+@router.get("/leaderboard")
+async def get_leaderboard(request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
+    """All-time totals per player identity, across every session"""
+    return await cached_result(request, response, db, "leaderboard", analytics.leaderboard)
+
+@router.get("/sessions")
+async def get_session_summaries(request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
+    """Round count, player count and leader of every session"""
+    return await cached_result(request, response, db, "sessions", analytics.session_summaries)
+
+@router.get("/history")
+async def get_history(request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
+    """Cumulative score and rank of every identity after each session"""
+    return await cached_result(request, response, db, "history", analytics.history)
+
+@router.get("/series")
+async def get_series(request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
+    """Cumulative score of every identity after each session"""
+    result = await cached_result(request, response, db, "history", analytics.history)
+    if isinstance(result, Response):
+        return result
+    return {key: result[key] for key in ("session_ids", "names", "scores")}
+
+@router.get("/ranks")
+async def get_rank_history(request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
+    """Rank of every identity after each session (None before their first session)"""
+    result = await cached_result(request, response, db, "history", analytics.history)
+    if isinstance(result, Response):
+        return result
+    return {key: result[key] for key in ("session_ids", "names", "ranks")}
@@ -0,0 +1,46 @@
+import asyncio
+import json
+from fastapi import APIRouter, Depends, Header, Request
+from fastapi.responses import StreamingResponse
+from ..database import AsyncSessionLocal
+from .. import tables
+from ..live import hub
+from ..active_session import get_active_session_id
+from .game import standings_for
+
+router = APIRouter(prefix="/api/events", tags=["events"])
+
+KEEPALIVE_SECONDS = 15
+
+def format_event(event: dict) -> str:
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+async def resync_snapshot(table: str) -> dict:
+    async with AsyncSessionLocal() as db:
+        session_id = await get_active_session_id(db, table)
+        return {"type": "resync", "id": hub.last_id, "session_id": session_id,
+                "standings": await standings_for(db, session_id)}
+
+@router.get("")
+async def stream_events(request: Request, last_event_id: str | None = Header(None),
+                        table: str = Depends(tables.current_table)):
+    """Live updates for one table (?table=, as EventSource can't send headers); only events published for
+    that table are forwarded."""
+    async def stream():
+        async with hub.subscribe() as queue:
+            # A reconnecting client that missed events gets the current standings instead of a replay
+            if last_event_id is not None and last_event_id != str(hub.last_id):
+                yield format_event(await resync_snapshot(table))
+            else:
+                yield format_event({"type": "ready", "id": hub.last_id})
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                # A resync comes from the hub for this stream alone (it fell behind); anything else must name the table
+                if event["type"] == "resync" or event.get("table") == table:
+                    yield format_event(event)
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -1,81 +1,88 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from .. import models
-from ..database import get_db
+from fastapi import APIRouter, Depends, Query, Request, Response
+from sqlalchemy import and_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from .. import models, ledger, stats, versioning, archive, journal, tables, progression
+from ..database import get_async_db
+from ..active_session import current_session_id
+from ..live import hub
 
 router = APIRouter(prefix="/api/game", tags=["game"])
 
-def get_active_session_id(db: Session) -> int | None:
-    session = db.query(models.Session).filter(models.Session.is_active == True).first()
-    return session.id if session else None
-
 @router.get("/standings")
-def get_standings(db: Session = Depends(get_db)):
-    session_id = get_active_session_id(db)
-    # Only get players for this session
-    if session_id:
-        players = db.query(models.Player).filter(models.Player.session_id == session_id).all()
-    else:
-        players = db.query(models.Player).filter(models.Player.session_id == None).all()
-    standings = []
-    for p in players:
-        # Join through Round to filter by session
-        query = db.query(func.coalesce(func.sum(models.RoundScore.delta), 0)).join(
-            models.Round, models.RoundScore.round_id == models.Round.id
-        ).filter(models.RoundScore.player_id == p.id)
-        if session_id:
-            query = query.filter(models.Round.session_id == session_id)
-        else:
-            query = query.filter(models.Round.session_id == None)
-        score = query.scalar()
-        standings.append({"id": p.id, "name": p.name, "color": p.color,
-                          "avatar_path": p.avatar_path, "score": score})
+async def get_standings(request: Request, response: Response, session_id: int | None = Depends(current_session_id),
+                        db: AsyncSession = Depends(get_async_db)):
+    if cached := await versioning.not_modified(request, response, db, versioning.session_scope(session_id)):
+        return cached
+    return await standings_for(db, session_id)
+
+async def standings_for(db: AsyncSession, session_id: int | None) -> list[dict]:
+    # One row per player: running totals come from the ledger, not SUM() over round_scores
+    rows = await db.execute(select(models.Player, models.PlayerTotal.score).outerjoin(
+        models.PlayerTotal, and_(models.PlayerTotal.player_id == models.Player.id,
+                                 ledger.in_session(models.PlayerTotal.session_id, session_id))
+    ).where(ledger.in_session(models.Player.session_id, session_id)))
+    standings = [{"id": p.id, "name": p.name, "color": p.color,
+                  "avatar_path": p.avatar_path, "score": score or 0} for p, score in rows]
     standings.sort(key=lambda x: x["score"], reverse=True)
     return standings
 
+async def player_info(db: AsyncSession, player_ids) -> dict[int, models.Player]:
+    players = await db.scalars(select(models.Player).where(models.Player.id.in_(list(player_ids))))
+    return {p.id: p for p in players}
+
+async def compute_stats(db: AsyncSession, session_id: int | None, **options) -> dict:
+    rows = await db.run_sync(stats.load_scores, session_id)
+    # The pass is CPU-bound on long sessions; keep it off the event loop
+    return await run_in_threadpool(stats.compute, rows, **options)
+
 @router.get("/statistics")
-def get_statistics(db: Session = Depends(get_db)):
-    session_id = get_active_session_id(db)
-    # Only get players for this session
-    if session_id:
-        players = db.query(models.Player).filter(models.Player.session_id == session_id).all()
-    else:
-        players = db.query(models.Player).filter(models.Player.session_id == None).all()
-    stats = []
-    for p in players:
-        # Join through Round to filter by session
-        query = db.query(models.RoundScore).join(
-            models.Round, models.RoundScore.round_id == models.Round.id
-        ).filter(models.RoundScore.player_id == p.id)
-        if session_id:
-            query = query.filter(models.Round.session_id == session_id)
-        else:
-            query = query.filter(models.Round.session_id == None)
-        scores = query.all()
-        if not scores:
-            continue
-        deltas = [s.delta for s in scores]
-        wins = sum(1 for d in deltas if d > 0)
-        stats.append({
-            "name": p.name, "color": p.color, "rounds": len(deltas),
-            "win_rate": round(wins / len(deltas) * 100, 1),
-            "avg": round(sum(deltas) / len(deltas), 1),
-            "best": max(deltas), "worst": min(deltas)
-        })
-    stats.sort(key=lambda x: x["win_rate"], reverse=True)
-    return stats
+async def get_statistics(request: Request, response: Response, session_id: int | None = Depends(current_session_id),
+                         db: AsyncSession = Depends(get_async_db)):
+    if cached := await versioning.not_modified(request, response, db, versioning.session_scope(session_id)):
+        return cached
+    summaries = (await compute_stats(db, session_id))["players"]
+    players = await player_info(db, summaries)
+    result = [{"id": pid, "name": players[pid].name, "color": players[pid].color, **summary}
+              for pid, summary in summaries.items() if pid in players]
+    result.sort(key=lambda x: x["win_rate"], reverse=True)
+    return result
+
+@router.get("/statistics/series")
+async def get_score_series(request: Request, response: Response, session_id: int | None = Depends(current_session_id),
+                           db: AsyncSession = Depends(get_async_db)):
+    """Cumulative score of every player after each round"""
+    if cached := await versioning.not_modified(request, response, db, versioning.session_scope(session_id)):
+        return cached
+    return (await compute_stats(db, session_id, series=True))["series"]
+
+@router.get("/progression")
+async def get_progression(request: Request, response: Response, points: int = Query(200, ge=2, le=2000),
+                          session_id: int | None = Depends(current_session_id), db: AsyncSession = Depends(get_async_db)):
+    """Scores and ranks after at most ``points`` evenly spaced rounds, read from the per-round snapshots"""
+    if cached := await versioning.not_modified(request, response, db, versioning.session_scope(session_id)):
+        return cached
+    return await db.run_sync(progression.progression, session_id, points)
+
+@router.get("/statistics/head-to-head")
+async def get_head_to_head(request: Request, response: Response, session_id: int | None = Depends(current_session_id),
+                           db: AsyncSession = Depends(get_async_db)):
+    """Pairwise matrices over shared rounds: rounds played together, rounds won against, net points"""
+    if cached := await versioning.not_modified(request, response, db, versioning.session_scope(session_id)):
+        return cached
+    h2h = (await compute_stats(db, session_id, head_to_head=True))["head_to_head"]
+    players = await player_info(db, h2h["player_ids"])
+    h2h["names"] = [players[pid].name if pid in players else None for pid in h2h["player_ids"]]
+    return h2h
 
 @router.post("/reset")
-def reset_game(db: Session = Depends(get_db)):
-    # Only reset rounds in active session (or no session)
-    session_id = get_active_session_id(db)
-    if session_id:
-        round_ids = [r.id for r in db.query(models.Round).filter(models.Round.session_id == session_id).all()]
-    else:
-        round_ids = [r.id for r in db.query(models.Round).filter(models.Round.session_id == None).all()]
-    if round_ids:
-        db.query(models.RoundScore).filter(models.RoundScore.round_id.in_(round_ids)).delete(synchronize_session=False)
-        db.query(models.Round).filter(models.Round.id.in_(round_ids)).delete(synchronize_session=False)
-    db.commit()
+async def reset_game(session_id: int | None = Depends(current_session_id), table: str = Depends(tables.current_table),
+                     db: AsyncSession = Depends(get_async_db)):
+    # Only reset rounds in the table's active session (or no session)
+    await db.run_sync(archive.reset_session, session_id)
+    await db.run_sync(ledger.clear_session, session_id)
+    await db.run_sync(journal.record, session_id, "game_reset", {})
+    await db.run_sync(versioning.bump, versioning.session_scope(session_id), *versioning.listing_scopes(table))
+    await db.commit()
+    hub.publish("game_reset", session_id, table=table, standings=await standings_for(db, session_id))
     return {"ok": True}
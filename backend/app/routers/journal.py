@@ -0,0 +1,57 @@
+from fastapi import APIRouter, Depends, Query, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models, schemas, ledger, versioning, journal, revisions, tables
+from ..database import get_async_db
+from ..active_session import current_session_id
+from ..live import hub
+from .game import standings_for
+
+router = APIRouter(prefix="/api/journal", tags=["journal"])
+
+@router.get("", response_model=list[schemas.JournalEntry])
+async def list_journal(request: Request, response: Response, before_id: int | None = None,
+                       limit: int = Query(50, ge=1, le=500), session_id: int | None = Depends(current_session_id),
+                       db: AsyncSession = Depends(get_async_db)):
+    """Audit history of the session, newest first. Page backwards with before_id."""
+    if cached := await versioning.not_modified(request, response, db, versioning.session_scope(session_id)):
+        return cached
+    query = select(models.JournalEntry).where(
+        ledger.in_session(models.JournalEntry.session_id, session_id)
+    ).order_by(models.JournalEntry.id.desc()).limit(limit)
+    if before_id is not None:
+        query = query.where(models.JournalEntry.id < before_id)
+    return [journal.to_schema(e) for e in await db.scalars(query)]
+
+async def apply_step(request: Request, response: Response, session_id: int | None, table: str, expected: str | None,
+                     db: AsyncSession, redo: bool) -> schemas.JournalStep:
+    await revisions.check(db, session_id, expected)
+    entry, delta = await db.run_sync(journal.step, session_id, redo, request.client.host if request.client else None)
+    await db.run_sync(versioning.bump, versioning.session_scope(session_id), *versioning.listing_scopes(table),
+                      versioning.IDENTITIES)
+    await db.commit()
+    await revisions.set_etag(response, db, session_id)
+    await db.refresh(entry)
+    result = schemas.JournalStep(entry=journal.to_schema(entry), standings_delta={int(k): v for k, v in delta.items()})
+    # Round changes only move scores, so clients patch their standings with the delta instead of refetching;
+    # player edits can rename or recolor, so those carry the full standings
+    payload = {"table": table, "entry_id": entry.id, "target_id": entry.target_id, "action": result.entry.data["action"],
+               "standings_delta": result.standings_delta}
+    if not delta:
+        payload["standings"] = await standings_for(db, session_id)
+    hub.publish("redo" if redo else "undo", session_id, **payload)
+    return result
+
+@router.post("/undo", response_model=schemas.JournalStep)
+async def undo(request: Request, response: Response, expected: str | None = Depends(revisions.expected_revision),
+               session_id: int | None = Depends(current_session_id), table: str = Depends(tables.current_table),
+               db: AsyncSession = Depends(get_async_db)):
+    """Revert the session's latest change; 409 when there is nothing left to undo"""
+    return await apply_step(request, response, session_id, table, expected, db, redo=False)
+
+@router.post("/redo", response_model=schemas.JournalStep)
+async def redo(request: Request, response: Response, expected: str | None = Depends(revisions.expected_revision),
+               session_id: int | None = Depends(current_session_id), table: str = Depends(tables.current_table),
+               db: AsyncSession = Depends(get_async_db)):
+    """Re-apply the latest undone change, unless something new was recorded since"""
+    return await apply_step(request, response, session_id, table, expected, db, redo=True)
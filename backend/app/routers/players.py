@@ -1,104 +1,131 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from .. import models, schemas
-from ..database import get_db
-import os
-import uuid
-
-AVATARS_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "..", "static", "avatars")
-os.makedirs(AVATARS_DIR, exist_ok=True)
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Request, Response
+from sqlalchemy import and_, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models, schemas, ledger, versioning, avatars, analytics, archive, journal, revisions, tables
+from ..database import get_async_db
+from ..serialization import json_response
+from ..active_session import current_session_id, require_table
+from ..live import hub
+from .game import standings_for
 
 router = APIRouter(prefix="/api/players", tags=["players"])
 
-def get_active_session_id(db: Session) -> int | None:
-    session = db.query(models.Session).filter(models.Session.is_active == True).first()
-    return session.id if session else None
+async def get_player(db: AsyncSession, player_id: int, table: str) -> models.Player:
+    player = await db.get(models.Player, player_id)
+    if not player:
+        raise HTTPException(404, "Player not found")
+    await require_table(db, player.session_id, table)
+    return player
 
 @router.get("", response_model=list[schemas.Player])
-def list_players(db: Session = Depends(get_db)):
-    session_id = get_active_session_id(db)
-    query = db.query(models.Player)
-    if session_id:
-        query = query.filter(models.Player.session_id == session_id)
-    else:
-        query = query.filter(models.Player.session_id == None)
-    players = query.all()
-    result = []
-    for p in players:
-        score = db.query(func.coalesce(func.sum(models.RoundScore.delta), 0)).filter(
-            models.RoundScore.player_id == p.id
-        ).scalar()
-        result.append(schemas.Player(
-            id=p.id, name=p.name, color=p.color,
-            avatar_path=p.avatar_path, created_at=p.created_at, score=score
-        ))
-    return result
+async def list_players(request: Request, response: Response, session_id: int | None = Depends(current_session_id),
+                       db: AsyncSession = Depends(get_async_db)):
+    if cached := await versioning.not_modified(request, response, db, versioning.session_scope(session_id)):
+        return cached
+    rows = await db.execute(select(
+        models.Player.id, models.Player.name, models.Player.color, models.Player.avatar_path,
+        models.Player.identity_id, models.Player.created_at, models.PlayerTotal.score
+    ).outerjoin(models.PlayerTotal, and_(models.PlayerTotal.player_id == models.Player.id,
+                                         ledger.in_session(models.PlayerTotal.session_id, session_id))
+    ).where(ledger.in_session(models.Player.session_id, session_id)))
+    return await json_response(request, response, [
+        {"name": name, "color": color, "id": player_id, "avatar_path": avatar_path, "identity_id": identity_id,
+         "created_at": created_at, "score": score or 0}
+        for player_id, name, color, avatar_path, identity_id, created_at, score in rows])
 
 @router.post("", response_model=schemas.Player)
-def create_player(player: schemas.PlayerCreate, db: Session = Depends(get_db)):
-    session_id = get_active_session_id(db)
-    existing = db.query(models.Player).filter(
+async def create_player(player: schemas.PlayerCreate, response: Response,
+                        expected: str | None = Depends(revisions.expected_revision),
+                        session_id: int | None = Depends(current_session_id), table: str = Depends(tables.current_table),
+                        db: AsyncSession = Depends(get_async_db)):
+    existing = await db.scalar(select(models.Player.id).where(
         models.Player.name == player.name,
         models.Player.session_id == session_id
-    ).first()
+    ))
     if existing:
         raise HTTPException(400, "Player already exists")
-    db_player = models.Player(name=player.name, color=player.color, session_id=session_id)
+    await revisions.check(db, session_id, expected)
+    identity_id = await db.run_sync(analytics.resolve_identity, player.name)
+    db_player = models.Player(name=player.name, color=player.color, session_id=session_id, identity_id=identity_id)
     db.add(db_player)
-    db.commit()
-    db.refresh(db_player)
-    return schemas.Player(id=db_player.id, name=db_player.name, color=db_player.color,
-                          avatar_path=db_player.avatar_path, created_at=db_player.created_at, score=0)
+    await db.run_sync(versioning.bump, versioning.session_scope(session_id), versioning.IDENTITIES)
+    await db.commit()
+    await revisions.set_etag(response, db, session_id)
+    await db.refresh(db_player)
+    result = schemas.Player(id=db_player.id, name=db_player.name, color=db_player.color, avatar_path=db_player.avatar_path,
+                            identity_id=identity_id, created_at=db_player.created_at, score=0)
+    hub.publish("player_created", session_id, table=table, player=result.model_dump(mode="json"),
+                standings=await standings_for(db, session_id))
+    return result
 
 @router.patch("/{player_id}", response_model=schemas.Player)
-def update_player(player_id: int, update: schemas.PlayerUpdate, db: Session = Depends(get_db)):
-    player = db.query(models.Player).filter(models.Player.id == player_id).first()
-    if not player:
-        raise HTTPException(404, "Player not found")
+async def update_player(player_id: int, update: schemas.PlayerUpdate, request: Request, response: Response,
+                        expected: str | None = Depends(revisions.expected_revision),
+                        table: str = Depends(tables.current_table), db: AsyncSession = Depends(get_async_db)):
+    player = await get_player(db, player_id, table)
+    await revisions.check(db, player.session_id, expected)
+    before = journal.player_fields(player)
     if update.name is not None:
         player.name = update.name
+        player.identity_id = await db.run_sync(analytics.resolve_identity, update.name)
+    if update.identity_id is not None:
+        if not await db.get(models.PlayerIdentity, update.identity_id):
+            raise HTTPException(404, "Identity not found")
+        player.identity_id = update.identity_id
     if update.color is not None:
         player.color = update.color
     if update.avatar_path is not None:
         player.avatar_path = update.avatar_path
-    db.commit()
-    db.refresh(player)
-    score = db.query(func.coalesce(func.sum(models.RoundScore.delta), 0)).filter(
-        models.RoundScore.player_id == player.id
-    ).scalar()
-    return schemas.Player(id=player.id, name=player.name, color=player.color,
-                          avatar_path=player.avatar_path, created_at=player.created_at, score=score)
+    await db.run_sync(journal.record_player_edit, player, before, request.client.host if request.client else None)
+    await db.run_sync(versioning.bump, versioning.session_scope(player.session_id), versioning.IDENTITIES)
+    await db.commit()
+    await revisions.set_etag(response, db, player.session_id)
+    score = await db.scalar(select(models.PlayerTotal.score).where(
+        models.PlayerTotal.player_id == player.id,
+        ledger.in_session(models.PlayerTotal.session_id, player.session_id)
+    )) or 0
+    result = schemas.Player(id=player.id, name=player.name, color=player.color, avatar_path=player.avatar_path,
+                            identity_id=player.identity_id, created_at=player.created_at, score=score)
+    hub.publish("player_updated", player.session_id, table=table, player=result.model_dump(mode="json"),
+                standings=await standings_for(db, player.session_id))
+    return result
 
 @router.get("/{player_id}/locked")
-def is_player_locked(player_id: int, db: Session = Depends(get_db)):
+async def is_player_locked(player_id: int, table: str = Depends(tables.current_table),
+                           db: AsyncSession = Depends(get_async_db)):
     """Check if player has any round history (locked = can't delete without admin)"""
-    count = db.query(models.RoundScore).filter(models.RoundScore.player_id == player_id).count()
+    await get_player(db, player_id, table)
+    count = await db.scalar(select(func.count(models.RoundScore.id)).where(models.RoundScore.player_id == player_id))
     return {"locked": count > 0}
 
 @router.delete("/{player_id}")
-def delete_player(player_id: int, db: Session = Depends(get_db)):
-    player = db.query(models.Player).filter(models.Player.id == player_id).first()
-    if not player:
-        raise HTTPException(404, "Player not found")
-    db.delete(player)
-    db.commit()
+async def delete_player(player_id: int, response: Response, expected: str | None = Depends(revisions.expected_revision),
+                        table: str = Depends(tables.current_table), db: AsyncSession = Depends(get_async_db)):
+    player = await get_player(db, player_id, table)
+    session_id = player.session_id
+    await revisions.check(db, session_id, expected)
+    # Their scores go too (with foreign keys on they can't be left pointing at nothing)
+    await db.run_sync(archive.delete_players, [player.id])
+    # Undo can't take back rounds that no longer hold the player's scores
+    await db.run_sync(journal.record, session_id, "player_deleted", {"player_id": player.id, "name": player.name})
+    await db.run_sync(versioning.bump, versioning.session_scope(session_id), versioning.IDENTITIES)
+    await db.commit()
+    await revisions.set_etag(response, db, session_id)
+    hub.publish("player_deleted", session_id, table=table, player_id=player_id, standings=await standings_for(db, session_id))
     return {"ok": True}
 
 @router.post("/{player_id}/avatar")
-async def upload_avatar(player_id: int, file: UploadFile = File(...), db: Session = Depends(get_db)):
-    player = db.query(models.Player).filter(models.Player.id == player_id).first()
-    if not player:
-        raise HTTPException(404, "Player not found")
-
-    ext = os.path.splitext(file.filename)[1] if file.filename else ".jpg"
-    filename = f"{uuid.uuid4()}{ext}"
-    filepath = os.path.join(AVATARS_DIR, filename)
-
-    with open(filepath, "wb") as f:
-        content = await file.read()
-        f.write(content)
-
+async def upload_avatar(player_id: int, response: Response, file: UploadFile = File(...),
+                        expected: str | None = Depends(revisions.expected_revision),
+                        table: str = Depends(tables.current_table), db: AsyncSession = Depends(get_async_db)):
+    # Store and thumbnail the image before the write transaction opens, so other writers don't wait on Pillow
+    filename = await avatars.store_upload(file)
+    player = await get_player(db, player_id, table)
+    await revisions.check(db, player.session_id, expected)
     player.avatar_path = filename
-    db.commit()
+    await db.run_sync(versioning.bump, versioning.session_scope(player.session_id))
+    await db.commit()
+    await revisions.set_etag(response, db, player.session_id)
+    hub.publish("player_updated", player.session_id, table=table, player_id=player.id, avatar_path=filename,
+                standings=await standings_for(db, player.session_id))
     return {"ok": True, "avatar_path": filename}
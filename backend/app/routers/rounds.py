@@ -1,59 +1,214 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from .. import models, schemas
-from ..database import get_db
+from itertools import groupby
+from operator import itemgetter
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from .. import models, schemas, ledger, versioning, journal, revisions, tables, progression
+from ..database import get_async_db
+from ..serialization import json_response
+from ..active_session import current_session_id, require_table
+from ..live import hub
+from .game import standings_for
 
 router = APIRouter(prefix="/api/rounds", tags=["rounds"])
 
-def get_active_session_id(db: Session) -> int | None:
-    session = db.query(models.Session).filter(models.Session.is_active == True).first()
-    return session.id if session else None
+def with_scores(query):
+    return query.options(selectinload(models.Round.scores).joinedload(models.RoundScore.player))
+
+def round_schema(r: models.Round) -> schemas.Round:
+    scores = [schemas.RoundScore(player_id=s.player_id, player_name=s.player.name, delta=s.delta) for s in r.scores]
+    return schemas.Round(id=r.id, recorder_id=r.recorder_id, recorder_ip=r.recorder_ip,
+                         client_key=r.client_key, created_at=r.created_at, scores=scores)
 
 @router.get("", response_model=list[schemas.Round])
-def list_rounds(db: Session = Depends(get_db)):
-    session_id = get_active_session_id(db)
-    query = db.query(models.Round).order_by(models.Round.id.desc())
-    if session_id:
-        query = query.filter(models.Round.session_id == session_id)
-    else:
-        query = query.filter(models.Round.session_id == None)
-    rounds = query.all()
-    result = []
-    for r in rounds:
-        scores = [schemas.RoundScore(player_id=s.player_id, player_name=s.player.name, delta=s.delta) for s in r.scores]
-        result.append(schemas.Round(id=r.id, recorder_id=r.recorder_id, recorder_ip=r.recorder_ip,
-                                    created_at=r.created_at, scores=scores))
-    return result
+async def list_rounds(request: Request, response: Response, before_id: int | None = None, since_id: int | None = None,
+                      limit: int | None = Query(None, ge=1, le=1000), session_id: int | None = Depends(current_session_id),
+                      db: AsyncSession = Depends(get_async_db)):
+    """Newest first. Page backwards with before_id, or fetch only rounds newer than since_id (round ids are never
+    reused, so a new round always sorts after every round a client has seen)."""
+    if cached := await versioning.not_modified(request, response, db, versioning.session_scope(session_id)):
+        return cached
+    page = select(models.Round.id).where(
+        ledger.in_session(models.Round.session_id, session_id)
+    ).order_by(models.Round.id.desc())
+    if before_id is not None:
+        page = page.where(models.Round.id < before_id)
+    if since_id is not None:
+        page = page.where(models.Round.id > since_id)
+    if limit is not None:
+        page = page.limit(limit)
+    page = page.subquery()
+    # One row per score, rounds and their players joined in
+    rows = await db.execute(select(
+        models.Round.id, models.Round.recorder_id, models.Round.recorder_ip, models.Round.client_key,
+        models.Round.created_at, models.RoundScore.player_id, models.Player.name, models.RoundScore.delta
+    ).join(page, page.c.id == models.Round.id).outerjoin(
+        models.RoundScore, models.RoundScore.round_id == models.Round.id
+    ).outerjoin(models.Player, models.Player.id == models.RoundScore.player_id).order_by(
+        models.Round.id.desc(), models.RoundScore.player_id))
+    rounds = []
+    for (round_id, recorder_id, recorder_ip, client_key, created_at), scores in groupby(
+            rows, key=itemgetter(0, 1, 2, 3, 4)):
+        rounds.append({"id": round_id, "recorder_id": recorder_id, "recorder_ip": recorder_ip,
+                       "client_key": client_key, "created_at": created_at,
+                       "scores": [{"player_id": player_id, "player_name": name, "delta": delta}
+                                  for *_, player_id, name, delta in scores if player_id is not None]})
+    if limit is not None and len(rounds) == limit:
+        response.headers["X-Next-Before-Id"] = str(rounds[-1]["id"])
+    return await json_response(request, response, rounds)
 
-@router.post("", response_model=schemas.Round)
-def create_round(round_data: schemas.RoundCreate, db: Session = Depends(get_db)):
+def round_error(round_data: schemas.RoundCreate, known_player_ids: set[int]) -> str | None:
+    if not round_data.scores:
+        return "Round has no scores"
     total = sum(s.delta for s in round_data.scores)
     if total != 0:
-        raise HTTPException(400, f"Scores must sum to zero, got {total}")
-
-    session_id = get_active_session_id(db)
-    db_round = models.Round(session_id=session_id, recorder_id=round_data.recorder_id, recorder_ip=round_data.recorder_ip)
-    db.add(db_round)
-    db.flush()
-
-    for score in round_data.scores:
-        player = db.query(models.Player).filter(models.Player.id == score.player_id).first()
-        if not player:
-            raise HTTPException(400, f"Player {score.player_id} not found")
-        db_score = models.RoundScore(round_id=db_round.id, player_id=score.player_id, delta=score.delta)
-        db.add(db_score)
-
-    db.commit()
-    db.refresh(db_round)
-    scores = [schemas.RoundScore(player_id=s.player_id, player_name=s.player.name, delta=s.delta) for s in db_round.scores]
-    return schemas.Round(id=db_round.id, recorder_id=db_round.recorder_id, recorder_ip=db_round.recorder_ip,
-                         created_at=db_round.created_at, scores=scores)
+        return f"Scores must sum to zero, got {total}"
+    player_ids = [s.player_id for s in round_data.scores]
+    if len(set(player_ids)) != len(player_ids):
+        return "Player listed more than once"
+    for player_id in player_ids:
+        if player_id not in known_player_ids:
+            return f"Player {player_id} not found"
+    if round_data.recorder_id is not None and round_data.recorder_id not in known_player_ids:
+        return f"Recorder {round_data.recorder_id} not found"
+    return None
+
+async def existing_player_ids(db: AsyncSession, session_id: int | None, rounds: list[schemas.RoundCreate]) -> set[int]:
+    """Ids of the rounds' players and recorders that are in the session; another table's players count as
+    not found."""
+    wanted = {s.player_id for r in rounds for s in r.scores}
+    wanted |= {r.recorder_id for r in rounds if r.recorder_id is not None}
+    return set(await db.scalars(ledger.session_players(session_id, wanted))) if wanted else set()
+
+async def rounds_by_key(db: AsyncSession, session_id: int | None, keys) -> dict[str, int]:
+    """Rounds already recorded in the session under these idempotency keys.
+
+    Keys are unique across sessions, so a key taken in another session (maybe another table's) is a 409
+    that says nothing about that round.
+    """
+    keys = {k for k in keys if k}
+    if not keys:
+        return {}
+    rows = (await db.execute(select(models.Round.client_key, models.Round.id, models.Round.session_id).where(
+        models.Round.client_key.in_(keys)))).all()
+    if any(round_session_id != session_id for _, _, round_session_id in rows):
+        raise HTTPException(409, "client_key was already used in another session")
+    return {key: round_id for key, round_id, _ in rows}
+
+async def insert_rounds(db: AsyncSession, session_id: int | None, table: str,
+                        rounds: list[schemas.RoundCreate]) -> list[int]:
+    """Bulk insert rounds and their scores in two statements; returns the new round ids in input order."""
+    # SQLite hands out rowids in statement order within the write transaction, so sorting the
+    # returned ids restores input order without falling back to one INSERT per row
+    round_ids = sorted(await db.scalars(
+        insert(models.Round).returning(models.Round.id),
+        [{"session_id": session_id, "recorder_id": r.recorder_id, "recorder_ip": r.recorder_ip,
+          "client_key": r.client_key} for r in rounds]
+    ))
+    await db.execute(insert(models.RoundScore), [
+        {"round_id": round_id, "player_id": s.player_id, "delta": s.delta}
+        for round_id, r in zip(round_ids, rounds) for s in r.scores
+    ])
+    await db.run_sync(ledger.apply_scores, session_id, [(s.player_id, s.delta) for r in rounds for s in r.scores])
+    await db.run_sync(ledger.apply_rounds, session_id, len(rounds))
+    await db.run_sync(progression.refresh, session_id, round_ids[0])
+    await db.run_sync(versioning.bump, versioning.session_scope(session_id), *versioning.listing_scopes(table))
+    return round_ids
+
+async def load_round(db: AsyncSession, round_id: int) -> schemas.Round:
+    return round_schema(await db.scalar(with_scores(select(models.Round)).where(models.Round.id == round_id)))
+
+def client_ip(request: Request) -> str | None:
+    return request.client.host if request.client else None
+
+@router.post("", response_model=schemas.Round)
+async def create_round(round_data: schemas.RoundCreate, request: Request, response: Response,
+                       expected: str | None = Depends(revisions.expected_revision),
+                       session_id: int | None = Depends(current_session_id), table: str = Depends(tables.current_table),
+                       db: AsyncSession = Depends(get_async_db)):
+    # A retried request with a known idempotency key returns the round recorded the first time in this session
+    if existing := (await rounds_by_key(db, session_id, [round_data.client_key])).get(round_data.client_key):
+        return await load_round(db, existing)
+    if error := round_error(round_data, await existing_player_ids(db, session_id, [round_data])):
+        raise HTTPException(400, error)
+    await revisions.check(db, session_id, expected)
+
+    [round_id] = await insert_rounds(db, session_id, table, [round_data])
+    await db.run_sync(journal.record_rounds, session_id, "round_added", [round_id], round_data.recorder_id,
+                      client_ip(request))
+    await db.commit()
+    await revisions.set_etag(response, db, session_id)
+    result = await load_round(db, round_id)
+    hub.publish("round_created", session_id, table=table, round=result.model_dump(mode="json"),
+                standings=await standings_for(db, session_id))
+    return result
+
+@router.post("/batch", response_model=schemas.RoundBatchResult)
+async def create_rounds_batch(batch: schemas.RoundBatchCreate, request: Request, response: Response,
+                              expected: str | None = Depends(revisions.expected_revision),
+                              session_id: int | None = Depends(current_session_id),
+                              table: str = Depends(tables.current_table), db: AsyncSession = Depends(get_async_db)):
+    """Record many rounds atomically: either every new round is stored or none is.
+
+    Rounds whose client_key was already recorded in this session (earlier, or earlier in this batch) are
+    reported as duplicates and skipped, so retrying a batch after a dropped connection is safe. A key taken
+    in another session rejects the whole batch with 409.
+    """
+    known_players = await existing_player_ids(db, session_id, batch.rounds)
+    seen = await rounds_by_key(db, session_id, (r.client_key for r in batch.rounds))
+    results, pending = [], []
+    for index, round_data in enumerate(batch.rounds):
+        item = schemas.RoundBatchItem(index=index, client_key=round_data.client_key, status="created")
+        if round_data.client_key in seen:
+            item.status, item.round_id = "duplicate", seen[round_data.client_key]
+        elif error := round_error(round_data, known_players):
+            item.status, item.error = "invalid", error
+        else:
+            if round_data.client_key:
+                seen[round_data.client_key] = None
+            pending.append(item)
+        results.append(item)
+    if any(item.status == "invalid" for item in results):
+        raise HTTPException(400, {"message": "Batch rejected, no rounds were recorded",
+                                  "results": [item.model_dump() for item in results]})
+
+    if pending:
+        await revisions.check(db, session_id, expected)
+        round_ids = await insert_rounds(db, session_id, table, [batch.rounds[item.index] for item in pending])
+        # One journal entry for the whole batch, so one undo takes it back
+        await db.run_sync(journal.record_rounds, session_id, "round_added", round_ids,
+                          batch.rounds[pending[0].index].recorder_id, client_ip(request))
+        await db.commit()
+        await revisions.set_etag(response, db, session_id)
+        for item, round_id in zip(pending, round_ids):
+            item.round_id = round_id
+        for item in results:
+            if item.status == "duplicate" and item.round_id is None:
+                item.round_id = next(p.round_id for p in pending if p.client_key == item.client_key)
+        hub.publish("rounds_created", session_id, table=table, round_ids=round_ids,
+                    standings=await standings_for(db, session_id))
+    return schemas.RoundBatchResult(created=len(pending), duplicates=len(results) - len(pending), results=results)
 
 @router.delete("/{round_id}")
-def delete_round(round_id: int, db: Session = Depends(get_db)):
-    round_obj = db.query(models.Round).filter(models.Round.id == round_id).first()
+async def delete_round(round_id: int, request: Request, response: Response,
+                       expected: str | None = Depends(revisions.expected_revision),
+                       table: str = Depends(tables.current_table), db: AsyncSession = Depends(get_async_db)):
+    round_obj = await db.scalar(select(models.Round).options(selectinload(models.Round.scores))
+                                .where(models.Round.id == round_id))
     if not round_obj:
         raise HTTPException(404, "Round not found")
-    db.delete(round_obj)
-    db.commit()
+    session_id = round_obj.session_id
+    await require_table(db, session_id, table)
+    await revisions.check(db, session_id, expected)
+    await db.run_sync(journal.record_rounds, session_id, "round_removed", [round_id], None, client_ip(request))
+    await db.run_sync(ledger.apply_scores, session_id, [(s.player_id, s.delta) for s in round_obj.scores], -1)
+    await db.run_sync(ledger.apply_rounds, session_id, -1)
+    await db.delete(round_obj)
+    await db.flush()
+    await db.run_sync(progression.refresh, session_id, round_id)
+    await db.run_sync(versioning.bump, versioning.session_scope(session_id), *versioning.listing_scopes(table))
+    await db.commit()
+    await revisions.set_etag(response, db, session_id)
+    hub.publish("round_deleted", session_id, table=table, round_id=round_id, standings=await standings_for(db, session_id))
     return {"ok": True}
@@ -1,100 +1,202 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session as DBSession
-from sqlalchemy import func
-from .. import models, schemas
-from ..database import get_db
+import zlib
+from typing import Literal
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, UploadFile, File
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models, schemas, versioning, active_session, archive, exchange, tables
+from ..database import get_async_db, AsyncSessionLocal
+from ..serialization import json_response
+from ..live import hub
+from .game import standings_for
 
 router = APIRouter(prefix="/api/sessions", tags=["sessions"])
 
-@router.get("", response_model=list[schemas.Session])
-def list_sessions(db: DBSession = Depends(get_db)):
-    sessions = db.query(models.Session).order_by(models.Session.created_at.desc()).all()
-    result = []
-    for s in sessions:
-        round_count = db.query(func.count(models.Round.id)).filter(models.Round.session_id == s.id).scalar()
-        result.append(schemas.Session(
-            id=s.id,
-            name=s.name,
-            created_at=s.created_at,
-            is_active=s.is_active,
-            round_count=round_count
-        ))
-    return result
+async def get_session(db: AsyncSession, session_id: int, table: str) -> models.Session:
+    session = await db.get(models.Session, session_id)
+    # Each table only sees its own sessions
+    if not session or session.table_key != table:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session
 
-@router.get("/active", response_model=schemas.Session | None)
-def get_active_session(db: DBSession = Depends(get_db)):
-    session = db.query(models.Session).filter(models.Session.is_active == True).first()
-    if not session:
-        return None
-    round_count = db.query(func.count(models.Round.id)).filter(models.Round.session_id == session.id).scalar()
+async def deactivate(db: AsyncSession, table: str):
+    await db.execute(update(models.Session).where(
+        models.Session.table_key == table, models.Session.is_active == True
+    ).values(is_active=False))
+
+async def session_schema(db: AsyncSession, session: models.Session) -> schemas.Session:
+    # From the rollup, so archived sessions still report their rounds
+    round_count = await db.scalar(select(models.SessionTotal.rounds).where(models.SessionTotal.session_id == session.id))
     return schemas.Session(
         id=session.id,
         name=session.name,
         created_at=session.created_at,
         is_active=session.is_active,
-        round_count=round_count
+        table=session.table_key,
+        archived=session.archived_at is not None,
+        round_count=round_count or 0
     )
 
+@router.get("", response_model=list[schemas.Session])
+async def list_sessions(request: Request, response: Response, table: str = Depends(tables.current_table),
+                        db: AsyncSession = Depends(get_async_db)):
+    if cached := await versioning.not_modified(request, response, db, versioning.sessions_scope(table)):
+        return cached
+    # Round counts joined in from the rollup rather than read per session
+    rows = await db.execute(select(
+        models.Session.id, models.Session.name, models.Session.created_at, models.Session.is_active,
+        models.Session.archived_at, models.SessionTotal.rounds
+    ).outerjoin(models.SessionTotal, models.SessionTotal.session_id == models.Session.id).where(
+        models.Session.table_key == table
+    ).order_by(models.Session.created_at.desc()))
+    return await json_response(request, response, [
+        {"id": session_id, "name": name, "created_at": created_at, "is_active": is_active, "table": table,
+         "archived": archived_at is not None, "round_count": rounds or 0}
+        for session_id, name, created_at, is_active, archived_at, rounds in rows])
+
+@router.get("/active", response_model=schemas.Session | None)
+async def get_active_session(table: str = Depends(tables.current_table), db: AsyncSession = Depends(get_async_db)):
+    session_id = await active_session.get_active_session_id(db, table)
+    session = await db.get(models.Session, session_id) if session_id else None
+    if not session:
+        return None
+    return await session_schema(db, session)
+
 @router.post("", response_model=schemas.Session)
-def create_session(data: schemas.SessionCreate, db: DBSession = Depends(get_db)):
-    # Deactivate all existing sessions
-    db.query(models.Session).update({models.Session.is_active: False})
+async def create_session(data: schemas.SessionCreate, table: str = Depends(tables.current_table),
+                         db: AsyncSession = Depends(get_async_db)):
+    # Deactivate the table's current session; other tables keep theirs
+    await deactivate(db, table)
     # Create new active session
-    session = models.Session(name=data.name, is_active=True)
+    session = models.Session(name=data.name, is_active=True, table_key=table)
     db.add(session)
-    db.commit()
-    db.refresh(session)
+    await db.run_sync(versioning.bump, *versioning.listing_scopes(table))
+    await db.run_sync(active_session.invalidate, table)
+    await db.commit()
+    await db.refresh(session)
+    hub.publish("session_created", session.id, table=table, standings=[])
     return schemas.Session(
         id=session.id,
         name=session.name,
         created_at=session.created_at,
         is_active=session.is_active,
+        table=table,
         round_count=0
     )
 
 @router.post("/{session_id}/load", response_model=schemas.Session)
-def load_session(session_id: int, db: DBSession = Depends(get_db)):
-    session = db.query(models.Session).filter(models.Session.id == session_id).first()
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-    # Deactivate all, activate this one
-    db.query(models.Session).update({models.Session.is_active: False})
+async def load_session(session_id: int, table: str = Depends(tables.current_table),
+                       db: AsyncSession = Depends(get_async_db)):
+    session = await get_session(db, session_id, table)
+    # Archived sessions are restored on demand
+    if session.archived_at is not None:
+        await db.run_sync(archive.restore_session, session_id)
+    # Deactivate the table's current session, activate this one
+    await deactivate(db, table)
     session.is_active = True
-    db.commit()
-    db.refresh(session)
-    round_count = db.query(func.count(models.Round.id)).filter(models.Round.session_id == session.id).scalar()
-    return schemas.Session(
-        id=session.id,
-        name=session.name,
-        created_at=session.created_at,
-        is_active=session.is_active,
-        round_count=round_count
-    )
+    await db.run_sync(versioning.bump, *versioning.listing_scopes(table), versioning.session_scope(session_id))
+    await db.run_sync(active_session.invalidate, table)
+    await db.commit()
+    await db.refresh(session)
+    hub.publish("session_loaded", session.id, table=table, standings=await standings_for(db, session.id))
+    return await session_schema(db, session)
 
 @router.patch("/{session_id}", response_model=schemas.Session)
-def rename_session(session_id: int, data: schemas.SessionUpdate, db: DBSession = Depends(get_db)):
-    session = db.query(models.Session).filter(models.Session.id == session_id).first()
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
+async def rename_session(session_id: int, data: schemas.SessionUpdate, table: str = Depends(tables.current_table),
+                         db: AsyncSession = Depends(get_async_db)):
+    session = await get_session(db, session_id, table)
     session.name = data.name
-    db.commit()
-    db.refresh(session)
-    round_count = db.query(func.count(models.Round.id)).filter(models.Round.session_id == session.id).scalar()
-    return schemas.Session(
-        id=session.id,
-        name=session.name,
-        created_at=session.created_at,
-        is_active=session.is_active,
-        round_count=round_count
-    )
+    await db.run_sync(versioning.bump, *versioning.listing_scopes(table))
+    await db.commit()
+    return await session_schema(db, session)
 
 @router.delete("/{session_id}")
-def delete_session(session_id: int, db: DBSession = Depends(get_db)):
-    session = db.query(models.Session).filter(models.Session.id == session_id).first()
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-    # Delete all rounds in this session
-    db.query(models.Round).filter(models.Round.session_id == session_id).delete()
-    db.delete(session)
-    db.commit()
+async def delete_session(session_id: int, table: str = Depends(tables.current_table),
+                         db: AsyncSession = Depends(get_async_db)):
+    await get_session(db, session_id, table)
+    # Rounds, scores, players, totals and any archive go in one transaction, a few statements in all
+    await db.run_sync(archive.purge_session, session_id)
+    await db.run_sync(versioning.bump, *versioning.listing_scopes(table), versioning.IDENTITIES,
+                      versioning.session_scope(session_id))
+    await db.run_sync(active_session.invalidate, table)
+    await db.commit()
+    hub.publish("session_deleted", session_id, table=table)
     return {"ok": True}
+
+@router.post("/{session_id}/archive", response_model=schemas.Session)
+async def archive_session(session_id: int, table: str = Depends(tables.current_table),
+                          db: AsyncSession = Depends(get_async_db)):
+    """Move a finished session's rounds to cold storage; loading the session restores them."""
+    session = await get_session(db, session_id, table)
+    if session.is_active:
+        raise HTTPException(400, "Cannot archive the active session")
+    if session.archived_at is not None:
+        raise HTTPException(400, "Session is already archived")
+    await db.run_sync(archive.archive_session, session_id)
+    await db.run_sync(versioning.bump, *versioning.listing_scopes(table), versioning.session_scope(session_id))
+    await db.commit()
+    await db.refresh(session)
+    hub.publish("session_archived", session_id, table=table)
+    return await session_schema(db, session)
+
+@router.post("/{session_id}/restore", response_model=schemas.Session)
+async def restore_session(session_id: int, table: str = Depends(tables.current_table),
+                          db: AsyncSession = Depends(get_async_db)):
+    session = await get_session(db, session_id, table)
+    if session.archived_at is None:
+        raise HTTPException(400, "Session is not archived")
+    await db.run_sync(archive.restore_session, session_id)
+    await db.run_sync(versioning.bump, *versioning.listing_scopes(table), versioning.session_scope(session_id))
+    await db.commit()
+    await db.refresh(session)
+    hub.publish("session_restored", session_id, table=table)
+    return await session_schema(db, session)
+
+@router.get("/{session_id}/export")
+async def export_session(session_id: int, format: Literal["columnar", "csv"] = "columnar",
+                         compression: Literal["gzip", "zstd", "none"] = "gzip", table: str = Depends(tables.current_table),
+                         db: AsyncSession = Depends(get_async_db)):
+    """Stream a session's players and rounds; memory use doesn't grow with the session"""
+    session = await get_session(db, session_id, table)
+    if session.archived_at is not None:
+        raise HTTPException(400, "Session is archived, restore it before exporting")
+    exchange.compressor(compression)  # fail with 400 before streaming if zstd is unavailable
+
+    async def body():
+        # The response outlives the request's DB session, so the stream gets its own
+        async with AsyncSessionLocal() as stream_db:
+            rows = exchange.export_columnar(stream_db, session) if format == "columnar" \
+                else exchange.export_csv(stream_db, session)
+            async for chunk in exchange.compress_stream(rows, compression):
+                yield chunk
+
+    filename = f"session-{session_id}.{exchange.EXTENSIONS[format]}" + {"gzip": ".gz", "zstd": ".zst", "none": ""}[compression]
+    media_type = exchange.MEDIA_TYPES.get(compression, "text/csv" if format == "csv" else "application/x-ndjson")
+    return StreamingResponse(body(), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@router.post("/import", response_model=schemas.Session)
+async def import_session(file: UploadFile = File(...), format: Literal["columnar", "csv"] = "columnar",
+                         name: str | None = None, table: str = Depends(tables.current_table),
+                         db: AsyncSession = Depends(get_async_db)):
+    """Create a new (inactive) session at the table from an export; all or nothing"""
+    session = models.Session(name=name or "Imported session", is_active=False, table_key=table)
+    db.add(session)
+    await db.flush()
+    importer = exchange.Importer(db, session)
+    lines = exchange.read_lines(file)
+    try:
+        if format == "columnar":
+            exported_name = await exchange.import_columnar(importer, lines)
+            if not name and exported_name:
+                session.name = exported_name
+        else:
+            await exchange.import_csv(importer, lines)
+    except (ValueError, KeyError, TypeError, IndexError, zlib.error) as exc:
+        raise HTTPException(400, f"Invalid {format} export: {exc}")
+    await db.run_sync(versioning.bump, *versioning.listing_scopes(table), versioning.IDENTITIES,
+                      versioning.session_scope(session.id))
+    await db.commit()
+    await db.refresh(session)
+    hub.publish("session_created", session.id, table=table, standings=await standings_for(db, session.id))
+    return await session_schema(db, session)
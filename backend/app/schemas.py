@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
 
 class PlayerBase(BaseModel):
@@ -12,10 +12,12 @@ class PlayerUpdate(BaseModel):
     name: str | None = None
     color: str | None = None
     avatar_path: str | None = None
+    identity_id: int | None = None  # link to another player identity explicitly instead of by name
 
 class Player(PlayerBase):
     id: int
     avatar_path: str | None
+    identity_id: int | None = None
     created_at: datetime
     score: int = 0
     class Config:
@@ -29,6 +31,22 @@ class RoundCreate(BaseModel):
     scores: list[RoundScoreCreate]
     recorder_id: int | None = None
     recorder_ip: str | None = None
+    client_key: str | None = Field(None, max_length=64)
+
+class RoundBatchCreate(BaseModel):
+    rounds: list[RoundCreate] = Field(..., min_length=1, max_length=1000)
+
+class RoundBatchItem(BaseModel):
+    index: int
+    client_key: str | None
+    status: str  # "created", "duplicate" or "invalid"
+    round_id: int | None = None
+    error: str | None = None
+
+class RoundBatchResult(BaseModel):
+    created: int
+    duplicates: int
+    results: list[RoundBatchItem]
 
 class RoundScore(BaseModel):
     player_id: int
@@ -41,11 +59,28 @@ class Round(BaseModel):
     id: int
     recorder_id: int | None
     recorder_ip: str | None
+    client_key: str | None = None
     created_at: datetime
     scores: list[RoundScore]
     class Config:
         from_attributes = True
 
+class JournalEntry(BaseModel):
+    id: int
+    session_id: int | None
+    action: str  # "round_added", "round_removed", "player_edited", "undo", "redo", or a barrier (journal.BARRIERS)
+    target_id: int | None = None
+    undone: bool = False
+    revision: int | None = None
+    actor_id: int | None = None
+    actor_ip: str | None = None
+    created_at: datetime
+    data: dict
+
+class JournalStep(BaseModel):
+    entry: JournalEntry
+    standings_delta: dict[int, int]  # player id -> score change applied by this undo/redo
+
 class AdminVerify(BaseModel):
     code: str
 
@@ -64,6 +99,8 @@ class Session(BaseModel):
     name: str
     created_at: datetime
     is_active: bool
+    table: str = "default"
+    archived: bool = False
     round_count: int = 0
     class Config:
         from_attributes = True
@@ -0,0 +1,70 @@
+"""JSON bodies for the large list endpoints, built straight from query rows.
+
+Those handlers return ``json_response(...)`` with plain dicts and lists: the
+body is encoded once (with orjson when it is installed) instead of going
+through Pydantic validation and FastAPI's encoder; their ``response_model``
+still documents the shape. Bodies over ``MIN_COMPRESS_BYTES`` are compressed
+when the client accepts it, with br if the brotli package is installed,
+otherwise gzip.
+"""
+import json
+import zlib
+from datetime import datetime
+from fastapi import Request, Response
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_COMPRESS_BYTES = 1024
+# Compressing bigger bodies than this moves off the event loop
+THREADPOOL_BYTES = 256 * 1024
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+def accepted_encodings(request: Request) -> set[str]:
+    encodings = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.partition(";")
+        _, _, quality = params.partition("q=")
+        try:
+            refused = float(quality) == 0 if quality.strip() else False
+        except ValueError:
+            refused = False
+        if not refused:
+            encodings.add(name.strip().lower())
+    return encodings
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=4)
+    packer = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return packer.compress(body) + packer.flush()
+
+async def json_response(request: Request, response: Response, content) -> Response:
+    """The encoded body, with the headers the handler set on ``response`` (ETag, paging)."""
+    body = dumps(content)
+    headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+    headers["Vary"] = "Accept-Encoding"
+    if len(body) >= MIN_COMPRESS_BYTES:
+        accepted = accepted_encodings(request)
+        encoding = "br" if brotli is not None and "br" in accepted else "gzip" if "gzip" in accepted else None
+        if encoding:
+            body = await run_in_threadpool(compress, body, encoding) if len(body) > THREADPOOL_BYTES \
+                else compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+    return Response(body, media_type="application/json", headers=headers)
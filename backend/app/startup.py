@@ -0,0 +1,31 @@
+"""Per-worker startup, run from the app's lifespan rather than at import time.
+
+Importing ``app.main`` touches neither the database nor the filesystem, so tests,
+tooling and freshly spawned workers only pay for it once they actually start
+serving. Each step is timed; the report is printed once startup finishes and
+exported as ``mahjong_startup_seconds`` on /api/metrics.
+"""
+import time
+from contextlib import contextmanager
+from . import metrics
+
+class StartupReport:
+    def __init__(self):
+        self.steps: list[tuple[str, float]] = []
+
+    def add(self, name: str, seconds: float):
+        self.steps.append((name, seconds))
+
+    @contextmanager
+    def step(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def finish(self, log=print):
+        metrics.record_startup(self.steps)
+        total = sum(seconds for _, seconds in self.steps)
+        log(f"Startup took {total * 1000:.0f} ms: " + ", ".join(f"{name} {seconds * 1000:.1f} ms"
+                                                               for name, seconds in self.steps))
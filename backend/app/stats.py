@@ -0,0 +1,97 @@
+from collections import defaultdict
+from itertools import groupby
+from math import sqrt
+from operator import itemgetter
+from sqlalchemy.orm import Session
+from . import models
+from .ledger import in_session
+
+class PlayerAccumulator:
+    __slots__ = ("rounds", "wins", "total", "sum_sq", "best", "worst",
+                 "win_streak", "loss_streak", "longest_win", "longest_loss", "peak", "max_drawdown")
+
+    def __init__(self):
+        self.rounds = self.wins = self.total = self.sum_sq = 0
+        self.best = self.worst = None
+        self.win_streak = self.loss_streak = self.longest_win = self.longest_loss = 0
+        self.peak = self.max_drawdown = 0
+
+    def add(self, delta: int):
+        self.rounds += 1
+        self.total += delta
+        self.sum_sq += delta * delta
+        self.best = delta if self.best is None else max(self.best, delta)
+        self.worst = delta if self.worst is None else min(self.worst, delta)
+        if delta > 0:
+            self.wins += 1
+            self.win_streak += 1
+            self.loss_streak = 0
+            self.longest_win = max(self.longest_win, self.win_streak)
+        elif delta < 0:
+            self.loss_streak += 1
+            self.win_streak = 0
+            self.longest_loss = max(self.longest_loss, self.loss_streak)
+        else:
+            self.win_streak = self.loss_streak = 0
+        self.peak = max(self.peak, self.total)
+        self.max_drawdown = max(self.max_drawdown, self.peak - self.total)
+
+    def summary(self) -> dict:
+        mean = self.total / self.rounds
+        return {
+            "rounds": self.rounds, "total": self.total,
+            "win_rate": round(self.wins / self.rounds * 100, 1),
+            "avg": round(mean, 1),
+            "stddev": round(sqrt(max(self.sum_sq / self.rounds - mean * mean, 0)), 1),
+            "best": self.best, "worst": self.worst,
+            "longest_win_streak": self.longest_win, "longest_loss_streak": self.longest_loss,
+            "max_drawdown": self.max_drawdown,
+        }
+
+def load_scores(db: Session, session_id: int | None) -> list[tuple[int, int, int]]:
+    """All (round_id, player_id, delta) rows of a session in round order, in one query."""
+    return db.query(models.RoundScore.round_id, models.RoundScore.player_id, models.RoundScore.delta).join(
+        models.Round, models.RoundScore.round_id == models.Round.id
+    ).filter(in_session(models.Round.session_id, session_id)).order_by(
+        models.RoundScore.round_id, models.RoundScore.player_id
+    ).all()
+
+def compute(rows, series: bool = False, head_to_head: bool = False) -> dict:
+    """Single pass over (round_id, player_id, delta) rows sorted by round_id."""
+    players: dict[int, PlayerAccumulator] = defaultdict(PlayerAccumulator)
+    shared = defaultdict(int)
+    beat = defaultdict(int)
+    net = defaultdict(int)
+    round_ids = []
+    cumulative = {}
+    for round_id, group in groupby(rows, key=itemgetter(0)):
+        group = [(player_id, delta) for _, player_id, delta in group]
+        for player_id, delta in group:
+            players[player_id].add(delta)
+        if series:
+            round_ids.append(round_id)
+            for player_id, _ in group:
+                if player_id not in cumulative:
+                    cumulative[player_id] = [0] * (len(round_ids) - 1)
+            for player_id, points in cumulative.items():
+                points.append(players[player_id].total)
+        if head_to_head:
+            for a, delta_a in group:
+                for b, delta_b in group:
+                    if a != b:
+                        shared[a, b] += 1
+                        net[a, b] += delta_a - delta_b
+                        if delta_a > delta_b:
+                            beat[a, b] += 1
+    result = {"players": {player_id: acc.summary() for player_id, acc in players.items()}}
+    if series:
+        result["series"] = {"round_ids": round_ids, "scores": cumulative}
+    if head_to_head:
+        ids = sorted(players)
+        result["head_to_head"] = {
+            "player_ids": ids,
+            "rounds": [[shared[a, b] for b in ids] for a in ids],
+            "wins": [[beat[a, b] for b in ids] for a in ids],
+            "net": [[net[a, b] for b in ids] for a in ids],
+        }
+    return result
@@ -0,0 +1,28 @@
+"""Tables (tenants): each table at the venue has its own active session.
+
+A request names its table with an ``X-Table`` header or ``?table=`` (event
+streams can't set headers); requests that name none belong to the default
+table, so single-table setups work as before.
+"""
+import asyncio
+import re
+import weakref
+from fastapi import HTTPException, Request
+
+DEFAULT = "default"
+_KEY = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]{0,39}")
+
+# Held while a write for the table is in flight; dropped once no request is using it
+_write_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+def current_table(request: Request) -> str:
+    table = request.headers.get("x-table") or request.query_params.get("table") or DEFAULT
+    if not _KEY.fullmatch(table):
+        raise HTTPException(400, "Table must be 1-40 letters, digits, '.', '_' or '-'")
+    return table
+
+def write_lock(table: str) -> asyncio.Lock:
+    lock = _write_locks.get(table)
+    if lock is None:
+        lock = _write_locks[table] = asyncio.Lock()
+    return lock
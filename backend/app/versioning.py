@@ -0,0 +1,143 @@
+"""Per-scope data versions, bumped in the transaction of every write and cached per process.
+
+Caches here and in the modules built on them (active session, admin code) stay
+coherent across uvicorn workers and scripts without any messaging: every lookup
+first asks SQLite, through a connection of its own that never writes, whether
+any connection has committed since the previous lookup (``PRAGMA
+data_version``), and drops the cache if so. That check and the occasional
+single-row re-read run on the event loop; both are in-memory reads of an open
+connection, with no transaction left behind and nothing to fsync.
+"""
+import sqlite3
+from fastapi import Request, Response
+from sqlalchemy import event, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from . import models
+from .database import SQLALCHEMY_DATABASE_URL
+
+SESSIONS = "sessions"  # every table's sessions, for venue-wide analytics
+IDENTITIES = "identities"
+
+_versions: dict[str, int] = {}
+_watch: sqlite3.Connection | None = None
+_data_version: int | None = None
+_epoch = 0  # moves whenever the cache is dropped
+
+def session_scope(session_id: int | None) -> str:
+    return f"session:{session_id}" if session_id else "session:none"
+
+def active_scope(table: str) -> str:
+    return f"active:{table}"
+
+def sessions_scope(table: str) -> str:
+    return f"sessions:{table}"
+
+def listing_scopes(table: str) -> tuple[str, str]:
+    """Scopes to bump when a session's listing (name, round count, state) changes."""
+    return sessions_scope(table), SESSIONS
+
+def bump(db: Session, *scopes: str):
+    """Increment scope versions inside the caller's transaction; caches notice once it commits.
+
+    Takes a sync Session; async handlers call it through ``await db.run_sync(versioning.bump, ...)``.
+    Each scope moves at most once per transaction, so a scope's version doubles as a revision number
+    that advances by one per committed write.
+    """
+    pending = db.info.setdefault("versions", {})
+    for scope in scopes:
+        if scope in pending:
+            continue
+        pending[scope] = db.execute(insert(models.DataVersion).values(scope=scope, version=1).on_conflict_do_update(
+            index_elements=[models.DataVersion.scope], set_={"version": models.DataVersion.version + 1}
+        ).returning(models.DataVersion.version)).scalar_one()
+
+def stored(db: Session, scope: str) -> int:
+    """A scope's version as this transaction sees it (including its own bump), bypassing the cache."""
+    pending = db.info.get("versions", {})
+    if scope in pending:
+        return pending[scope]
+    return db.query(models.DataVersion.version).filter(models.DataVersion.scope == scope).scalar() or 0
+
+def _watcher() -> sqlite3.Connection:
+    global _watch
+    if _watch is None:
+        _watch = sqlite3.connect(make_url(SQLALCHEMY_DATABASE_URL).database, isolation_level=None,
+                                 check_same_thread=False)
+    return _watch
+
+def revalidate() -> int:
+    """Drop the cache if anything (another worker, a script, this process) committed since the last check.
+    Returns a counter that moves whenever it is dropped, for caches kept elsewhere."""
+    global _data_version, _epoch
+    data_version = _watcher().execute("PRAGMA data_version").fetchone()[0]
+    if data_version != _data_version:
+        _versions.clear()
+        _data_version = data_version
+        _epoch += 1
+    return _epoch
+
+def load_all():
+    """Fill the cache with every stored scope version in one read."""
+    revalidate()
+    _versions.update(_watcher().execute("SELECT scope, version FROM data_versions").fetchall())
+
+async def current(scope: str) -> int:
+    """A scope's latest committed version."""
+    revalidate()
+    if scope not in _versions:
+        row = _watcher().execute("SELECT version FROM data_versions WHERE scope = ?", (scope,)).fetchone()
+        _versions[scope] = row[0] if row else 0
+    return _versions[scope]
+
+async def read_with(db: AsyncSession, scope: str, query) -> tuple[int, object]:
+    """A scope's version and the value of a scalar ``query``, read in one statement of ``db``'s transaction.
+
+    For caches keyed on a version: the pair is consistent whatever snapshot the request reads, and safe to
+    cache when the version equals ``current()``.
+    """
+    version, value = (await db.execute(select(
+        select(models.DataVersion.version).where(models.DataVersion.scope == scope).scalar_subquery(),
+        query.scalar_subquery()))).one()
+    return version or 0, value
+
+def etag(versions: dict[str, int]) -> str:
+    return 'W/"' + "-".join([f"{scope}.{version}" for scope, version in versions.items()]) + '"'
+
+async def read(db: AsyncSession, *scopes: str) -> dict[str, int]:
+    """Scope versions as the request's own transaction sees them, bypassing the cache."""
+    rows = dict((await db.execute(select(models.DataVersion.scope, models.DataVersion.version).where(
+        models.DataVersion.scope.in_(scopes)))).all())
+    return {scope: rows.get(scope, 0) for scope in scopes}
+
+async def not_modified(request: Request, response: Response, db: AsyncSession, *scopes: str) -> Response | None:
+    """Set the ETag for these scopes; returns a 304 response when the client already has this version.
+
+    A client holding the latest versions gets its 304 from the cache, without a query. Otherwise the versions
+    are read in ``db``'s transaction, before the handler reads the body through it, so the ETag and the body
+    come from the same snapshot however many workers or scripts are writing.
+    """
+    held = {t.strip() for t in request.headers.get("if-none-match", "").split(",")} - {""}
+    if held and (tag := etag({scope: await current(scope) for scope in scopes})) in held:
+        return Response(status_code=304, headers={"ETag": tag})
+    tag = etag(await read(db, *scopes))
+    response.headers["ETag"] = tag
+    if tag in held:
+        return Response(status_code=304, headers={"ETag": tag})
+    return None
+
+def committed(db: AsyncSession, scope: str) -> int | None:
+    """The version ``db``'s last commit gave a scope (None if it didn't bump it)."""
+    return db.sync_session.info.get("committed_versions", {}).get(scope)
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(db: Session):
+    versions = db.info.pop("versions", None)
+    if versions:
+        db.info["committed_versions"] = versions
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(db: Session):
+    db.info.pop("versions", None)
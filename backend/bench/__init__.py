@@ -0,0 +1 @@
+"""Synthetic data seeding and load generation for the API. See ``python -m bench --help``."""
@@ -0,0 +1,154 @@
+"""Benchmark the API against a synthetic database.
+
+    python -m bench seed bench.db --sessions 10 --players 8 --rounds 100000
+    python -m bench run bench.db --mode inprocess --clients 20 --duration 30 --json before.json
+    python -m bench run bench.db --mode uvicorn --workers 2 --clients 50 --json after.json
+    python -m bench compare before.json after.json
+
+Run from the backend directory. ``run`` works on a copy of the database, so
+repeated runs start from the same data.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+async def run_inprocess(args) -> dict:
+    from app.main import app
+    from .workload import ASGITransport, run_clients
+    async with app.router.lifespan_context(app):
+        return await run_clients(lambda: ASGITransport(app), args.clients, args.duration,
+                                 args.poll_interval, args.think, args.seed)
+
+async def run_uvicorn(args) -> dict:
+    from .workload import HTTPTransport, run_clients
+    port = free_port()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+                               "--workers", str(args.workers), "--log-level", "warning"], env=os.environ.copy())
+    try:
+        for _ in range(100):
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+                    break
+            except OSError:
+                time.sleep(0.1)
+        return await run_clients(lambda: HTTPTransport("127.0.0.1", port), args.clients, args.duration,
+                                 args.poll_interval, args.think, args.seed)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="mahjong-bench-")
+    db_path = os.path.join(workdir, "bench.db")
+    shutil.copy(args.database, db_path)
+    # Before any app import: the app reads these at import time
+    os.environ["MAHJONG_DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ["MAHJONG_DEBUG_QUERIES"] = "1"
+    try:
+        result = asyncio.run(run_inprocess(args) if args.mode == "inprocess" else run_uvicorn(args))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    report = {"revision": git_revision(), "python": platform.python_version(), "mode": args.mode,
+              "workers": args.workers if args.mode == "uvicorn" else None, "clients": args.clients,
+              "duration_s": args.duration, "poll_interval_s": args.poll_interval, "think_s": args.think, **result}
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+def print_report(report: dict):
+    print(f"{report['mode']}: {report['requests']} requests in {report['elapsed_s']} s "
+          f"({report['rps']} req/s, {report['errors']} errors)")
+    print(f"{'endpoint':<16}{'reqs':>8}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'304s':>7}")
+    for op, e in report["endpoints"].items():
+        print(f"{op:<16}{e['requests']:>8}{e['rps']:>9}{e['p50_ms']:>9}{e['p95_ms']:>9}{e['p99_ms']:>9}"
+              f"{e['queries_mean'] if e['queries_mean'] is not None else '-':>9}{e['not_modified']:>7}")
+
+def compare(args) -> int:
+    """Print per-endpoint changes; exit 1 when p95 latency or query counts regressed."""
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    regressions = 0
+    print(f"{'endpoint':<16}{'p95 before':>12}{'p95 after':>12}{'change':>9}{'queries':>18}")
+    for op in sorted(set(before["endpoints"]) | set(after["endpoints"])):
+        b, a = before["endpoints"].get(op), after["endpoints"].get(op)
+        if not b or not a:
+            print(f"{op:<16}{'only in ' + ('after' if a else 'before'):>33}")
+            continue
+        change = (a["p95_ms"] - b["p95_ms"]) / b["p95_ms"] if b["p95_ms"] else 0
+        queries = f"{b['queries_mean']} -> {a['queries_mean']}"
+        worse = change > args.threshold or (a["queries_mean"] or 0) > (b["queries_mean"] or 0)
+        regressions += worse
+        print(f"{op:<16}{b['p95_ms']:>12}{a['p95_ms']:>12}{change:>+9.0%}{queries:>18}{'  REGRESSION' if worse else ''}")
+    print(f"throughput: {before['rps']} -> {after['rps']} req/s")
+    return 1 if regressions else 0
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Seed and load-test the Mahjong Tracker API")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed_cmd = commands.add_parser("seed", help="create a synthetic database")
+    seed_cmd.add_argument("database")
+    seed_cmd.add_argument("--sessions", type=int, default=10)
+    seed_cmd.add_argument("--players", type=int, default=8, help="players per session")
+    seed_cmd.add_argument("--rounds", type=int, default=100_000, help="rounds in total")
+    seed_cmd.add_argument("--seed", type=int, default=1)
+    seed_cmd.add_argument("--tables", type=int, default=1, help="tables (tenants) the sessions are spread over")
+
+    run_cmd = commands.add_parser("run", help="drive the API with concurrent virtual clients")
+    run_cmd.add_argument("database", help="seeded database; a copy is used")
+    run_cmd.add_argument("--mode", choices=("inprocess", "uvicorn"), default="inprocess")
+    run_cmd.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    run_cmd.add_argument("--clients", type=int, default=20, help="concurrent table devices")
+    run_cmd.add_argument("--duration", type=float, default=30, help="seconds")
+    run_cmd.add_argument("--poll-interval", type=float, default=5, help="standings poll interval, 0 to disable")
+    run_cmd.add_argument("--think", type=float, default=1, help="mean pause between a client's actions, 0 for none")
+    run_cmd.add_argument("--seed", type=int, default=1)
+    run_cmd.add_argument("--json", help="write the report here")
+
+    compare_cmd = commands.add_parser("compare", help="diff two JSON reports")
+    compare_cmd.add_argument("before")
+    compare_cmd.add_argument("after")
+    compare_cmd.add_argument("--threshold", type=float, default=0.2, help="allowed relative p95 increase")
+
+    args = parser.parse_args()
+    if args.command == "seed":
+        if os.path.exists(args.database):
+            parser.error(f"{args.database} already exists")
+        from .seed import seed
+        start = time.perf_counter()
+        if not 1 <= args.tables <= args.sessions:
+            parser.error("--tables must be between 1 and --sessions")
+        info = seed(args.database, args.sessions, args.players, args.rounds, args.seed, args.tables)
+        print(f"Seeded {info['sessions']} sessions x {info['players']} players, {info['rounds']} rounds "
+              f"at {info['tables']} table{'s' if info['tables'] > 1 else ''} "
+              f"in {time.perf_counter() - start:.1f} s")
+    elif args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+if __name__ == "__main__":
+    main()
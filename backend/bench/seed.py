@@ -0,0 +1,57 @@
+import random
+import sqlite3
+from sqlalchemy.orm import Session
+from app import analytics, ledger, migrations, progression
+from app.database import create_db_engine
+
+PLAYER_NAMES = ["East", "South", "West", "North", "Red", "Green", "White", "Bamboo", "Circle", "Character",
+                "Flower", "Season", "Plum", "Orchid", "Chrysanthemum", "Spring"]
+SCORES_PER_ROUND = 4
+
+def random_deltas(rng: random.Random, players: int) -> list[int]:
+    """Zero-sum deltas: one winner, the others pay."""
+    losses = [-rng.choice((1, 2, 4, 8, 16)) * 8 for _ in range(players - 1)]
+    return [-sum(losses)] + losses
+
+def seed(path: str, sessions: int = 10, players: int = 8, rounds: int = 100_000, seed: int = 1, tables: int = 1) -> dict:
+    """Create ``path`` (a fresh SQLite file) with ``rounds`` rounds spread evenly over ``sessions`` sessions.
+
+    With several tables, sessions are dealt to tables in turn and each table's last session is its active one.
+    """
+    rng = random.Random(seed)
+    engine = create_db_engine(f"sqlite:///{path}")
+    migrations.upgrade(engine, log=lambda message: None)
+    engine.dispose()
+
+    conn = sqlite3.connect(path)
+    with conn:
+        player_ids, round_id, score_rows, round_rows = {}, 0, [], []
+        for s in range(1, sessions + 1):
+            table = "default" if tables == 1 else f"table-{(s - 1) % tables + 1}"
+            conn.execute("INSERT INTO sessions (id, name, is_active, table_key) VALUES (?, ?, ?, ?)",
+                         (s, f"Bench session {s}", s > sessions - tables, table))
+            for p in range(players):
+                cur = conn.execute("INSERT INTO players (session_id, name, color) VALUES (?, ?, ?)",
+                                   (s, PLAYER_NAMES[p % len(PLAYER_NAMES)] + ("" if p < len(PLAYER_NAMES) else str(p)),
+                                    f"#{rng.randrange(0x1000000):06x}"))
+                player_ids.setdefault(s, []).append(cur.lastrowid)
+        for r in range(rounds):
+            s = r * sessions // rounds + 1
+            round_id += 1
+            round_rows.append((round_id, s))
+            seated = rng.sample(player_ids[s], min(SCORES_PER_ROUND, players))
+            score_rows.extend((round_id, player_id, delta) for player_id, delta in zip(seated, random_deltas(rng, len(seated))))
+        conn.executemany("INSERT INTO rounds (id, session_id) VALUES (?, ?)", round_rows)
+        conn.executemany("INSERT INTO round_scores (round_id, player_id, delta) VALUES (?, ?, ?)", score_rows)
+    conn.close()
+
+    engine = create_db_engine(f"sqlite:///{path}")
+    with Session(engine) as db:
+        ledger.rebuild(db)
+        progression.rebuild_all(db)
+        analytics.link_players(db)
+        db.commit()
+    with engine.connect() as conn:
+        conn.exec_driver_sql("ANALYZE")
+    engine.dispose()
+    return {"sessions": sessions, "players": players, "rounds": rounds, "seed": seed, "tables": tables}
@@ -0,0 +1,248 @@
+"""Virtual clients that replay the frontend's request mix, and the transports they talk through."""
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+# Weighted actions of one table device, on top of its standings poll
+ACTIONS = {
+    "rounds": 30,
+    "post_round": 30,
+    "players": 20,
+    "sessions": 10,
+    "statistics": 8,
+    "switch_session": 2,
+}
+
+class Response:
+    __slots__ = ("status", "headers", "body")
+
+    def __init__(self, status: int, headers: dict[str, str], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+class ASGITransport:
+    """Calls the ASGI app directly: no sockets, no server, one event loop."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, path: str, body=None, headers: dict | None = None) -> Response:
+        url = urlsplit(path)
+        payload = json.dumps(body).encode() if body is not None else b""
+        raw_headers = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+        if body is not None:
+            raw_headers.append((b"content-type", b"application/json"))
+        raw_headers.append((b"content-length", str(len(payload)).encode()))
+        scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+                 "scheme": "http", "path": url.path, "raw_path": url.path.encode(), "root_path": "",
+                 "query_string": url.query.encode(), "headers": raw_headers,
+                 "client": ("127.0.0.1", 50000), "server": ("bench", 80)}
+        sent = False
+        status, response_headers, chunks = 500, {}, []
+
+        async def receive():
+            nonlocal sent
+            if sent:
+                await asyncio.Event().wait()
+            sent = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+
+        async def send(message):
+            nonlocal status, response_headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_headers = {k.decode().lower(): v.decode() for k, v in message.get("headers", [])}
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return Response(status, response_headers, b"".join(chunks))
+
+class HTTPTransport:
+    """Minimal keep-alive HTTP/1.1 client over asyncio streams (one connection per virtual client)."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._streams = None
+
+    async def close(self):
+        if self._streams:
+            self._streams[1].close()
+            self._streams = None
+
+    async def request(self, method: str, path: str, body=None, headers: dict | None = None) -> Response:
+        for attempt in (1, 2):
+            if self._streams is None:
+                self._streams = await asyncio.open_connection(self.host, self.port)
+            try:
+                return await self._exchange(method, path, body, headers)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # The server closed an idle keep-alive connection; retry once on a fresh one
+                await self.close()
+                if attempt == 2:
+                    raise
+
+    async def _exchange(self, method, path, body, headers) -> Response:
+        reader, writer = self._streams
+        payload = json.dumps(body).encode() if body is not None else b""
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}", f"Content-Length: {len(payload)}"]
+        if body is not None:
+            lines.append("Content-Type: application/json")
+        lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + payload)
+        await writer.drain()
+        status = int((await reader.readuntil(b"\r\n")).split()[1])
+        response_headers = {}
+        while (line := await reader.readuntil(b"\r\n")) != b"\r\n":
+            key, _, value = line.decode().partition(":")
+            response_headers[key.strip().lower()] = value.strip()
+        if response_headers.get("transfer-encoding") == "chunked":
+            chunks = []
+            while size := int((await reader.readuntil(b"\r\n")).strip(), 16):
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            await reader.readexactly(2)
+            data = b"".join(chunks)
+        else:
+            data = await reader.readexactly(int(response_headers.get("content-length", 0)))
+        if response_headers.get("connection") == "close":
+            await self.close()
+        return Response(status, response_headers, data)
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.not_modified = defaultdict(int)
+
+    def add(self, op: str, seconds: float, response: Response):
+        self.latencies[op].append(seconds)
+        if "x-query-count" in response.headers:
+            self.queries[op].append(int(response.headers["x-query-count"]))
+        if response.status == 304:
+            self.not_modified[op] += 1
+        elif response.status >= 400:
+            self.errors[op] += 1
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+def summarize(recorder: Recorder, elapsed: float) -> dict:
+    endpoints = {}
+    for op, latencies in sorted(recorder.latencies.items()):
+        queries = recorder.queries[op]
+        endpoints[op] = {
+            "requests": len(latencies), "errors": recorder.errors[op], "not_modified": recorder.not_modified[op],
+            "rps": round(len(latencies) / elapsed, 2),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+            "queries_mean": round(sum(queries) / len(queries), 2) if queries else None,
+            "queries_max": max(queries) if queries else None,
+        }
+    total = sum(e["requests"] for e in endpoints.values())
+    return {"elapsed_s": round(elapsed, 2), "requests": total, "rps": round(total / elapsed, 2),
+            "errors": sum(e["errors"] for e in endpoints.values()), "endpoints": endpoints}
+
+class Client:
+    """One table device: polls standings on a fixed interval and performs weighted actions in between."""
+
+    def __init__(self, transport, recorder: Recorder, rng: random.Random, table: str, session_ids: list[int]):
+        self.transport = transport
+        self.recorder = recorder
+        self.rng = rng
+        self.table = table
+        self.session_ids = session_ids
+        self.etags: dict[str, str] = {}
+        self.player_ids: list[int] = []
+
+    async def call(self, op: str, method: str, path: str, body=None) -> Response:
+        # Like the browser: revalidate cached GETs with If-None-Match
+        headers = {"X-Debug-Queries": "1", "X-Table": self.table}
+        if method == "GET" and path in self.etags:
+            headers["If-None-Match"] = self.etags[path]
+        start = time.perf_counter()
+        response = await self.transport.request(method, path, body, headers)
+        self.recorder.add(op, time.perf_counter() - start, response)
+        if method == "GET" and "etag" in response.headers:
+            self.etags[path] = response.headers["etag"]
+        return response
+
+    async def refresh_players(self):
+        self.etags.pop("/api/players", None)
+        response = await self.call("players", "GET", "/api/players")
+        if response.status == 200:
+            self.player_ids = [p["id"] for p in response.json()]
+
+    async def poll(self, deadline: float, interval: float):
+        await asyncio.sleep(self.rng.uniform(0, interval))
+        while time.monotonic() < deadline:
+            await self.call("standings", "GET", "/api/game/standings")
+            await asyncio.sleep(interval)
+
+    async def act(self, deadline: float, think: float):
+        await self.refresh_players()
+        ops, weights = list(ACTIONS), list(ACTIONS.values())
+        while time.monotonic() < deadline:
+            op = self.rng.choices(ops, weights)[0]
+            if op == "rounds":
+                await self.call(op, "GET", "/api/rounds?limit=50")
+            elif op == "players":
+                await self.call(op, "GET", "/api/players")
+            elif op == "sessions":
+                await self.call(op, "GET", "/api/sessions")
+            elif op == "statistics":
+                await self.call(op, "GET", "/api/game/statistics")
+            elif op == "switch_session":
+                await self.call(op, "POST", f"/api/sessions/{self.rng.choice(self.session_ids)}/load")
+                await self.refresh_players()
+            elif op == "post_round" and len(self.player_ids) >= 2:
+                seated = self.rng.sample(self.player_ids, min(4, len(self.player_ids)))
+                losses = [-self.rng.choice((8, 16, 32)) for _ in seated[1:]]
+                scores = [{"player_id": p, "delta": d} for p, d in zip(seated, [-sum(losses)] + losses)]
+                await self.call(op, "POST", "/api/rounds", {"scores": scores})
+            if think:
+                await asyncio.sleep(self.rng.expovariate(1 / think))
+
+async def run_clients(make_transport, clients: int, duration: float, poll_interval: float, think: float,
+                      seed: int = 1) -> dict:
+    recorder = Recorder()
+    setup = make_transport()
+    # Devices are dealt to the seeded tables in turn; each only switches between its own table's sessions
+    tables = defaultdict(list)
+    for s in (await setup.request("GET", "/api/analytics/sessions")).json():
+        tables[s["table"]].append(s["id"])
+    tables = sorted(tables.items())
+    if hasattr(setup, "close"):
+        await setup.close()
+    transports = []
+    deadline = time.monotonic() + duration
+    start = time.perf_counter()
+    tasks = []
+    for i in range(clients):
+        table, session_ids = tables[i % len(tables)]
+        client = Client(make_transport(), recorder, random.Random(seed * 1000 + i), table, session_ids)
+        transports.append(client.transport)
+        tasks.append(client.act(deadline, think))
+        if poll_interval:
+            # The poller gets its own connection, as a browser would open a second one
+            poller = Client(make_transport(), recorder, random.Random(seed * 2000 + i), table, session_ids)
+            transports.append(poller.transport)
+            tasks.append(poller.poll(deadline, poll_interval))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    for transport in transports:
+        if hasattr(transport, "close"):
+            await transport.close()
+    return summarize(recorder, elapsed)
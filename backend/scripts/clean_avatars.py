@@ -0,0 +1,17 @@
+import sys
+sys.path.insert(0, '.')
+from sqlalchemy import select
+from app.database import SessionLocal
+from app import avatars, models
+
+def main():
+    db = SessionLocal()
+    referenced = set(db.scalars(select(models.Player.avatar_path).where(models.Player.avatar_path != None)))
+    db.close()
+    removed = avatars.sweep_orphans(referenced)
+    for name in removed:
+        print(f"removed {name}")
+    print(f"Removed {len(removed)} orphaned avatar file(s)")
+
+if __name__ == '__main__':
+    main()
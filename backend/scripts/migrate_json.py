@@ -1,45 +1,253 @@
+"""Import a legacy mahjong_data.json ledger into a session.
+
+The file is parsed incrementally, so the ledger is never held in memory as a
+whole. Rounds are written with pre-assigned ids in bulk, one transaction per
+chunk, and a checkpoint is stored with each chunk: re-running the same command
+after a failure resumes where it stopped.
+
+    python scripts/migrate_json.py ../mahjong_data.json --session "Old ledger"
+    python scripts/migrate_json.py ../mahjong_data.json --dry-run
+"""
+import argparse
+import hashlib
 import json
+import os
 import sys
+from contextlib import contextmanager
 sys.path.insert(0, '.')
-from app.database import SessionLocal, engine, Base
-from app import models
-
-def migrate():
-    Base.metadata.create_all(bind=engine)
-    db = SessionLocal()
-
-    with open('../mahjong_data.json', 'r') as f:
-        data = json.load(f)
-
-    # Create players
-    player_map = {}
-    for i, (name, score) in enumerate(data.get('players', {}).items()):
-        color = data.get('player_colors', {}).get(name, '#808080')
-        avatar = data.get('player_avatars', {}).get(name)
-        player = models.Player(name=name, color=color, avatar_path=avatar)
-        db.add(player)
-        db.flush()
-        player_map[name] = player.id
-
-    # Create rounds
-    for round_data in data.get('ledger', []):
-        recorder_name = round_data.get('recorder')
-        recorder_id = player_map.get(recorder_name) if recorder_name else None
-        round_obj = models.Round(recorder_id=recorder_id, recorder_ip=round_data.get('ip'))
-        db.add(round_obj)
-        db.flush()
-        for player_name, delta in round_data.get('deltas', {}).items():
-            if player_name in player_map:
-                score = models.RoundScore(round_id=round_obj.id, player_id=player_map[player_name], delta=delta)
-                db.add(score)
-
-    # Save admin code
-    admin_code = data.get('admin_code', '8888')
-    db.add(models.Setting(key='admin_code', value=admin_code))
-
-    db.commit()
-    print(f"Migrated {len(player_map)} players and {len(data.get('ledger', []))} rounds")
-    db.close()
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+from app.database import engine, next_id
+from app import models, migrations, ledger, versioning, admin_code, analytics, archive, progression, active_session
+
+class JSONStream:
+    """Minimal incremental reader for a top-level JSON object whose values may be large arrays."""
+
+    def __init__(self, f, chunk_size: int = 1 << 16):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        data = self.f.read(self.chunk_size)
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def _peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON input")
+
+    def _expect(self, char: str):
+        if self._peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos}, found {self.buf[self.pos]!r}")
+        self.pos += 1
+
+    def value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A value ending exactly at the buffer edge may be a truncated number or literal
+                if end < len(self.buf) or self.eof or not self._fill():
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+
+    def items(self):
+        """Yield the keys of the top-level object; the caller must consume each value before the next key."""
+        self._expect("{")
+        if self._peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self._expect(":")
+            yield key
+            if self._peek() == ",":
+                self.pos += 1
+                continue
+            self._expect("}")
+            return
+
+    def array(self):
+        self._expect("[")
+        if self._peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self._peek() == ",":
+                self.pos += 1
+                continue
+            self._expect("]")
+            return
+
+def read_header(path: str) -> tuple[dict, int]:
+    """First pass: every small top-level section, plus the number of ledger entries."""
+    header, ledger_size = {}, 0
+    with open(path, encoding="utf-8") as f:
+        stream = JSONStream(f)
+        for key in stream.items():
+            if key == "ledger":
+                ledger_size = sum(1 for _ in stream.array())
+            else:
+                header[key] = stream.value()
+    return header, ledger_size
+
+def iter_ledger(path: str):
+    with open(path, encoding="utf-8") as f:
+        stream = JSONStream(f)
+        for key in stream.items():
+            if key == "ledger":
+                yield from stream.array()
+            else:
+                stream.value()
+
+def round_problems(round_data: dict, names) -> list[str]:
+    deltas = round_data.get("deltas", {})
+    problems = [f"unknown player {name!r}" for name in deltas if name not in names]
+    if sum(deltas.values()) != 0:
+        problems.append(f"deltas sum to {sum(deltas.values())}")
+    return problems
+
+def checkpoint_key(path: str) -> str:
+    return "import:" + hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+
+@contextmanager
+def write_transaction():
+    """Session in a transaction that holds SQLite's write lock from the start, so pre-assigned ids cannot collide."""
+    with engine.connect() as conn:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        with Session(bind=conn) as db:
+            yield db
+            db.flush()
+        conn.commit()
+
+def dry_run(path: str):
+    header, ledger_size = read_header(path)
+    names = set(header.get("players", {}))
+    problems = 0
+    for index, round_data in enumerate(iter_ledger(path)):
+        for problem in round_problems(round_data, names):
+            problems += 1
+            print(f"round {index}: {problem}")
+    print(f"Dry run: {len(names)} players, {ledger_size} rounds, {problems} problem(s); nothing written")
+    return 1 if problems else 0
+
+def prepare(path: str, header: dict, session_name: str | None, session_id: int | None) -> tuple[int, dict, int]:
+    """Create (or resume into) the target session and its players. Returns (session_id, player_map, rounds_done)."""
+    key = checkpoint_key(path)
+    with write_transaction() as db:
+        checkpoint = db.get(models.Setting, key)
+        if checkpoint:
+            state = json.loads(checkpoint.value)
+            session_id = state["session_id"]
+            print(f"Resuming into session {session_id} after {state['done']} rounds")
+        else:
+            if session_id is None:
+                session = models.Session(name=session_name or f"Imported {os.path.basename(path)}", is_active=False)
+                db.add(session)
+                db.flush()
+                session_id = session.id
+            elif not db.get(models.Session, session_id):
+                raise SystemExit(f"Session {session_id} not found")
+            state = {"session_id": session_id, "done": 0}
+        existing = dict(db.execute(select(models.Player.name, models.Player.id).where(
+            models.Player.session_id == session_id)).all())
+        new_players = [name for name in header.get("players", {}) if name not in existing]
+        first_id = next_id(db, models.Player)
+        rows = [{"id": first_id + i, "session_id": session_id, "name": name,
+                 "color": header.get("player_colors", {}).get(name, "#808080"),
+                 "avatar_path": header.get("player_avatars", {}).get(name),
+                 "identity_id": analytics.resolve_identity(db, name)} for i, name in enumerate(new_players)]
+        if rows:
+            db.execute(insert(models.Player), rows)
+        player_map = {**existing, **{row["name"]: row["id"] for row in rows}}
+        if "admin_code" in header and not db.get(models.Setting, "admin_code"):
+            db.add(models.Setting(key="admin_code", value=admin_code.hash_code(str(header["admin_code"]))))
+            versioning.bump(db, admin_code.ADMIN)
+        db.merge(models.Setting(key=key, value=json.dumps(state)))
+        table = active_session.session_table(db, session_id)
+        versioning.bump(db, versioning.session_scope(session_id), *versioning.listing_scopes(table), versioning.IDENTITIES)
+    return session_id, player_map, state["done"]
+
+def write_chunk(path: str, session_id: int, player_map: dict, chunk: list[dict], done: int) -> int:
+    """Insert one chunk of ledger rounds with pre-assigned ids; returns the number of skipped score entries."""
+    with write_transaction() as db:
+        round_id = next_id(db, models.Round, archive.highest_round_id(db))
+        rounds, scores, skipped = [], [], 0
+        for round_data in chunk:
+            recorder = round_data.get("recorder")
+            rounds.append({"id": round_id, "session_id": session_id, "recorder_id": player_map.get(recorder),
+                           "recorder_ip": round_data.get("ip")})
+            for name, delta in round_data.get("deltas", {}).items():
+                if name in player_map:
+                    scores.append({"round_id": round_id, "player_id": player_map[name], "delta": delta})
+                else:
+                    skipped += 1
+            round_id += 1
+        db.execute(insert(models.Round), rounds)
+        if scores:
+            db.execute(insert(models.RoundScore), scores)
+        ledger.apply_scores(db, session_id, [(s["player_id"], s["delta"]) for s in scores])
+        ledger.apply_rounds(db, session_id, len(rounds))
+        progression.refresh(db, session_id, rounds[0]["id"])
+        db.merge(models.Setting(key=checkpoint_key(path), value=json.dumps({"session_id": session_id, "done": done})))
+        table = active_session.session_table(db, session_id)
+        versioning.bump(db, versioning.session_scope(session_id), *versioning.listing_scopes(table))
+    return skipped
+
+def finish(path: str):
+    with engine.begin() as conn:
+        conn.execute(models.Setting.__table__.delete().where(models.Setting.key == checkpoint_key(path)))
+
+def migrate(path: str, session_name: str | None = None, session_id: int | None = None, chunk_size: int = 5000):
+    migrations.upgrade(engine)
+    header, ledger_size = read_header(path)
+    session_id, player_map, done = prepare(path, header, session_name, session_id)
+    skipped = 0
+    chunk = []
+    for index, round_data in enumerate(iter_ledger(path)):
+        if index < done:
+            continue
+        chunk.append(round_data)
+        if len(chunk) == chunk_size:
+            done += len(chunk)
+            skipped += write_chunk(path, session_id, player_map, chunk, done)
+            chunk = []
+            print(f"Imported {done}/{ledger_size} rounds ({done / ledger_size:.1%})")
+    if chunk:
+        done += len(chunk)
+        skipped += write_chunk(path, session_id, player_map, chunk, done)
+    finish(path)
+    print(f"Migrated {len(player_map)} players and {done} rounds into session {session_id}"
+          + (f" ({skipped} score entries for unknown players skipped)" if skipped else ""))
 
 if __name__ == '__main__':
-    migrate()
+    parser = argparse.ArgumentParser(description="Import a legacy mahjong_data.json ledger")
+    parser.add_argument("path", nargs="?", default="../mahjong_data.json")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--session", help="name of a new session to import into")
+    target.add_argument("--session-id", type=int, help="existing session to import into")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="rounds per transaction")
+    parser.add_argument("--dry-run", action="store_true", help="validate the file without writing anything")
+    args = parser.parse_args()
+    if args.dry_run:
+        sys.exit(dry_run(args.path))
+    migrate(args.path, args.session, args.session_id, args.chunk_size)
@@ -0,0 +1,23 @@
+import sys
+sys.path.insert(0, '.')
+from app.database import SessionLocal, engine
+from app import ledger, migrations, progression
+
+def main(verify_only: bool):
+    migrations.upgrade(engine)
+    db = SessionLocal()
+    if verify_only:
+        drift = ledger.find_drift(db)
+    else:
+        drift = ledger.rebuild(db)
+        progression.rebuild_all(db)
+        db.commit()
+    for d in drift:
+        print(f"session={d['session_id']} player={d['player_id']} expected={d['expected']} stored={d['stored']}")
+    action = "found" if verify_only else "fixed"
+    print(f"Ledger drift {action}: {len(drift)} row(s)")
+    db.close()
+    return 1 if verify_only and drift else 0
+
+if __name__ == '__main__':
+    sys.exit(main('--verify' in sys.argv[1:]))
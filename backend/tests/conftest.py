@@ -0,0 +1,22 @@
+import os
+import tempfile
+import pytest
+
+# The app binds its engines at import, so point it at a scratch database first
+os.environ["MAHJONG_DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/mahjong.db"
+
+from fastapi.testclient import TestClient  # noqa: E402
+from app.main import app  # noqa: E402
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+@pytest.fixture
+def table(client, request):
+    """A table of its own for the test, with an active session and players a and b; returns (headers, ids)."""
+    headers = {"X-Table": request.node.name[:40].replace("[", "-").replace("]", "")}
+    client.post("/api/sessions", json={"name": request.node.name}, headers=headers)
+    ids = [client.post("/api/players", json={"name": name}, headers=headers).json()["id"] for name in "ab"]
+    return headers, ids
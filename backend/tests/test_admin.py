@@ -0,0 +1,12 @@
+import asyncio
+import httpx
+from app.main import app
+
+def test_concurrent_wrong_codes_are_limited(client):
+    async def attempts():
+        transport = httpx.ASGITransport(app=app, client=("10.0.0.1", 1234))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await asyncio.gather(*(http.post("/api/admin/verify", json={"code": "wrong"}) for _ in range(20)))
+    statuses = [r.status_code for r in asyncio.run(attempts())]
+    assert statuses.count(401) == 5
+    assert statuses.count(429) == 15
@@ -0,0 +1,32 @@
+def scores(a, b, delta=5):
+    return [{"player_id": a, "delta": delta}, {"player_id": b, "delta": -delta}]
+
+def test_round_scores_session_players(client, table):
+    headers, (a, b) = table
+    response = client.post("/api/rounds", json={"scores": scores(a, b)}, headers=headers)
+    assert response.status_code == 200
+    assert [s["player_name"] for s in response.json()["scores"]] == ["a", "b"]
+
+def test_foreign_player_is_rejected(client, table):
+    headers, (a, _) = table
+    other = {"X-Table": "other-table"}
+    client.post("/api/sessions", json={"name": "other"}, headers=other)
+    foreign = client.post("/api/players", json={"name": "c"}, headers=other).json()["id"]
+    response = client.post("/api/rounds", json={"scores": scores(a, foreign)}, headers=headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == f"Player {foreign} not found"
+    batch = client.post("/api/rounds/batch", json={"rounds": [{"scores": scores(a, foreign)}]}, headers=headers)
+    assert batch.status_code == 400
+    assert client.get("/api/rounds", headers=headers).json() == []
+
+def test_unknown_recorder_is_rejected(client, table):
+    headers, (a, b) = table
+    response = client.post("/api/rounds", json={"scores": scores(a, b), "recorder_id": 999_999}, headers=headers)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Recorder 999999 not found"
+    batch = client.post("/api/rounds/batch", json={"rounds": [{"scores": scores(a, b), "recorder_id": a},
+                                                              {"scores": scores(a, b), "recorder_id": 999_999}]},
+                        headers=headers)
+    assert batch.status_code == 400
+    assert [item["status"] for item in batch.json()["detail"]["results"]] == ["created", "invalid"]
+    assert client.get("/api/rounds", headers=headers).json() == []
@@ -11,12 +11,14 @@ import { SessionManager } from './components/SessionManager'
 import { SettingsContent } from './components/Settings'
 import { Drawer } from './components/Drawer'
 import { IconButton } from './components/IconButton'
+import { useLiveUpdates } from './api/live'
 
 type DrawerType = 'stats' | 'history' | 'players' | 'settings' | null
 
 function App() {
   const { t, i18n } = useTranslation()
   const [activeDrawer, setActiveDrawer] = useState<DrawerType>(null)
+  useLiveUpdates()
 
   const toggleLang = () => {
     const newLang = i18n.language === 'en' ? 'zh' : 'en'
@@ -1,6 +1,11 @@
 import axios from 'axios'
 
-const api = axios.create({ baseURL: '/api' })
+// Each table at the venue opens the app as /?table=<name>; without one it uses the server's default table
+export const table = new URLSearchParams(window.location.search).get('table')
+export const withTable = (url: string) =>
+  table ? `${url}${url.includes('?') ? '&' : '?'}table=${encodeURIComponent(table)}` : url
+
+const api = axios.create({ baseURL: '/api', headers: table ? { 'X-Table': table } : {} })
 
 export interface Player {
   id: number
@@ -20,10 +25,17 @@ export interface Round {
   id: number
   recorder_id: number | null
   recorder_ip: string | null
+  client_key: string | null
   created_at: string
   scores: RoundScore[]
 }
 
+// Content-addressed avatars (<sha256>.<ext>) have square webp thumbnails; older uploads only have the original
+export const avatarUrl = (path: string, size: 64 | 128 | 256 = 64) => {
+  const digest = path.match(/^([0-9a-f]{64})\./)?.[1]
+  return `/static/avatars/${digest ? `${digest}_${size}.webp` : path}`
+}
+
 export const playersApi = {
   list: () => api.get<Player[]>('/players').then(r => r.data),
   create: (name: string, color: string) => api.post<Player>('/players', { name, color }).then(r => r.data),
@@ -38,10 +50,32 @@ export const playersApi = {
 }
 
 export const roundsApi = {
-  list: () => api.get<Round[]>('/rounds').then(r => r.data),
-  create: (scores: { player_id: number; delta: number }[], recorder_id?: number) =>
-    api.post<Round>('/rounds', { scores, recorder_id }).then(r => r.data),
-  delete: (id: number) => api.delete(`/rounds/${id}`),
+  list: (params?: { before_id?: number; since_id?: number; limit?: number }) =>
+    api.get<Round[]>('/rounds', { params }).then(r => r.data),
+  create: (scores: { player_id: number; delta: number }[], recorder_id?: number, client_key?: string) =>
+    api.post<Round>('/rounds', { scores, recorder_id, client_key }).then(r => r.data),
+}
+
+export interface JournalEntry {
+  id: number
+  session_id: number | null
+  action: string
+  target_id: number | null
+  undone: boolean
+  actor_id: number | null
+  actor_ip: string | null
+  created_at: string
+  data: Record<string, unknown>
+}
+
+export interface JournalStep {
+  entry: JournalEntry
+  standings_delta: Record<number, number>
+}
+
+export const journalApi = {
+  undo: () => api.post<JournalStep>('/journal/undo').then(r => r.data),
+  redo: () => api.post<JournalStep>('/journal/redo').then(r => r.data),
 }
 
 export const gameApi = {
@@ -60,6 +94,8 @@ export interface Session {
   name: string
   created_at: string
   is_active: boolean
+  table: string
+  archived: boolean
   round_count: number
 }
 
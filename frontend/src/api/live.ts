@@ -0,0 +1,111 @@
+import { useEffect } from 'react'
+import { useQueryClient, type QueryClient } from '@tanstack/react-query'
+import { roundsApi, withTable, type Player, type Round } from './client'
+
+interface LiveEvent {
+  type: string
+  id: number
+  session_id: number | null
+  standings?: Player[]
+  entry_id?: number
+  standings_delta?: Record<number, number>
+  round?: Round
+  round_id?: number
+}
+
+function applyDelta(standings: Player[] | undefined, delta: Record<number, number>) {
+  if (!standings) return standings
+  return standings
+    .map(p => (p.id in delta ? { ...p, score: p.score + delta[p.id] } : p))
+    .sort((a, b) => b.score - a.score)
+}
+
+// Journal entries whose delta is already in the cache: the tab that undoes or redoes gets it both in the
+// response and as a live event
+const appliedSteps = new Set<number>()
+
+// Patch the cached standings and player scores with an undo/redo's delta instead of refetching them
+export function applyStandingsDelta(queryClient: QueryClient, entryId: number, delta: Record<number, number>) {
+  if (appliedSteps.has(entryId)) return
+  appliedSteps.add(entryId)
+  queryClient.setQueryData<Player[]>(['standings'], old => applyDelta(old, delta))
+  queryClient.setQueryData<Player[]>(['players'], old =>
+    old?.map(p => (p.id in delta ? { ...p, score: p.score + delta[p.id] } : p)))
+}
+
+// Merge rounds into the cached history (newest first, like the list endpoint) instead of refetching all of it
+export function addRounds(queryClient: QueryClient, rounds: Round[]) {
+  queryClient.setQueryData<Round[]>(['rounds'], old => {
+    if (!old) return old
+    const known = new Set(old.map(r => r.id))
+    const added = rounds.filter(r => !known.has(r.id))
+    return added.length ? [...added, ...old].sort((a, b) => b.id - a.id) : old
+  })
+}
+
+// Fetch only the rounds newer than the newest cached one
+async function fetchNewRounds(queryClient: QueryClient) {
+  const cached = queryClient.getQueryData<Round[]>(['rounds'])
+  if (!cached) return
+  addRounds(queryClient, await roundsApi.list({ since_id: cached.length ? cached[0].id : 0 }))
+}
+
+// Standings carry every player's score; the player list shows the same scores
+function syncPlayerScores(queryClient: QueryClient, standings: Player[]) {
+  const scores = new Map(standings.map(p => [p.id, p.score]))
+  queryClient.setQueryData<Player[]>(['players'], old =>
+    old?.map(p => (scores.has(p.id) ? { ...p, score: scores.get(p.id)! } : p)))
+}
+
+// Keeps React Query caches fresh from the server's event stream instead of polling
+export function useLiveUpdates() {
+  const queryClient = useQueryClient()
+
+  useEffect(() => {
+    const source = new EventSource(withTable('/api/events'))
+    const handle = (e: MessageEvent) => {
+      const event: LiveEvent = JSON.parse(e.data)
+      if (event.type === 'ready') return
+      if (event.type.startsWith('session_') || event.type === 'resync') {
+        queryClient.invalidateQueries()
+        return
+      }
+      if (event.standings) {
+        queryClient.setQueryData(['standings'], event.standings)
+        syncPlayerScores(queryClient, event.standings)
+      } else if (event.standings_delta && event.entry_id !== undefined) {
+        // Undo/redo of rounds only moves scores
+        applyStandingsDelta(queryClient, event.entry_id, event.standings_delta)
+      }
+      // Apply what the event carries to the round history; only rare changes refetch it
+      switch (event.type) {
+        case 'round_created':
+          if (event.round) addRounds(queryClient, [event.round])
+          break
+        case 'rounds_created':
+          fetchNewRounds(queryClient).catch(() => queryClient.invalidateQueries({ queryKey: ['rounds'] }))
+          break
+        case 'round_deleted':
+          queryClient.setQueryData<Round[]>(['rounds'], old => old?.filter(r => r.id !== event.round_id))
+          break
+        case 'game_reset':
+          queryClient.setQueryData<Round[]>(['rounds'], old => (old ? [] : old))
+          break
+        case 'player_created':
+          queryClient.invalidateQueries({ queryKey: ['players'] })
+          break
+        default:
+          // Player edits and deletions rename or drop scores; undo/redo add or remove unknown rounds
+          queryClient.invalidateQueries({ queryKey: ['players'] })
+          queryClient.invalidateQueries({ queryKey: ['rounds'] })
+      }
+      // Statistics are computed by the server: one summary request, and only while they are on screen
+      queryClient.invalidateQueries({ queryKey: ['statistics'] })
+    }
+    const types = ['ready', 'resync', 'round_created', 'rounds_created', 'round_deleted', 'game_reset', 'player_created',
+      'player_updated', 'player_deleted', 'session_created', 'session_loaded', 'session_deleted', 'session_archived',
+      'session_restored', 'undo', 'redo']
+    types.forEach(type => source.addEventListener(type, handle))
+    return () => source.close()
+  }, [queryClient])
+}
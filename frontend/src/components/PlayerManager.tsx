@@ -1,7 +1,7 @@
 import { useState, useRef } from 'react'
 import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query'
 import { useTranslation } from 'react-i18next'
-import { playersApi } from '../api/client'
+import { playersApi, avatarUrl } from '../api/client'
 import { AdminModal } from './AdminModal'
 
 export function PlayerManager() {
@@ -92,7 +92,7 @@ export function PlayerManager() {
             />
             {p.avatar_path ? (
               <img
-                src={`/static/avatars/${p.avatar_path}`}
+                src={avatarUrl(p.avatar_path)}
                 alt={p.name}
                 className="w-8 h-8 rounded-full object-cover cursor-pointer hover:ring-2 ring-blue-400"
                 onClick={() => handleAvatarClick(p.id)}
@@ -1,30 +1,43 @@
 import { useState } from 'react'
 import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query'
 import { useTranslation } from 'react-i18next'
-import { roundsApi, playersApi } from '../api/client'
+import axios from 'axios'
+import { roundsApi, playersApi, journalApi } from '../api/client'
+import { applyStandingsDelta } from '../api/live'
 import { AdminModal } from './AdminModal'
 
+type Step = 'undo' | 'redo'
+
 export function RoundHistory() {
   const { t } = useTranslation()
   const queryClient = useQueryClient()
-  const { data: rounds, isLoading } = useQuery({ queryKey: ['rounds'], queryFn: roundsApi.list })
+  const { data: rounds, isLoading } = useQuery({ queryKey: ['rounds'], queryFn: () => roundsApi.list() })
   const { data: players } = useQuery({ queryKey: ['players'], queryFn: playersApi.list })
-  const [showAdminModal, setShowAdminModal] = useState(false)
+  const [pendingStep, setPendingStep] = useState<Step | null>(null)
+  const [stepError, setStepError] = useState<string | null>(null)
 
-  const deleteMutation = useMutation({
-    mutationFn: (id: number) => roundsApi.delete(id),
-    onSuccess: () => {
+  const stepMutation = useMutation({
+    mutationFn: (step: Step) => (step === 'undo' ? journalApi.undo() : journalApi.redo()),
+    onSuccess: result => {
+      setStepError(null)
+      if (Object.keys(result.standings_delta).length) {
+        applyStandingsDelta(queryClient, result.entry.id, result.standings_delta)
+      } else {
+        // A player edit: names or colors change, not scores
+        queryClient.invalidateQueries({ queryKey: ['standings'] })
+        queryClient.invalidateQueries({ queryKey: ['players'] })
+      }
       queryClient.invalidateQueries({ queryKey: ['rounds'] })
-      queryClient.invalidateQueries({ queryKey: ['standings'] })
       queryClient.invalidateQueries({ queryKey: ['statistics'] })
     },
+    // 409: nothing to undo or redo, or the change can't be taken back any more
+    onError: error =>
+      setStepError(axios.isAxiosError(error) ? (error.response?.data?.detail ?? error.message) : String(error)),
   })
 
-  const handleUndo = () => {
-    if (rounds?.length) {
-      deleteMutation.mutate(rounds[0].id)
-      setShowAdminModal(false)
-    }
+  const handleStep = () => {
+    if (pendingStep) stepMutation.mutate(pendingStep)
+    setPendingStep(null)
   }
 
   if (isLoading) return <div className="p-4">Loading...</div>
@@ -34,15 +47,18 @@ export function RoundHistory() {
 
   return (
     <div>
-      <div className="flex justify-end items-center mb-3">
-        {rounds?.length ? (
+      <div className="flex justify-end items-center gap-2 mb-3">
+        {stepError && <span className="text-xs text-red-600 mr-auto">{stepError}</span>}
+        {(['undo', 'redo'] as const).map(step => (
           <button
-            onClick={() => setShowAdminModal(true)}
-            className="px-2 py-1 bg-white border border-[#E5E5EA] text-gray-700 rounded-lg hover:bg-gray-50 text-xs"
+            key={step}
+            onClick={() => setPendingStep(step)}
+            disabled={stepMutation.isPending}
+            className="px-2 py-1 bg-white border border-[#E5E5EA] text-gray-700 rounded-lg hover:bg-gray-50 text-xs disabled:opacity-50"
           >
-            {t('undoLast')}
+            {t(step === 'undo' ? 'undoLast' : 'redoLast')}
           </button>
-        ) : null}
+        ))}
       </div>
 
       <div className="overflow-x-auto max-h-[60vh] overflow-y-auto">
@@ -86,8 +102,8 @@ export function RoundHistory() {
         )}
       </div>
 
-      {showAdminModal && (
-        <AdminModal onVerified={handleUndo} onClose={() => setShowAdminModal(false)} />
+      {pendingStep && (
+        <AdminModal onVerified={handleStep} onClose={() => setPendingStep(null)} />
       )}
     </div>
   )
@@ -2,6 +2,7 @@ import { useState, useEffect } from 'react'
 import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query'
 import { useTranslation } from 'react-i18next'
 import { playersApi, roundsApi } from '../api/client'
+import { addRounds } from '../api/live'
 import { AdminModal } from './AdminModal'
 
 const RECORDER_KEY = 'mahjong_recorder'
@@ -32,9 +33,9 @@ export function ScoreInput() {
 
   const mutation = useMutation({
     mutationFn: (data: { player_id: number; delta: number }[]) => roundsApi.create(data),
-    onSuccess: () => {
+    onSuccess: round => {
+      addRounds(queryClient, [round])
       queryClient.invalidateQueries({ queryKey: ['standings'] })
-      queryClient.invalidateQueries({ queryKey: ['rounds'] })
       queryClient.invalidateQueries({ queryKey: ['statistics'] })
       setScores({})
     },
@@ -1,13 +1,12 @@
 import { useQuery } from '@tanstack/react-query'
 import { useTranslation } from 'react-i18next'
-import { gameApi } from '../api/client'
+import { gameApi, avatarUrl } from '../api/client'
 
 export function Standings() {
   const { t } = useTranslation()
   const { data: players, isLoading } = useQuery({
     queryKey: ['standings'],
     queryFn: gameApi.standings,
-    refetchInterval: 5000,
   })
 
   if (isLoading) return <div className="p-4">Loading...</div>
@@ -25,7 +24,7 @@ export function Standings() {
             <span className="text-lg font-bold w-6">{i + 1}</span>
             {player.avatar_path ? (
               <img
-                src={`/static/avatars/${player.avatar_path}`}
+                src={avatarUrl(player.avatar_path, 128)}
                 alt={player.name}
                 className="w-10 h-10 rounded-full object-cover"
               />
@@ -9,6 +9,7 @@ const resources = {
       recordRound: 'Record Round',
       roundHistory: 'Round History',
       undoLast: 'Undo Last',
+      redoLast: 'Redo',
       statistics: 'Statistics',
       players: 'Players',
       diceRoller: 'Dice Roller',
@@ -69,6 +70,7 @@ const resources = {
       recordRound: '记录回合',
       roundHistory: '历史记录',
       undoLast: '撤销上一局',
+      redoLast: '重做',
       statistics: '统计',
       players: '玩家',
       diceRoller: '骰子',